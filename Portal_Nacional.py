@@ -2,29 +2,108 @@ import os
 import time
 import datetime
 import xml.etree.ElementTree as ET
-import pandas as pd
-from tqdm import tqdm
 import re
-import pdfplumber
 import calendar
 import threading
-
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.keys import Keys
+import queue
+import shutil
+import tempfile
+import multiprocessing
+import sys
+import select
+import struct
+import ctypes
+import json
+import gzip
+import base64
+import csv
+import logging
+import atexit
+from logging.handlers import RotatingFileHandler
+import argparse
+import cProfile
+import pstats
+from copy import copy
+from itertools import repeat, islice
+import sqlite3
+from contextlib import closing, contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from urllib.parse import unquote, urljoin, urlsplit, urlunsplit, parse_qsl, urlencode
+from html.parser import HTMLParser
 
 import customtkinter as ctk
 from tkinter import filedialog, messagebox
-from openpyxl import load_workbook
-from openpyxl.styles import Font, Alignment, PatternFill
-from openpyxl.utils import get_column_letter
 
-import velopack
+# ============================= IMPORTAÇÕES SOB DEMANDA =============================
+# selenium, requests, pandas, openpyxl e pyarrow levam segundos para importar no
+# executável do PyInstaller: a janela abre sem eles e cada grupo é importado na
+# primeira vez em que é usado (pdfplumber, só lido em Tomados, e velopack são
+# importados dentro das funções que os usam). Os nomes ficam globais, como se
+# tivessem sido importados aqui.
+
+webdriver = By = WebDriverWait = EC = Options = Service = Keys = TimeoutException = None
+requests = HTTPAdapter = None
+pd = Workbook = WriteOnlyCell = Font = Alignment = PatternFill = Border = Side = NamedStyle = None
+DEFAULT_FONT = get_column_letter = None
+pa = ds = pq = None
+_PYARROW_VERIFICADO = False
+_LOCK_IMPORTACOES = threading.RLock()
+
+def carregar_selenium():
+    global webdriver, By, WebDriverWait, EC, Options, Service, Keys, TimeoutException
+    with _LOCK_IMPORTACOES:
+        if webdriver is not None:
+            return
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.chrome.options import Options
+        from selenium.webdriver.chrome.service import Service
+        from selenium.webdriver.common.keys import Keys
+        from selenium.common.exceptions import TimeoutException
+        from selenium import webdriver
+
+def carregar_http():
+    global requests, HTTPAdapter
+    with _LOCK_IMPORTACOES:
+        if requests is not None:
+            return
+        from requests.adapters import HTTPAdapter
+        import requests
+
+def carregar_planilhas():
+    """pandas e openpyxl, para os relatórios."""
+    global pd, Workbook, WriteOnlyCell, Font, Alignment, PatternFill, Border, Side, NamedStyle, DEFAULT_FONT
+    global get_column_letter
+    with _LOCK_IMPORTACOES:
+        if pd is not None:
+            return
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font, Alignment, PatternFill, Border, Side, NamedStyle
+        from openpyxl.styles.fonts import DEFAULT_FONT
+        from openpyxl.utils import get_column_letter
+        import pandas as pd
+
+def carregar_pyarrow():
+    """Opcional: sem pyarrow o dataset consolidado (Parquet) simplesmente não é gravado. Devolve se há pyarrow."""
+    global pa, ds, pq, _PYARROW_VERIFICADO
+    with _LOCK_IMPORTACOES:
+        if not _PYARROW_VERIFICADO:
+            try:
+                import pyarrow.dataset as ds
+                import pyarrow.parquet as pq
+                import pyarrow as pa
+            except ImportError:
+                pa = ds = pq = None
+            _PYARROW_VERIFICADO = True
+        return pa is not None
 
 URL_PORTAL = "https://www.nfse.gov.br/EmissorNacional"
+URL_LISTA = {
+    'prestados': URL_PORTAL + "/Notas/Emitidas",
+    'tomados': URL_PORTAL + "/Notas/Recebidas",
+}
 
 # Modo global: 'prestados' ou 'tomados'
 MODO = 'prestados'
@@ -39,12 +118,83 @@ def get_defaults():
 PASTA_DOWNLOADS_DEFAULT, COMPETENCIA_DESEJADA_DEFAULT = get_defaults()
 TIMEOUT = 30
 
+# Motor de download: 'http' (sessão HTTP com os cookies do Chrome, em paralelo)
+# ou 'navegador' (driver.get em cada link, como antigamente)
+MOTOR_DOWNLOAD = 'http'
+DOWNLOAD_WORKERS = 8
+# Com o motor HTTP as páginas 2..N da lista são lidas pela sessão, por URL (?pg=N),
+# e até PAGINAS_PREFETCH páginas seguintes são buscadas enquanto os downloads rodam
+PAGINAS_PREFETCH = 2
+
+# Limites superiores (segundos) das esperas por condição
+TIMEOUT_PAGINA = 30          # recarga da tabela / troca de página
+TIMEOUT_ARQUIVO = 30         # conclusão de cada arquivo baixado pelo navegador
+TIMEOUT_DOWNLOADS = 60       # fim dos .crdownload pendentes
+INTERVALO_VERIFICACAO = 0.2  # intervalo entre verificações da pasta
+
+# Leitura de XMLs/PDFs nos relatórios: arquivos sem cache válido são lidos num
+# pool de processos quando passam do limite (PDF é bem mais caro que XML)
+PARSE_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+LIMITE_POOL_XML = 200
+LIMITE_POOL_PDF = 8
+# Fração superior da página do DANFSe lida primeiro (bloco do emitente/Simples)
+FRACAO_REGIAO_PDF = 0.45
+
+# Vários navegadores em paralelo (lista de empresas): cada um com perfil e
+# pasta de entrada próprios, pegando a próxima empresa da fila
+NAVEGADORES_PARALELOS = 3
+TIMEOUT_LOGIN = 300          # login manual (certificado) em cada navegador
+PASTA_ENTRADA = "_entrada"   # dentro da pasta de downloads, uma subpasta por navegador
+PREFIXO_PERFIS = "nfse_perfis_"  # perfis do Chrome num temporário próprio de cada processo
+# O Chrome fica aberto entre empresas (sessão limpa a cada uma) e só é reaberto
+# depois deste número de empresas ou se parar de responder
+EMPRESAS_POR_NAVEGADOR = 20
+
+# Distribuição por NSU (ADN - Ambiente de Dados Nacional): alternativa ao
+# Selenium que recebe os XMLs do contribuinte em lotes, a partir do último NSU
+# já recebido. Autenticação pelo certificado digital (PEM) informado no job
+URL_ADN = "https://adn.nfse.gov.br/contribuintes"
+URL_ADN_DANFSE = "https://adn.nfse.gov.br/danfse"
+DANFSE_POR_NSU = True        # baixa também o DANFSe de cada nota recebida
+PASTA_ADN = "adn"            # _entrada/adn/<CNPJ>/AAAA-MM: notas recebidas ainda não organizadas
+MAX_LOTES_NSU = 2000         # trava de segurança por empresa e execução
+
+# Métricas por empresa (JSON/CSV) e, opcionalmente, o cProfile da execução
+# ficam nesta subpasta da pasta de downloads
+PASTA_DESEMPENHO = "_desempenho"
+PERFILAR_EXECUCAO = False    # cProfile: --perfilar / "perfilar": true no job, ou a caixa na interface
+
+# Log da interface: as mensagens vão para uma fila que o mainloop do Tk esvazia
+# em lotes; a caixa de log guarda só as últimas linhas e o log completo vai
+# para um arquivo com rotação
+INTERVALO_LOG_MS = 100
+LOTE_LOG = 1000              # mensagens por esvaziamento da fila
+MAX_LINHAS_LOG = 3000
+PASTA_LOGS = os.path.join(os.environ.get("LOCALAPPDATA") or tempfile.gettempdir(), "NFSe Portal Nacional", "logs")
+TAMANHO_ARQUIVO_LOG = 5 * 2**20
+ARQUIVOS_LOG_ANTIGOS = 5
+
+# Dataset consolidado (Parquet) com todas as notas lidas, dentro da pasta de downloads:
+# _dataset/modo=.../competencia=AAAA-MM/cnpj=.../notas.parquet
+PASTA_DATASET = "_dataset"
+
+# Empresas com mais XMLs que isto geram o relatório em fluxo: XMLs lidos em
+# lotes, linhas ordenadas numa base SQLite temporária e gravadas direto na
+# planilha, com a memória limitada qualquer que seja o número de notas
+LIMITE_RELATORIO_EM_FLUXO = 20000
+LOTE_RELATORIO_EM_FLUXO = 2000
+
+# Formatação da planilha dos relatórios
+LARGURA_COLUNA_RELATORIO = 15.43
+ALTURA_LINHA_RELATORIO = 17.25
+
 # ============================= FUNÇÕES AUXILIARES =============================
 
-def criar_driver(headless=False):
+def criar_driver(headless=False, pasta=None, perfil=None):
+    carregar_selenium()
     chrome_options = Options()
     prefs = {
-        "download.default_directory": os.path.abspath(PASTA_DOWNLOADS),
+        "download.default_directory": os.path.abspath(pasta or PASTA_DOWNLOADS),
         "download.prompt_for_download": False,
         "download.directory_upgrade": True,
         "safebrowsing.enabled": True,
@@ -54,23 +204,405 @@ def criar_driver(headless=False):
     chrome_options.add_argument("--disable-blink-features=AutomationControlled")
     if headless:
         chrome_options.add_argument("--headless=new")
-
-    # ✅ SEM Service/ChromeDriverManager (Selenium Manager resolve)
-    driver = webdriver.Chrome(options=chrome_options)
+    if perfil:
+        chrome_options.add_argument(f"--user-data-dir={os.path.abspath(perfil)}")
+
+    # ✅ SEM ChromeDriverManager: o Selenium Manager resolve o chromedriver na
+    # primeira vez e o caminho fica guardado para os próximos navegadores
+    with _LOCK_CHROMEDRIVER:
+        caminho = _CAMINHO_CHROMEDRIVER[0] if _CAMINHO_CHROMEDRIVER and os.path.isfile(_CAMINHO_CHROMEDRIVER[0]) else None
+    driver = webdriver.Chrome(options=chrome_options, service=Service(executable_path=caminho) if caminho else None)
+    if not caminho and driver.service.path:
+        with _LOCK_CHROMEDRIVER:
+            _CAMINHO_CHROMEDRIVER[:] = [driver.service.path]
     driver.maximize_window()
     return driver
 
-def aguardar_downloads(pasta, timeout=30, log_fn=print):
+_CAMINHO_CHROMEDRIVER = []
+_LOCK_CHROMEDRIVER = threading.Lock()
+
+# ============================= NAVEGADOR REUTILIZADO =============================
+# Abrir o Chrome custa alguns segundos por empresa. O navegador fica aberto e
+# cada empresa ganha um contexto de navegação novo (como uma janela anônima:
+# cookies, cache, armazenamento e o certificado escolhido no login ficam
+# isolados); o contexto da empresa anterior é descartado. O Chrome só é reaberto
+# depois de EMPRESAS_POR_NAVEGADOR empresas ou quando deixa de responder.
+
+_PASTA_PERFIS = None
+_LOCK_PERFIS = threading.Lock()
+
+def pasta_perfis():
+    """
+    Raiz dos perfis do Chrome deste processo, criada na primeira vez e apagada
+    na saída: duas instâncias abertas (Prestados e Tomados) não apagam os
+    perfis uma da outra.
+    """
+    global _PASTA_PERFIS
+    with _LOCK_PERFIS:
+        if _PASTA_PERFIS is None:
+            _PASTA_PERFIS = tempfile.mkdtemp(prefix=PREFIXO_PERFIS)
+            atexit.register(shutil.rmtree, _PASTA_PERFIS, True)
+        return _PASTA_PERFIS
+
+class NavegadorReutilizado:
+    def __init__(self, pasta, perfil=None, headless=False, limite=EMPRESAS_POR_NAVEGADOR, log_fn=print):
+        self.pasta = pasta
+        self.perfil = perfil
+        self.headless = headless
+        self.limite = limite
+        self.log_fn = log_fn
+        self.driver = None
+        self.contexto = None
+        self.empresas = 0
+        self._abrindo = None
+        self._erro_abertura = None
+
+    def aquecer(self):
+        """Abre o Chrome em segundo plano para a primeira empresa não esperar por ele."""
+        if self.driver is None and self._abrindo is None:
+            self._abrindo = threading.Thread(target=self._abrir_em_segundo_plano, daemon=True)
+            self._abrindo.start()
+        return self
+
+    def _abrir_em_segundo_plano(self):
+        try:
+            self._abrir()
+        except Exception as e:
+            self._erro_abertura = e
+
+    def _abrir(self):
+        if self.perfil:
+            # Perfil limpo a cada abertura: nada da execução anterior sobrevive
+            shutil.rmtree(self.perfil, ignore_errors=True)
+        self.driver = criar_driver(headless=self.headless, pasta=self.pasta, perfil=self.perfil)
+        self.contexto = None
+        self.empresas = 0
+
+    def saudavel(self):
+        try:
+            self.driver.execute_script("return 1;")
+            return bool(self.driver.window_handles)
+        except:
+            return False
+
+    def sessao_limpa(self, pasta=None):
+        """Driver pronto para a próxima empresa: em about:blank, sem nada da sessão anterior."""
+        if self._abrindo is not None:
+            self._abrindo.join()
+            self._abrindo = None
+            if self._erro_abertura is not None:
+                erro, self._erro_abertura = self._erro_abertura, None
+                raise erro
+        if pasta and os.path.abspath(pasta) != os.path.abspath(self.pasta):
+            self.pasta = pasta
+            self.fechar()
+        if self.driver is not None and (self.empresas >= self.limite or not self.saudavel()):
+            motivo = "limite de empresas" if self.empresas >= self.limite else "sem resposta"
+            self.log_fn(f"Reabrindo o navegador ({motivo})")
+            self.fechar()
+        if self.driver is None:
+            self._abrir()
+        elif self.empresas:
+            try:
+                self._trocar_contexto()
+            except Exception as e:
+                self.log_fn(f"Não foi possível limpar a sessão ({str(e)[:80]}); reabrindo o navegador")
+                self.fechar()
+                self._abrir()
+        self.empresas += 1
+        contar("navegadores reutilizados" if self.empresas > 1 else "navegadores abertos")
+        return self.driver
+
+    def _trocar_contexto(self):
+        driver = self.driver
+        antigas = driver.window_handles
+        anterior = self.contexto
+        self.contexto = driver.execute_cdp_cmd("Target.createBrowserContext", {})["browserContextId"]
+        driver.execute_cdp_cmd("Target.createTarget", {"url": "about:blank", "browserContextId": self.contexto})
+        nova = next(h for h in driver.window_handles if h not in antigas)
+        for handle in antigas:
+            driver.switch_to.window(handle)
+            driver.close()
+        driver.switch_to.window(nova)
+        if anterior:
+            driver.execute_cdp_cmd("Target.disposeBrowserContext", {"browserContextId": anterior})
+        # As preferências de download do perfil não valem no contexto novo
+        driver.execute_cdp_cmd("Browser.setDownloadBehavior", {
+            "behavior": "allow", "downloadPath": os.path.abspath(self.pasta), "browserContextId": self.contexto})
+        if not self.headless:
+            driver.maximize_window()
+
+    def fechar(self):
+        if self._abrindo is not None:
+            self._abrindo.join()
+            self._abrindo = None
+            self._erro_abertura = None
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except:
+                pass
+        self.driver = None
+        self.contexto = None
+        self.empresas = 0
+
+# ============================= TEMPOS POR FASE =============================
+# Cada fase soma no total da execução (TEMPOS_FASES) e no perfil da empresa
+# ativo na thread (perfil_ativo). Fases podem se sobrepor: "downloads" inclui
+# os "download da nota" de cada nota, que por sua vez correm em paralelo.
+TEMPOS_FASES = {}  # fase -> [segundos acumulados, ocorrências]
+CONTADORES = {}    # contador -> total
+_LOCK_TEMPOS = threading.Lock()
+_PERFIL_DA_THREAD = threading.local()
+
+def novo_perfil(cnpj=None, nome=None):
+    return {'cnpj': cnpj, 'nome': nome, 'inicio': datetime.datetime.now(), 'fases': {}, 'contadores': {}}
+
+@contextmanager
+def perfil_ativo(perfil):
+    """Faz medir_fase/contar desta thread também irem para o perfil da empresa."""
+    anterior = getattr(_PERFIL_DA_THREAD, 'perfil', None)
+    _PERFIL_DA_THREAD.perfil = perfil
+    try:
+        yield perfil
+    finally:
+        _PERFIL_DA_THREAD.perfil = anterior
+
+def perfil_atual():
+    return getattr(_PERFIL_DA_THREAD, 'perfil', None)
+
+@contextmanager
+def medir_fase(fase, perfil=None):
+    """`perfil` só precisa ser passado por threads de pool, que não herdam o perfil ativo."""
+    perfil = perfil if perfil is not None else perfil_atual()
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        decorrido = time.perf_counter() - inicio
+        with _LOCK_TEMPOS:
+            acumulado = TEMPOS_FASES.setdefault(fase, [0.0, 0])
+            acumulado[0] += decorrido
+            acumulado[1] += 1
+            if perfil is not None:
+                da_empresa = perfil['fases'].setdefault(fase, [0.0, 0, 0.0])
+                da_empresa[0] += decorrido
+                da_empresa[1] += 1
+                da_empresa[2] = max(da_empresa[2], decorrido)
+
+def contar(contador, n=1, perfil=None):
+    perfil = perfil if perfil is not None else perfil_atual()
+    with _LOCK_TEMPOS:
+        CONTADORES[contador] = CONTADORES.get(contador, 0) + n
+        if perfil is not None:
+            perfil['contadores'][contador] = perfil['contadores'].get(contador, 0) + n
+
+def zerar_tempos():
+    with _LOCK_TEMPOS:
+        TEMPOS_FASES.clear()
+        CONTADORES.clear()
+
+def resumo_tempos(log_fn=print):
+    with _LOCK_TEMPOS:
+        fases = sorted(TEMPOS_FASES.items(), key=lambda kv: kv[1][0], reverse=True)
+        contadores = sorted(CONTADORES.items())
+    if not fases:
+        return
+    log_fn("Tempo por fase:")
+    for fase, (total, n) in fases:
+        log_fn(f"  {fase:<28} {total:9.2f} s  ({n}x, média {total / n:.2f} s)")
+    if contadores:
+        log_fn("Contadores: " + " | ".join(f"{nome}: {n}" for nome, n in contadores))
+
+def exportar_perfil(pasta_base, perfil, competencia_str, log_fn=print):
+    """Grava o perfil da empresa em _desempenho/ como JSON e como CSV (uma linha por fase/contador)."""
+    fim = datetime.datetime.now()
+    with _LOCK_TEMPOS:
+        fases = {fase: {'segundos': round(total, 3), 'vezes': n, 'maximo_s': round(maximo, 3)}
+                 for fase, (total, n, maximo) in sorted(perfil['fases'].items(), key=lambda kv: -kv[1][0])}
+        contadores = dict(sorted(perfil['contadores'].items()))
+    dados = {
+        'cnpj': perfil['cnpj'], 'nome': perfil['nome'], 'modo': MODO, 'competencia': competencia_str,
+        'inicio': perfil['inicio'].isoformat(timespec='seconds'), 'fim': fim.isoformat(timespec='seconds'),
+        'duracao_s': round((fim - perfil['inicio']).total_seconds(), 3),
+        'fases': fases, 'contadores': contadores,
+    }
+    pasta = os.path.join(pasta_base, PASTA_DESEMPENHO)
+    os.makedirs(pasta, exist_ok=True)
+    base = os.path.join(pasta, f"{MODO}_{perfil['cnpj'] or 'empresa'}_{perfil['inicio']:%Y%m%d_%H%M%S}")
+    with open(base + ".json", 'w', encoding='utf-8') as f:
+        json.dump(dados, f, ensure_ascii=False, indent=2)
+    with open(base + ".csv", 'w', encoding='utf-8-sig', newline='') as f:
+        w = csv.writer(f, delimiter=';')
+        w.writerow(['tipo', 'nome', 'valor', 'vezes', 'maximo_s'])
+        w.writerow(['total', 'duracao_s', dados['duracao_s'], '', ''])
+        for fase, t in fases.items():
+            w.writerow(['fase', fase, t['segundos'], t['vezes'], t['maximo_s']])
+        for nome, n in contadores.items():
+            w.writerow(['contador', nome, n, '', ''])
+    log_fn(f"Desempenho: {base}.json")
+    return base + ".json"
+
+# ============================= CPROFILE (OPCIONAL) =============================
+_CPROFILES = []
+
+@contextmanager
+def perfilar_thread():
+    """Com PERFILAR_EXECUCAO, roda o bloco sob cProfile; os perfis das threads são somados em salvar_cprofile."""
+    if not PERFILAR_EXECUCAO:
+        yield
+        return
+    perfil = cProfile.Profile()
+    try:
+        perfil.enable()
+    except ValueError:
+        # Python 3.12+: um profiler por vez, e o que já está ativo enxerga todas as threads
+        perfil = None
+    try:
+        yield
+    finally:
+        if perfil is not None:
+            perfil.disable()
+            with _LOCK_TEMPOS:
+                _CPROFILES.append(perfil)
+
+def salvar_cprofile(pasta_base, log_fn=print):
+    with _LOCK_TEMPOS:
+        perfis = list(_CPROFILES)
+        _CPROFILES.clear()
+    if not perfis:
+        return None
+    stats = pstats.Stats(perfis[0])
+    for perfil in perfis[1:]:
+        stats.add(perfil)
+    pasta = os.path.join(pasta_base, PASTA_DESEMPENHO)
+    os.makedirs(pasta, exist_ok=True)
+    base = os.path.join(pasta, f"cprofile_{MODO}_{datetime.datetime.now():%Y%m%d_%H%M%S}")
+    stats.dump_stats(base + ".prof")
+    with open(base + ".txt", 'w', encoding='utf-8') as f:
+        pstats.Stats(base + ".prof", stream=f).sort_stats('cumulative').print_stats(60)
+    log_fn(f"cProfile: {base}.prof (resumo em {os.path.basename(base)}.txt)")
+    return base + ".prof"
+
+def aguardar_downloads(pasta, timeout=TIMEOUT_DOWNLOADS, log_fn=print):
     log_fn("Aguardando downloads terminarem...")
-    start = time.time()
-    while time.time() - start < timeout:
+    limite = time.monotonic() + timeout
+    while True:
         if not any(f.endswith('.crdownload') for f in os.listdir(pasta)):
-            time.sleep(2.5)
-            if not any(f.endswith('.crdownload') for f in os.listdir(pasta)):
-                log_fn("Downloads concluídos.")
-                return
-        time.sleep(2.5)
+            log_fn("Downloads concluídos.")
+            return True
+        if time.monotonic() >= limite:
+            break
+        time.sleep(INTERVALO_VERIFICACAO)
     log_fn("Timeout aguardando downloads; seguindo mesmo assim.")
+    return False
+
+# ============================= OBSERVADOR DE DOWNLOADS =============================
+class ObservadorDownloads:
+    """
+    Acompanha a pasta de downloads e publica cada arquivo concluído pelo nome
+    final. O Chrome grava em .crdownload e renomeia ao terminar (o motor HTTP faz
+    o mesmo com .part), então o aparecimento do nome final marca o fim do download.
+    Usa inotify no Linux e, nos demais sistemas, uma varredura leve da pasta.
+    """
+    EXTENSOES_PARCIAIS = ('.crdownload', '.part', '.tmp')
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+
+    def __init__(self, pasta, intervalo=INTERVALO_VERIFICACAO):
+        self.pasta = pasta
+        self.intervalo = intervalo
+        self._concluidos = []
+        self._cond = threading.Condition()
+        self._parar = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.iniciar()
+        return self
+
+    def __exit__(self, *exc):
+        self.parar()
+
+    def iniciar(self):
+        fd = self._abrir_inotify() if sys.platform.startswith('linux') else None
+        if fd is not None:
+            alvo = self._loop_inotify
+            args = (fd,)
+        else:
+            alvo = self._loop_varredura
+            args = (set(os.listdir(self.pasta)),)
+        self._thread = threading.Thread(target=alvo, args=args, daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        if self._thread:
+            self._thread.join()
+
+    def aguardar_proximo(self, extensoes, timeout=TIMEOUT_ARQUIVO):
+        """Retorna o nome do próximo arquivo concluído com uma das extensões, ou None."""
+        extensoes = tuple(e.lower() for e in extensoes)
+        with self._cond:
+            achou = self._cond.wait_for(
+                lambda: any(n.lower().endswith(extensoes) for n in self._concluidos), timeout)
+            if not achou:
+                return None
+            for i, nome in enumerate(self._concluidos):
+                if nome.lower().endswith(extensoes):
+                    return self._concluidos.pop(i)
+
+    def _publicar(self, nome):
+        if nome.lower().endswith(self.EXTENSOES_PARCIAIS):
+            return
+        with self._cond:
+            self._concluidos.append(nome)
+            self._cond.notify_all()
+
+    def _abrir_inotify(self):
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return None
+            mascara = self.IN_CLOSE_WRITE | self.IN_MOVED_TO
+            if libc.inotify_add_watch(fd, os.fsencode(os.path.abspath(self.pasta)), mascara) < 0:
+                os.close(fd)
+                return None
+            return fd
+        except (OSError, AttributeError):
+            return None
+
+    def _loop_inotify(self, fd):
+        cabecalho = struct.calcsize('iIII')
+        try:
+            while not self._parar.is_set():
+                prontos, _, _ = select.select([fd], [], [], self.intervalo)
+                if not prontos:
+                    continue
+                try:
+                    dados = os.read(fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                pos = 0
+                while pos + cabecalho <= len(dados):
+                    _, _, _, tamanho = struct.unpack_from('iIII', dados, pos)
+                    nome = dados[pos + cabecalho:pos + cabecalho + tamanho].rstrip(b'\0')
+                    pos += cabecalho + tamanho
+                    if nome:
+                        self._publicar(os.fsdecode(nome))
+        finally:
+            os.close(fd)
+
+    def _loop_varredura(self, conhecidos):
+        while not self._parar.wait(self.intervalo):
+            try:
+                atuais = set(os.listdir(self.pasta))
+            except OSError:
+                continue
+            for nome in sorted(atuais - conhecidos):
+                self._publicar(nome)
+            conhecidos = atuais
 
 def parse_competencia_str(comp_str):
     try:
@@ -79,112 +611,314 @@ def parse_competencia_str(comp_str):
     except:
         return None, None
 
+# Competência única ("11/2025") ou intervalo ("09/2025-11/2025", "09/2025 a 11/2025")
+RE_INTERVALO_COMPETENCIA = re.compile(r"^\s*(\d{1,2}/\d{4})\s*(?:-|a|até)\s*(\d{1,2}/\d{4})\s*$", re.IGNORECASE)
+
+def limites_competencia(comp_str):
+    """'MM/AAAA' ou 'MM/AAAA-MM/AAAA' -> ((ano, mes) inicial, (ano, mes) final); None se inválida."""
+    m = RE_INTERVALO_COMPETENCIA.match(comp_str or "")
+    inicio, fim = (m.group(1), m.group(2)) if m else (comp_str, comp_str)
+    inicio, fim = parse_competencia_str(inicio), parse_competencia_str(fim)
+    if None in inicio or None in fim or not (1 <= inicio[1] <= 12 and 1 <= fim[1] <= 12) or inicio > fim:
+        return None
+    return inicio, fim
+
+def meses_da_competencia(comp_str):
+    """Todos os meses do intervalo, em ordem, como 'MM/AAAA'."""
+    limites = limites_competencia(comp_str)
+    if not limites:
+        return []
+    (ano, mes), fim = limites
+    meses = []
+    while (ano, mes) <= fim:
+        meses.append(f"{mes:02d}/{ano}")
+        ano, mes = (ano, mes + 1) if mes < 12 else (ano + 1, 1)
+    return meses
+
+def competencia_da_nota(data_str, comp_str):
+    """
+    Mês do intervalo (MM/AAAA) em que a nota entra: o da própria data, limitado
+    ao primeiro/último mês do intervalo (notas sem data vão para o último).
+    """
+    meses = meses_da_competencia(comp_str)
+    if len(meses) <= 1:
+        return comp_str
+    try:
+        dt = datetime.datetime.strptime(data_str.strip(), "%d/%m/%Y").date()
+    except:
+        return meses[-1]
+    mes_nota = f"{dt.month:02d}/{dt.year}"
+    if mes_nota in meses:
+        return mes_nota
+    return meses[0] if (dt.year, dt.month) < limites_competencia(comp_str)[0] else meses[-1]
+
 def mesma_competencia(data_str, comp_str):
     try:
         dt = datetime.datetime.strptime(data_str.strip(), "%d/%m/%Y").date()
-        ano_c, mes_c = parse_competencia_str(comp_str)
-        return dt.year == ano_c and dt.month == mes_c
+        inicio, fim = limites_competencia(comp_str)
+        return inicio <= (dt.year, dt.month) <= fim
     except:
         return False
 
 def emissao_anterior_competencia(data_str, comp_str):
     try:
         dt = datetime.datetime.strptime(data_str.strip(), "%d/%m/%Y").date()
-        ano_c, mes_c = parse_competencia_str(comp_str)
-        return dt.year < ano_c or (dt.year == ano_c and dt.month < mes_c)
+        inicio, _ = limites_competencia(comp_str)
+        return (dt.year, dt.month) < inicio
     except:
         return False
 
-def obter_situacao_e_numero_da_linha(linha):
-    situacao = ""
-    numero_nota = ""
-    try:
-        img = linha.find_element(By.XPATH, ".//img[contains(@src,'tb-cancelada.svg') or contains(@src,'tb-gerada.svg')]")
-        src = img.get_attribute("src") or ""
-        if "tb-cancelada" in src:
-            situacao = "Cancelada"
-        elif "tb-gerada" in src:
-            situacao = "Autorizada"
-    except Exception:
-        pass
-    try:
-        td_num = linha.find_element(By.XPATH, ".//td[contains(@class,'td-numero')]")
-        numero_nota = td_num.text.strip()
-    except Exception:
-        try:
-            tds = linha.find_elements(By.TAG_NAME, "td")
-            for td in tds:
-                txt = td.text.strip()
-                if txt.isdigit():
-                    numero_nota = txt
-                    break
-        except Exception:
-            pass
-    return situacao, numero_nota
+# Extração em lote: uma única chamada ao chromedriver por página devolve a
+# tabela inteira como registros simples, em vez de vários find_element por linha.
+JS_EXTRAIR_LINHAS = r"""
+var classeData = arguments[0];
+var registros = [];
+var linhas = document.querySelectorAll('table tbody tr');
+for (var i = 0; i < linhas.length; i++) {
+    var tr = linhas[i];
+    var tds = tr.querySelectorAll('td');
+    if (!tds.length) continue;
+    var tdData = tr.querySelector('td[class*="' + classeData + '"]');
+    var tdNum = tr.querySelector('td[class*="td-numero"]');
+    var numero = tdNum ? tdNum.innerText.trim() : '';
+    if (!tdNum) {
+        for (var j = 0; j < tds.length; j++) {
+            var txt = tds[j].innerText.trim();
+            if (/^\d+$/.test(txt)) { numero = txt; break; }
+        }
+    }
+    var img = tr.querySelector('img[src*="tb-cancelada.svg"], img[src*="tb-gerada.svg"]');
+    var aXml = tr.querySelector('a[href*="Download/NFSe/"]');
+    var aPdf = tr.querySelector('a[href*="Download/DANFSe/"]');
+    registros.push({
+        indice: registros.length,
+        data: tdData ? tdData.innerText.trim() : null,
+        numero: numero,
+        status: img ? (img.src || '') : '',
+        href_xml: aXml ? aXml.href : null,
+        href_pdf: aPdf ? aPdf.href : null,
+        menu: !!tr.querySelector('i[class*="glyphicon-option-vertical"]')
+    });
+}
+return registros;
+"""
+
+JS_CLICAR_MENU_DA_LINHA = r"""
+var tr = Array.prototype.filter.call(document.querySelectorAll('table tbody tr'),
+    function (tr) { return tr.querySelector('td'); })[arguments[0]];
+tr.querySelector('i[class*="glyphicon-option-vertical"]').click();
+"""
+
+JS_LINKS_DA_LINHA = r"""
+var tr = Array.prototype.filter.call(document.querySelectorAll('table tbody tr'),
+    function (tr) { return tr.querySelector('td'); })[arguments[0]];
+var aXml = tr.querySelector('a[href*="Download/NFSe/"]');
+if (!aXml) return null;
+var aPdf = tr.querySelector('a[href*="Download/DANFSe/"]');
+return [aXml.href, aPdf ? aPdf.href : null];
+"""
+
+def extrair_linhas_da_pagina(driver):
+    classe_data = 'td-datahora' if MODO == 'tomados' else 'td-data'
+    return driver.execute_script(JS_EXTRAIR_LINHAS, classe_data) or []
+
+def situacao_do_icone(src):
+    if "tb-cancelada" in src:
+        return "Cancelada"
+    if "tb-gerada" in src:
+        return "Autorizada"
+    return ""
+
+def selecionar_nota(registro, num, comp, situacoes_dict, log_fn):
+    """
+    Aplica o filtro de competência a um registro de extrair_linhas_da_pagina.
+    Retorna o registro da nota, False (fora da competência/falha) ou "ANTERIOR".
+    """
+    if not registro.get('data'):
+        log_fn(f"Linha {num}: FALHA → data de emissão não encontrada")
+        return False
+    data_emissao = registro['data'].split()[0]  # Extrair apenas a parte da data
+    # Converter ano de 2 dígitos para 4 dígitos
+    partes = data_emissao.split('/')
+    if len(partes) == 3 and len(partes[2]) == 2:
+        partes[2] = '20' + partes[2]
+        data_emissao = '/'.join(partes)
+    situacao = situacao_do_icone(registro.get('status') or "")
+    numero = registro.get('numero') or ""
+    if numero:
+        situacoes_dict[numero] = situacao
+
+    if not mesma_competencia(data_emissao, comp):
+        log_fn(f"Linha {num}: Ignorada → {data_emissao}")
+        if emissao_anterior_competencia(data_emissao, comp):
+            return "ANTERIOR"
+        return False
 
-def baixar_xml_da_linha(driver, linha, num, comp, situacoes_dict, log_fn):
-    try:
-        datahora_class = 'td-datahora' if MODO == 'tomados' else 'td-data'
-        data_emissao_raw = linha.find_element(By.XPATH, f".//td[contains(@class,'{datahora_class}')]").text.strip()
-        data_emissao = data_emissao_raw.split()[0]  # Extrair apenas a parte da data
-        # Converter ano de 2 dígitos para 4 dígitos
-        partes = data_emissao.split('/')
-        if len(partes) == 3 and len(partes[2]) == 2:
-            partes[2] = '20' + partes[2]
-            data_emissao = '/'.join(partes)
-        situacao, numero = obter_situacao_e_numero_da_linha(linha)
-        if numero:
-            situacoes_dict[numero] = situacao
-
-        if not mesma_competencia(data_emissao, comp):
-            log_fn(f"Linha {num}: Ignorada → {data_emissao}")
-            if emissao_anterior_competencia(data_emissao, comp):
-                return "ANTERIOR"
-            return False
+    return {
+        'num': num,
+        'indice': registro['indice'],
+        'data_emissao': data_emissao,
+        'situacao': situacao,
+        'numero': numero,
+        'href_xml': registro.get('href_xml'),
+        'href_pdf': registro.get('href_pdf'),
+        'menu': registro.get('menu', False),
+    }
 
-        # Clicar no menu apenas para Tomados
-        if MODO == 'tomados':
-            linha.find_element(By.XPATH, ".//i[contains(@class,'glyphicon-option-vertical')]").click()
-            time.sleep(0.5)
+def revelar_links_da_nota(driver, nota):
+    """Em Tomados os links podem só entrar no DOM depois de abrir o menu da linha."""
+    if nota['href_xml'] or not nota['menu']:
+        return
+    driver.execute_script(JS_CLICAR_MENU_DA_LINHA, nota['indice'])
+    nota['href_xml'], nota['href_pdf'] = WebDriverWait(driver, TIMEOUT).until(
+        lambda d: d.execute_script(JS_LINKS_DA_LINHA, nota['indice']))
+
+def baixar_nota_navegador(driver, nota, observador, log_fn):
+    with medir_fase("download da nota"):
+        return _baixar_nota_navegador(driver, nota, observador, log_fn)
+
+def _baixar_nota_navegador(driver, nota, observador, log_fn):
+    num = nota['num']
+    driver.get(nota['href_xml'])
+    novo_xml = observador.aguardar_proximo(('.xml',))
+    if novo_xml:
+        SITUACOES_POR_ARQUIVO[novo_xml] = nota['situacao']
+        nota['arquivo_xml'] = novo_xml
+
+    if nota['href_pdf']:
+        driver.get(nota['href_pdf'])
+        novo_pdf = observador.aguardar_proximo(('.pdf',))
+        if novo_xml and novo_pdf:
+            PDF_POR_ARQUIVO[novo_xml] = novo_pdf
+    else:
+        log_fn(f"PDF ignorado na linha {num}? Não encontrado.")
+
+    log_fn(f"Linha {num}: BAIXADO → {nota['data_emissao']} | {nota['situacao']} | Nº {nota['numero']}")
+    return True
+
+# ============================= DOWNLOAD DIRETO VIA HTTP =============================
+# Os links Download/NFSe/ e Download/DANFSe/ só exigem a sessão autenticada do
+# portal: copiamos os cookies do Chrome para uma sessão HTTP com pool de conexões
+# e baixamos as notas da página em paralelo, gravando cada arquivo com nome conhecido.
+
+RE_FILENAME = re.compile(r"filename\*?=(?:UTF-8'')?\"?([^\";]+)\"?", re.IGNORECASE)
+
+def criar_sessao_http(driver):
+    carregar_http()
+    sessao = requests.Session()
+    adapter = HTTPAdapter(pool_connections=DOWNLOAD_WORKERS, pool_maxsize=DOWNLOAD_WORKERS, max_retries=2)
+    sessao.mount("https://", adapter)
+    sessao.mount("http://", adapter)
+    sessao.headers["User-Agent"] = driver.execute_script("return navigator.userAgent;")
+    atualizar_cookies_sessao(sessao, driver)
+    return sessao
+
+def atualizar_cookies_sessao(sessao, driver):
+    for c in driver.get_cookies():
+        sessao.cookies.set(c["name"], c["value"], domain=c.get("domain"), path=c.get("path", "/"))
+    sessao.headers["Referer"] = driver.current_url
+
+def nome_arquivo_da_resposta(resp, href, extensao):
+    m = RE_FILENAME.search(resp.headers.get("Content-Disposition", ""))
+    if m:
+        nome = os.path.basename(unquote(m.group(1)).strip())
+    else:
+        nome = href.split('?')[0].rstrip('/').split('/')[-1]
+    nome = limpar_nome_empresa(nome)
+    if not nome.lower().endswith(extensao):
+        nome += extensao
+    return nome
+
+LOCK_DOWNLOAD_HTTP = threading.Lock()
+
+def nome_livre(pasta, nome):
+    """`nome`, ou `nome (1)`, `nome (2)`... como o Chrome, se o arquivo já existe na pasta."""
+    base, ext = os.path.splitext(nome)
+    n = 0
+    while os.path.exists(os.path.join(pasta, nome)):
+        n += 1
+        nome = f"{base} ({n}){ext}"
+    return nome
+
+def baixar_arquivo_http(sessao, href, pasta, extensao):
+    with sessao.get(href, stream=True, timeout=TIMEOUT) as resp:
+        resp.raise_for_status()
+        # Sessão expirada devolve a página de login em vez do arquivo
+        if 'text/html' in resp.headers.get('Content-Type', ''):
+            raise RuntimeError("portal devolveu HTML em vez do arquivo (sessão expirada?)")
+        nome = nome_arquivo_da_resposta(resp, href, extensao)
+        # Duas linhas podem trazer o mesmo nome (ex.: mesmo número de emitentes
+        # diferentes em Tomados): cada download grava no seu próprio .part e o nome
+        # final é escolhido sob o lock, sem sobrescrever o arquivo do outro
+        descritor, parcial = tempfile.mkstemp(prefix=nome + ".", suffix=".part", dir=pasta)
+        try:
+            with os.fdopen(descritor, 'wb') as f:
+                for bloco in resp.iter_content(64 * 1024):
+                    f.write(bloco)
+            with LOCK_DOWNLOAD_HTTP:
+                nome = nome_livre(pasta, nome)
+                os.replace(parcial, os.path.join(pasta, nome))
+        except BaseException:
+            try: os.remove(parcial)
+            except OSError: pass
+            raise
+    return nome
+
+def baixar_notas_http(driver, sessao, notas, pasta, log_fn=print):
+    """Baixa XML + DANFSe de cada nota em paralelo; falhas caem para o navegador."""
+    perfil = perfil_atual()
+
+    def baixar(nota):
+        with medir_fase("download da nota", perfil):
+            nome_xml = baixar_arquivo_http(sessao, nota['href_xml'], pasta, '.xml')
+            nome_pdf = None
+            if nota['href_pdf']:
+                try:
+                    nome_pdf = baixar_arquivo_http(sessao, nota['href_pdf'], pasta, '.pdf')
+                except Exception as e_pdf:
+                    log_fn(f"PDF ignorado na linha {nota['num']}? {str(e_pdf)[:80]}")
+            return nome_xml, nome_pdf
 
-        antes_xml = set(os.listdir(PASTA_DOWNLOADS))
-        driver.get(linha.find_element(By.XPATH, ".//a[contains(@href,'Download/NFSe/')]").get_attribute("href"))
-        aguardar_downloads(PASTA_DOWNLOADS, timeout=0.1)
-        novos_xml = [f for f in os.listdir(PASTA_DOWNLOADS) if f.lower().endswith('.xml') and f not in antes_xml]
-        if novos_xml:
-            SITUACOES_POR_ARQUIVO[novos_xml[0]] = situacao
+    baixadas = 0
+    falhas = []
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+        futuros = [(nota, pool.submit(baixar, nota)) for nota in notas]
+        for nota, futuro in futuros:
+            try:
+                nome_xml, nome_pdf = futuro.result()
+            except Exception as e:
+                log_fn(f"Linha {nota['num']}: download HTTP falhou ({str(e)[:80]}); tentando pelo navegador")
+                falhas.append(nota)
+                continue
+            SITUACOES_POR_ARQUIVO[nome_xml] = nota['situacao']
+            nota['arquivo_xml'] = nome_xml
+            if nome_pdf:
+                PDF_POR_ARQUIVO[nome_xml] = nome_pdf
+            log_fn(f"Linha {nota['num']}: BAIXADO → {nota['data_emissao']} | {nota['situacao']} | Nº {nota['numero']}")
+            baixadas += 1
 
+    # Só com o pool encerrado: o observador tomaria por seus os arquivos que os
+    # outros downloads ainda estivessem gravando na mesma pasta
+    for nota in falhas:
         try:
-            antes_pdf = set(os.listdir(PASTA_DOWNLOADS))
-            link_pdf_elt = linha.find_element(By.XPATH, ".//a[contains(@href,'Download/DANFSe/')]")
-            driver.get(link_pdf_elt.get_attribute("href"))
-            aguardar_downloads(PASTA_DOWNLOADS, timeout=0.5)
-            novos_pdf = [f for f in os.listdir(PASTA_DOWNLOADS) if f.lower().endswith('.pdf') and f not in antes_pdf]
-            if novos_xml and novos_pdf:
-                PDF_POR_ARQUIVO[novos_xml[0]] = novos_pdf[0]
-        except Exception as e_pdf:
-            log_fn(f"PDF ignorado na linha {num}? Não encontrado: {str(e_pdf)[:80]}")
-            pass
-
-        log_fn(f"Linha {num}: BAIXADO → {data_emissao} | {situacao} | Nº {numero}")
-        return True
-    except Exception as e:
-        log_fn(f"Linha {num}: FALHA → {str(e)[:100]}")
-        return False
+            with ObservadorDownloads(pasta) as observador:
+                baixar_nota_navegador(driver, nota, observador, log_fn)
+            baixadas += 1
+        except Exception as e_nav:
+            log_fn(f"Linha {nota['num']}: FALHA → {str(e_nav)[:100]}")
+    return baixadas
 
 def aplicar_filtro_por_competencia(driver, competencia_str, log_fn=print):
     """
     Preenche os campos:
-    - datainicio = 01/MM/AAAA
-    - datafim    = último dia do mês (28/29/30/31 conforme mês/ano)
+    - datainicio = 01/MM/AAAA (primeiro mês do intervalo)
+    - datafim    = último dia do mês (28/29/30/31 conforme mês/ano; último mês do intervalo)
     e clica no botão Filtrar.
     Depois, espera a "mini recarga" terminar.
     """
-    mes, ano = competencia_str.split("/")
-    mes = int(mes)
-    ano = int(ano)
+    (ano_ini, mes_ini), (ano, mes) = limites_competencia(competencia_str)
 
-    data_inicio = f"01/{mes:02d}/{ano}"
+    data_inicio = f"01/{mes_ini:02d}/{ano_ini}"
     ultimo_dia = calendar.monthrange(ano, mes)[1]
     data_fim = f"{ultimo_dia:02d}/{mes:02d}/{ano}"
 
@@ -230,183 +964,638 @@ def aplicar_filtro_por_competencia(driver, competencia_str, log_fn=print):
 
     log_fn("Filtro aplicado com sucesso.")
 
-def processar_pagina(driver, competencia_str, situacoes_dict, log_fn=print):
-    WebDriverWait(driver, TIMEOUT).until(EC.presence_of_all_elements_located((By.XPATH, "//table//tbody//tr[td]")))
-    linhas = driver.find_elements(By.XPATH, "//table//tbody//tr[td]")
-    log_fn(f"Página atual: {len(linhas)} notas encontradas")
-    baixadas = 0
-    for i, linha in enumerate(linhas, 1):
-        r = baixar_xml_da_linha(driver, linha, i, competencia_str, situacoes_dict, log_fn)
+def processar_pagina(driver, competencia_str, situacoes_dict, log_fn=print, sessao=None, pasta=None, empresa=None):
+    with medir_fase("leitura da página"):
+        WebDriverWait(driver, TIMEOUT_PAGINA).until(EC.presence_of_all_elements_located((By.XPATH, "//table//tbody//tr[td]")))
+        registros = extrair_linhas_da_pagina(driver)
+    return processar_registros(driver, registros, competencia_str, situacoes_dict, log_fn, sessao, pasta, empresa)
+
+def processar_registros(driver, registros, competencia_str, situacoes_dict, log_fn=print, sessao=None, pasta=None,
+                        empresa=None):
+    """
+    Seleciona e baixa as notas de uma página já lida (pelo navegador ou por HTTP).
+    `empresa` ({'cnpj', 'puladas'}) liga a deduplicação antes do download e
+    acumula em 'arquivos' o que foi baixado, para o diário de execução.
+    """
+    pasta = pasta or PASTA_DOWNLOADS
+    log_fn(f"Página atual: {len(registros)} notas encontradas")
+
+    # Filtro sobre o retrato em memória da página (sem novas idas ao chromedriver)
+    selecionadas = []
+    anterior = False
+    for i, registro in enumerate(registros, 1):
+        r = selecionar_nota(registro, i, competencia_str, situacoes_dict, log_fn)
         if r == "ANTERIOR":
-            log_fn("Encontrada nota anterior à competência → parando.")
-            return -1
-        if r is True:
-            baixadas += 1
-        time.sleep(1.0)
-    log_fn(f"→ {baixadas} notas baixadas nesta página")
+            anterior = True
+            break
+        if r:
+            selecionadas.append(r)
+
+    baixadas = 0
+    puladas = 0
+    enviadas = list(selecionadas)
+    try:
+        if empresa is not None and selecionadas:
+            if not empresa.get('cnpj'):
+                # CNPJ da sessão ainda desconhecido: a primeira nota é baixada sozinha e ele sai do XML dela
+                primeira = selecionadas.pop(0)
+                baixadas += baixar_selecionadas(driver, [primeira], sessao, pasta, log_fn)
+                empresa['cnpj'] = cnpj_da_nota_baixada(pasta, primeira)
+            selecionadas, puladas = descartar_notas_existentes(selecionadas, empresa.get('cnpj'), log_fn)
+            empresa['puladas'] = empresa.get('puladas', 0) + puladas
+        baixadas += baixar_selecionadas(driver, selecionadas, sessao, pasta, log_fn)
+    finally:
+        # Mesmo se a página falhar no meio, o que chegou a ser baixado vai para o diário
+        if empresa is not None:
+            empresa.setdefault('arquivos', []).extend(
+                {'xml': n['arquivo_xml'], 'pdf': PDF_POR_ARQUIVO.get(n['arquivo_xml']), 'situacao': n['situacao'],
+                 'numero': n['numero']}
+                for n in enviadas if n.get('arquivo_xml'))
+            empresa['linhas'] = len(registros)
+
+    contar("páginas")
+    contar("notas baixadas", baixadas)
+    contar("notas já existentes", puladas)
+    if anterior:
+        log_fn("Encontrada nota anterior à competência → parando.")
+        return -1
+    extra = f" ({puladas} já existentes, não baixadas)" if puladas else ""
+    log_fn(f"→ {baixadas} notas baixadas nesta página{extra}")
     return baixadas
 
+def baixar_selecionadas(driver, selecionadas, sessao, pasta, log_fn):
+    notas = []
+    for nota in selecionadas:
+        try:
+            revelar_links_da_nota(driver, nota)
+        except Exception as e:
+            log_fn(f"Linha {nota['num']}: FALHA → {str(e)[:100]}")
+            continue
+        if not nota['href_xml']:
+            log_fn(f"Linha {nota['num']}: FALHA → link do XML não encontrado")
+            continue
+        notas.append(nota)
+    if not notas:
+        return 0
+
+    with medir_fase("downloads"):
+        if sessao is not None:
+            atualizar_cookies_sessao(sessao, driver)
+            return baixar_notas_http(driver, sessao, notas, pasta, log_fn)
+        baixadas = 0
+        with ObservadorDownloads(pasta) as observador:
+            for nota in notas:
+                try:
+                    baixar_nota_navegador(driver, nota, observador, log_fn)
+                    baixadas += 1
+                except Exception as e:
+                    log_fn(f"Linha {nota['num']}: FALHA → {str(e)[:100]}")
+        return baixadas
+
+def normalizar_numero_nota(numero):
+    """Número da nota só com dígitos e sem zeros à esquerda (tabela e XML nem sempre coincidem)."""
+    digitos = re.sub(r"\D", "", str(numero or ""))
+    return digitos.lstrip("0") or digitos
+
+def descartar_notas_existentes(notas, cnpj, log_fn=print):
+    """Tira da lista as notas cujo (CNPJ da sessão, número) já está em NOTAS_EXISTENTES."""
+    if not cnpj:
+        return notas, 0
+    with LOCK_ORGANIZACAO:
+        conhecidos = {normalizar_numero_nota(n) for c, n in NOTAS_EXISTENTES if c == cnpj}
+    novas = []
+    for nota in notas:
+        if normalizar_numero_nota(nota['numero']) in conhecidos:
+            log_fn(f"Linha {nota['num']}: já existe → Nº {nota['numero']}")
+        else:
+            novas.append(nota)
+    return novas, len(notas) - len(novas)
+
+def cnpj_da_nota_baixada(pasta, nota):
+    """CNPJ da empresa da sessão (emitente em Prestados, tomador em Tomados), lido do XML baixado."""
+    if not nota.get('arquivo_xml'):
+        return None
+    data = extrair_campos_xml(os.path.join(pasta, nota['arquivo_xml']), MODO)
+    if not data:
+        return None
+    return data['tomador_cnpj' if MODO == 'tomados' else 'emitente_cnpj'] or None
+
 def tem_proxima_pagina(driver, log_fn=print):
     pg_param = 'Recebidas' if MODO == 'tomados' else 'Emitidas'
     try:
         btn = driver.find_element(By.XPATH, f"//a[contains(@href, '{pg_param}?pg=') and contains(@data-original-title, 'Próxima')]")
         if "disabled" in btn.find_element(By.XPATH, "./ancestor::li").get_attribute("class"):
             return False
+        primeira_linha = driver.find_element(By.XPATH, "//table//tbody//tr[td]")
+        url_antes = driver.current_url
         driver.execute_script("arguments[0].click();", btn)
-        time.sleep(2.5)
+        # Troca concluída quando a tabela antiga some ou o número da página muda
+        WebDriverWait(driver, TIMEOUT_PAGINA).until(
+            lambda d: EC.staleness_of(primeira_linha)(d) or d.current_url != url_antes)
+        WebDriverWait(driver, TIMEOUT_PAGINA).until(
+            EC.presence_of_all_elements_located((By.XPATH, "//table//tbody//tr[td]")))
         return True
     except Exception:
         return False
 
+def baixar_notas_da_empresa(driver, competencia_str, pasta, log_fn=print, sessao=None, empresa=None):
+    """
+    Percorre as páginas da lista já filtrada baixando para `pasta`; devolve as
+    situações lidas. `empresa` ({'cnpj': ...} ou None, se desconhecido) recebe
+    em 'puladas' quantas notas já existentes deixaram de ser baixadas; com
+    'pasta_base', cada página concluída vai para o diário de execução e uma
+    execução interrompida da mesma empresa é retomada depois da última delas.
+    """
+    situacoes_dict = {}
+    empresa = empresa if empresa is not None else {'cnpj': None}
+    empresa.setdefault('puladas', 0)
+    iniciar_empresa_no_diario(empresa, competencia_str, log_fn)
+    try:
+        _percorrer_lista(driver, competencia_str, situacoes_dict, pasta, log_fn, sessao, empresa)
+    except Exception:
+        # O que a página interrompida já baixou também precisa ser reconciliado depois
+        concluir_pagina(empresa, None, competencia_str, pasta, log_fn)
+        raise
+    if empresa.get('cnpj') and empresa.get('pasta_base'):
+        registrar_no_diario(empresa['pasta_base'], 'fim', competencia_str, cnpj=empresa['cnpj'])
+    return situacoes_dict
+
+def _percorrer_lista(driver, competencia_str, situacoes_dict, pasta, log_fn, sessao, empresa):
+    if sessao is not None:
+        if pagina_ja_concluida(empresa, 1):
+            log_fn("--- PÁGINA 1 --- já concluída (diário)")
+        else:
+            log_fn("--- PÁGINA 1 ---")
+            res = processar_pagina(driver, competencia_str, situacoes_dict, log_fn, sessao, pasta, empresa)
+            concluir_pagina(empresa, 1, competencia_str, pasta, log_fn)
+            if res == -1:
+                return
+        paginador = PaginadorLista(sessao, driver.page_source, driver.current_url)
+        if paginador.tem_proxima:
+            with paginador:
+                percorrer_paginas_por_url(driver, paginador, competencia_str, situacoes_dict, log_fn, sessao, pasta,
+                                          empresa)
+        return
+
+    pagina = 1
+    while True:
+        if pagina_ja_concluida(empresa, pagina):
+            log_fn(f"--- PÁGINA {pagina} --- já concluída (diário)")
+        else:
+            log_fn(f"--- PÁGINA {pagina} ---")
+            res = processar_pagina(driver, competencia_str, situacoes_dict, log_fn, sessao, pasta, empresa)
+            with medir_fase("aguardar downloads"):
+                aguardar_downloads(pasta, log_fn=log_fn)
+            concluir_pagina(empresa, pagina, competencia_str, pasta, log_fn)
+            if res == -1:
+                break
+        with medir_fase("troca de página"):
+            if not tem_proxima_pagina(driver, log_fn):
+                break
+        pagina += 1
+
+# ============================= PAGINAÇÃO POR URL =============================
+# Os links da paginação já trazem Emitidas?pg=N / Recebidas?pg=N: com a sessão
+# HTTP autenticada as páginas seguintes são baixadas e lidas direto do HTML,
+# com as próximas já sendo buscadas enquanto a página atual é processada.
+
+def secao_da_lista():
+    return 'Recebidas' if MODO == 'tomados' else 'Emitidas'
+
+class LeitorListaNotas(HTMLParser):
+    """
+    Lê do HTML da lista os mesmos registros de JS_EXTRAIR_LINHAS e os links
+    da paginação (número da página -> URL, e se "Próxima" está desabilitada).
+    """
+    def __init__(self, url, classe_data, secao):
+        super().__init__()
+        self.url = url
+        self.classe_data = classe_data
+        self.marca_paginacao = f"{secao}?pg="
+        self.registros = []
+        self.paginas = {}
+        self.proxima = None           # (url, desabilitada)
+        self._tbody = 0
+        self._linha = None
+        self._td = None                # [classe, partes do texto]
+        self._tds = []
+        self._li = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classe = attrs.get('class') or ''
+        if tag == 'tbody':
+            self._tbody += 1
+        elif tag == 'li':
+            self._li.append(classe)
+        elif tag == 'tr' and self._tbody:
+            self._linha = {'data': None, 'numero': '', 'status': '', 'href_xml': None, 'href_pdf': None,
+                           'menu': False, 'tem_td': False}
+            self._tds = []
+        elif tag == 'td' and self._linha is not None:
+            self._linha['tem_td'] = True
+            self._td = [classe, []]
+        elif tag == 'img' and self._linha is not None and not self._linha['status']:
+            src = attrs.get('src') or ''
+            if 'tb-cancelada.svg' in src or 'tb-gerada.svg' in src:
+                self._linha['status'] = urljoin(self.url, src)
+        elif tag == 'i' and self._linha is not None and 'glyphicon-option-vertical' in classe:
+            self._linha['menu'] = True
+        elif tag == 'a':
+            href = attrs.get('href') or ''
+            if self._linha is not None:
+                if 'Download/NFSe/' in href and not self._linha['href_xml']:
+                    self._linha['href_xml'] = urljoin(self.url, href)
+                elif 'Download/DANFSe/' in href and not self._linha['href_pdf']:
+                    self._linha['href_pdf'] = urljoin(self.url, href)
+            if self.marca_paginacao in href:
+                absoluto = urljoin(self.url, href)
+                pg = dict(parse_qsl(urlsplit(absoluto).query)).get('pg', '')
+                if pg.isdigit():
+                    self.paginas.setdefault(int(pg), absoluto)
+                if 'Próxima' in (attrs.get('data-original-title') or attrs.get('title') or ''):
+                    self.proxima = (absoluto, 'disabled' in (self._li[-1] if self._li else ''))
+
+    def handle_endtag(self, tag):
+        if tag == 'tbody':
+            self._tbody = max(0, self._tbody - 1)
+        elif tag == 'li' and self._li:
+            self._li.pop()
+        elif tag == 'td' and self._td is not None:
+            classe, partes = self._td
+            texto = ' '.join(''.join(partes).split())
+            self._tds.append(texto)
+            if self.classe_data in classe and self._linha['data'] is None:
+                self._linha['data'] = texto
+            if 'td-numero' in classe and not self._linha['numero']:
+                self._linha['numero'] = texto
+                self._linha['td_numero'] = True
+            self._td = None
+        elif tag == 'tr' and self._linha is not None:
+            linha, self._linha = self._linha, None
+            if linha.pop('tem_td'):
+                if not linha.pop('td_numero', False):
+                    linha['numero'] = next((t for t in self._tds if t.isdigit()), '')
+                linha['indice'] = len(self.registros)
+                self.registros.append(linha)
+
+    def handle_data(self, data):
+        if self._td is not None:
+            self._td[1].append(data)
+
+def ler_lista_html(html, url):
+    leitor = LeitorListaNotas(url, 'td-datahora' if MODO == 'tomados' else 'td-data', secao_da_lista())
+    leitor.feed(html)
+    leitor.close()
+    return leitor
+
+def url_da_pagina(url_modelo, pg):
+    """Mesma URL (com os parâmetros do filtro) trocando apenas pg=."""
+    partes = urlsplit(url_modelo)
+    params = [(k, v) for k, v in parse_qsl(partes.query, keep_blank_values=True) if k != 'pg']
+    return urlunsplit(partes._replace(query=urlencode([('pg', str(pg))] + params)))
+
+class PaginadorLista:
+    """
+    Páginas 2..N da lista filtrada, lidas pela sessão HTTP, até uma página
+    vazia ou a "Próxima" desabilitada. Até `prefetch` páginas à frente ficam
+    sendo buscadas em segundo plano, sem passar da maior página que a
+    paginação já mostrou (atualizada a cada página: sem o link "Última" ela só
+    mostra uma janela de números); fechar() descarta as que não forem usadas
+    (ex.: parada por nota anterior à competência).
+    """
+    def __init__(self, sessao, html_pagina1, url_pagina1, prefetch=PAGINAS_PREFETCH):
+        self.sessao = sessao
+        self.prefetch = max(0, prefetch)
+        leitor = ler_lista_html(html_pagina1, url_pagina1)
+        self.tem_proxima = bool(leitor.proxima) and not leitor.proxima[1]
+        self.url_modelo = leitor.proxima[0] if leitor.proxima else None
+        self.total = max(leitor.paginas) if leitor.paginas else None
+        self._pool = ThreadPoolExecutor(max_workers=max(1, self.prefetch))
+        self._futuros = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
+
+    def fechar(self):
+        self._futuros.clear()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def buscar(self, pg):
+        url = url_da_pagina(self.url_modelo, pg)
+        resp = self.sessao.get(url, timeout=TIMEOUT_PAGINA)
+        resp.raise_for_status()
+        if 'login' in resp.url.lower():
+            raise RuntimeError("portal devolveu a tela de login (sessão expirada?)")
+        return url, ler_lista_html(resp.text, resp.url)
+
+    def _agendar(self, pg):
+        if pg not in self._futuros:
+            self._futuros[pg] = self._pool.submit(self.buscar, pg)
+
+    def paginas(self, inicio=2):
+        """Gera (pg, url, leitor ou exceção) a partir da página `inicio` (2, ou a de retomada)."""
+        pg = max(2, inicio)
+        while True:
+            self._agendar(pg)
+            for adiante in range(pg + 1, pg + self.prefetch + 1):
+                if self.total is None or adiante <= self.total:
+                    self._agendar(adiante)
+            futuro = self._futuros.pop(pg)
+            try:
+                with medir_fase("leitura da página"):
+                    url, leitor = futuro.result()
+            except Exception as e:
+                yield pg, url_da_pagina(self.url_modelo, pg), e
+                return
+            if leitor.paginas:
+                self.total = max(self.total or 0, max(leitor.paginas))
+            yield pg, url, leitor
+            if not leitor.registros or not leitor.proxima or leitor.proxima[1]:
+                return
+            pg += 1
+
+def percorrer_paginas_por_url(driver, paginador, competencia_str, situacoes_dict, log_fn, sessao, pasta, empresa=None):
+    """
+    Processa as páginas do paginador mantendo a parada em "ANTERIOR". Páginas
+    cujas linhas só mostram os links no menu (ou que falharam por HTTP) são
+    abertas no navegador e seguem o caminho normal a partir dali.
+    """
+    empresa = empresa if empresa is not None else {}
+    inicio = empresa.get('retomar_apos', 0) + 1
+    if inicio > 2:
+        log_fn(f"--- PÁGINAS 2 a {inicio - 1} --- já concluídas (diário)")
+    for pg, url, leitor in paginador.paginas(inicio):
+        log_fn(f"--- PÁGINA {pg} ---")
+        if isinstance(leitor, Exception):
+            log_fn(f"Página {pg} por HTTP falhou ({str(leitor)[:80]}); continuando pelo navegador")
+            driver.get(url)
+            continuar_no_navegador(driver, competencia_str, situacoes_dict, log_fn, sessao, pasta, pg, empresa)
+            return
+        if any(r['menu'] and not r['href_xml'] for r in leitor.registros):
+            driver.get(url)
+            res = processar_pagina(driver, competencia_str, situacoes_dict, log_fn, sessao, pasta, empresa)
+        else:
+            res = processar_registros(driver, leitor.registros, competencia_str, situacoes_dict, log_fn, sessao, pasta,
+                                      empresa)
+        concluir_pagina(empresa, pg, competencia_str, pasta, log_fn)
+        if res == -1:
+            return
+
+def continuar_no_navegador(driver, competencia_str, situacoes_dict, log_fn, sessao, pasta, pagina, empresa=None):
+    while True:
+        res = processar_pagina(driver, competencia_str, situacoes_dict, log_fn, sessao, pasta, empresa)
+        if empresa is not None:
+            concluir_pagina(empresa, pagina, competencia_str, pasta, log_fn)
+        if res == -1:
+            return
+        with medir_fase("troca de página"):
+            if not tem_proxima_pagina(driver, log_fn):
+                return
+        pagina += 1
+        log_fn(f"--- PÁGINA {pagina} ---")
+
 def safe_float(val):
     try:
         return float(str(val).strip().replace(',', '.'))
     except Exception:
         return 0.0
 
-def get_tag_value(parent, tags, sub_parent=None):
-    ns = 'http://www.sped.fazenda.gov.br/nfse'
-    if parent is None:
-        return 0.0
-    base = parent if sub_parent is None else parent.find(f'.//{{{ns}}}{sub_parent}')
-    if base is None:
-        return 0.0
-    for tag_name in tags:
-        elem = base.find(f'.//{{{ns}}}{tag_name}')
-        if elem is not None and elem.text:
-            return safe_float(elem.text.strip())
-    return 0.0
-
-def extrair_texto_pdf(pdf_path):
-    """Extrai todo o texto de um PDF usando pdfplumber."""
+RE_BLOCO_SIMPLES = re.compile(
+    r'SimplesNacionalnaDatadeCompetência\s+RegimedeApuraçãoTributáriapeloSN\s*\n(.*?)\s+(.*?)\s*\n',
+    re.IGNORECASE | re.DOTALL)
+# Formatar textos com substituições manuais
+SUBSTITUICOES_SIMPLES = [
+    (re.compile(r'Optante-MicroempreendedorIndividual\(MEI\)'), 'Optante - Microempreendedor Individual (MEI)'),
+    (re.compile(r'Optante-MicroempresaouEmpresadePequenoPorte\(ME/EPP\)'), 'Optante - Microempresa ou Empresa de Pequeno Porte (ME/EPP)'),
+    (re.compile(r'Nãooptante'), 'Não optante'),
+]
+SUBSTITUICOES_REGIME = [
+    (re.compile(r'RegimedeapuraçãodostributosfederaisemunicipalpeloSimplesNacional'), 'Regime de apuração dos tributos federais e municipal pelo Simples Nacional'),
+    (re.compile(r'RegimedeapuraçãodostributosfederaispeloSimplesNacionaleoISSQN'), 'Regime de apuração dos tributos federais pelo Simples Nacional eo ISSQN'),
+]
+
+def extrair_dados_pdf(pdf_path):
+    """
+    Lê do DANFSe apenas o necessário para o bloco "Simples Nacional na Data de
+    Competência / Regime de Apuração": primeiro a parte de cima da página, depois
+    a página inteira, parando na primeira página onde o bloco aparece.
+    Retorna None em caso de erro (para não ir para o cache).
+    """
+    import pdfplumber
     try:
         with pdfplumber.open(pdf_path) as pdf:
-            texto_completo = ""
             for page in pdf.pages:
-                texto_pagina = page.extract_text()
-                if texto_pagina:
-                    texto_completo += texto_pagina + "\n"
-            return texto_completo.strip()
+                regiao = page.crop((0, 0, page.width, page.height * FRACAO_REGIAO_PDF))
+                for trecho in (regiao, page):
+                    texto = trecho.extract_text() or ""
+                    if RE_BLOCO_SIMPLES.search(texto):
+                        return parse_dados_nfse_pdf(texto)
+        return {}
     except Exception as e:
         print(f"Erro ao extrair texto do PDF {pdf_path}: {e}")
-        return ""
+        return None
 
 def parse_dados_nfse_pdf(texto):
     """Parseia dados específicos do texto extraído do PDF de NFS-e."""
     dados = {}
 
     # Captura textos após os títulos concatenados
-    match = re.search(r'SimplesNacionalnaDatadeCompetência\s+RegimedeApuraçãoTributáriapeloSN\s*\n(.*?)\s+(.*?)\s*\n', texto, re.IGNORECASE | re.DOTALL)
+    match = RE_BLOCO_SIMPLES.search(texto)
     if match:
         simples = match.group(1).strip()
         regime = match.group(2).strip()
-        # Formatar textos com substituições manuais
-        simples = re.sub(r'Optante-MicroempreendedorIndividual\(MEI\)', 'Optante - Microempreendedor Individual (MEI)', simples)
-        simples = re.sub(r'Optante-MicroempresaouEmpresadePequenoPorte\(ME/EPP\)', 'Optante - Microempresa ou Empresa de Pequeno Porte (ME/EPP)', simples)
-        simples = re.sub(r'Nãooptante', 'Não optante', simples)
-        regime = re.sub(r'RegimedeapuraçãodostributosfederaisemunicipalpeloSimplesNacional', 'Regime de apuração dos tributos federais e municipal pelo Simples Nacional', regime)
-        regime = re.sub(r'RegimedeapuraçãodostributosfederaispeloSimplesNacionaleoISSQN', 'Regime de apuração dos tributos federais pelo Simples Nacional eo ISSQN', regime)
-        # Adicionar espaços adicionais se necessário
+        for padrao, texto_novo in SUBSTITUICOES_SIMPLES:
+            simples = padrao.sub(texto_novo, simples)
+        for padrao, texto_novo in SUBSTITUICOES_REGIME:
+            regime = padrao.sub(texto_novo, regime)
         dados['simples_nacional'] = simples
         dados['regime_apuracao'] = regime
 
     return dados
 
 def parse_xml_por_nota(xml_path, situacoes_dict=None):
-    try:
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
-        ns = '{http://www.sped.fazenda.gov.br/nfse}'
-
-        emit_nome = root.findtext(f'.//{ns}emit/{ns}xNome', '')
-        emit_cnpj = root.findtext(f'.//{ns}emit/{ns}CNPJ', '')
-        emit_cpf = root.findtext(f'.//{ns}emit/{ns}CPF', '')
-        toma_nome = root.findtext(f'.//{ns}toma/{ns}xNome', '')
-        toma_cnpj = root.findtext(f'.//{ns}toma/{ns}CNPJ', '')
-        toma_cpf = root.findtext(f'.//{ns}toma/{ns}CPF', '')
-        n_nfse = root.findtext(f'.//{ns}infNFSe/{ns}nNFSe', '')
-
-        dh_tag = 'dhProc' if MODO == 'tomados' else 'dhEmi'
-        dhEmi = root.find(f'.//{ns}{dh_tag}') or root.find(f'.//{ns}dhEmi')
-        data_emissao = ''
-        if dhEmi is not None and dhEmi.text:
-            try:
-                data_emissao = datetime.datetime.strptime(dhEmi.text[:10], "%Y-%m-%d").strftime("%d/%m/%Y")
-            except:
-                pass
+    data = extrair_campos_xml(xml_path, MODO)
+    if data:
+        aplicar_situacao(data, situacoes_dict, xml_path)
+    return data
+
+def situacao_da_pasta(caminho):
+    """Situação de um XML já organizado (.../Canceladas/XML/nota.xml); None fora de Autorizadas/Canceladas."""
+    pasta = os.path.basename(os.path.dirname(os.path.dirname(os.path.abspath(caminho))))
+    return {"Canceladas": "Cancelada", "Autorizadas": "Autorizada"}.get(pasta)
+
+def aplicar_situacao(data, situacoes_dict=None, caminho=None):
+    # XML já organizado: vale a pasta, porque SITUACOES_POR_ARQUIVO só conhece os
+    # arquivos desta execução (outro processo regeraria as canceladas como autorizadas)
+    situacao = (caminho and situacao_da_pasta(caminho)) or SITUACOES_POR_ARQUIVO.get(data['arquivo'], "Autorizada")
+    if situacoes_dict and data['numero_nota']:
+        situacao = situacoes_dict.get(data['numero_nota'], situacao)
+    data['situacao'] = situacao
+    return data
+
+# ============================= LEITURA DO XML (PASSADA ÚNICA) =============================
+# A árvore é percorrida uma única vez (root.iter(), em ordem de documento) e
+# cada tag é despachada por tabela. As tabelas reproduzem as buscas feitas antes
+# com root.findtext/find: vale sempre o primeiro elemento encontrado.
+NS_NFSE = 'http://www.sped.fazenda.gov.br/nfse'
+
+def _tags(tabela):
+    return {'{%s}%s' % (NS_NFSE, tag): campo for tag, campo in tabela.items()}
+
+# tag pai -> {tag filha: campo}, equivalente a './/pai/filha'
+CAMPOS_POR_PAI = {
+    '{%s}%s' % (NS_NFSE, pai): _tags(filhos) for pai, filhos in {
+        'emit': {'xNome': 'emit_nome', 'CNPJ': 'emit_cnpj', 'CPF': 'emit_cpf'},
+        'toma': {'xNome': 'toma_nome', 'CNPJ': 'toma_cnpj', 'CPF': 'toma_cpf'},
+        'infNFSe': {'nNFSe': 'n_nfse'},
+        'valores': {'vBC': 'v_bc', 'vLiq': 'v_liq', 'vTotalRet': 'v_total_ret'},
+    }.items()
+}
+# tag -> campo, equivalente a './/tag'
+CAMPOS_EM_QUALQUER_LUGAR = _tags({'dhEmi': 'dhEmi', 'tpRetISSQN': 'tpRet', 'vISSQN': 'vISSQN'})
+# A partir de cada infDPS
+CAMINHO_VSERV = tuple(_tags({'valores': 0, 'vServPrest': 0, 'vServ': 0}))
+CAMINHO_TRIBFED = tuple(_tags({'valores': 0, 'trib': 0, 'tribFed': 0}))
+# Dentro do 1º cServ/serv do 1º infDPS, do 1º tribFed e do 1º piscofins desse tribFed
+CAMPOS_SERV = _tags({'xDescServ': 'x_desc', 'cTribNac': 'codigo_serv'})
+CAMPOS_TRIBFED = _tags({'vRetIRRF': 'irrf', 'vRetCP': 'cp', 'vRetCSLL': 'csll'})
+CAMPOS_PISCOFINS = _tags({'vPis': 'pis', 'vCofins': 'cofins'})
+TAG_INFDPS = '{%s}infDPS' % NS_NFSE
+TAG_PISCOFINS = '{%s}piscofins' % NS_NFSE
+
+def _primeiro_no_caminho(elem, caminho):
+    atual = [elem]
+    for tag in caminho:
+        atual = [filho for pai in atual for filho in pai if filho.tag == tag]
+    return atual[0] if atual else None
+
+def _primeiros_descendentes(elem, tabela, achados):
+    for tag, campo in tabela.items():
+        if campo not in achados:
+            alvo = next(elem.iter(tag), None)
+            if alvo is not None:
+                achados[campo] = alvo.text or ''
+
+def varrer_xml_nfse(xml_path, modo):
+    """Retorna {campo: texto} com o texto do primeiro elemento de cada campo."""
+    tag_serv = '{%s}%s' % (NS_NFSE, 'cServ' if modo == 'tomados' else 'serv')
+    tag_dh = '{%s}dhProc' % NS_NFSE if modo == 'tomados' else None
+    raiz = ET.parse(xml_path).getroot()
+    achados = {}
+    dh_modo = None
+    primeiro_infdps = True
+
+    elementos = raiz.iter()
+    next(elementos)  # './/' não inclui a própria raiz
+    for elem in elementos:
+        tag = elem.tag
+        filhos = CAMPOS_POR_PAI.get(tag)
+        if filhos:
+            for filho in elem:
+                campo = filhos.get(filho.tag)
+                if campo and campo not in achados:
+                    achados[campo] = filho.text or ''
+            continue
 
-        v_bc = safe_float(root.findtext(f'.//{ns}valores/{ns}vBC'))
-        v_liq = safe_float(root.findtext(f'.//{ns}valores/{ns}vLiq'))
-        v_serv = safe_float(root.findtext(f'.//{ns}valores/{ns}vServ'))
-        v_total_ret = safe_float(root.findtext(f'.//{ns}valores/{ns}vTotalRet'))
-
-        v_serv = safe_float(root.findtext(f'.//{ns}infDPS/{ns}valores/{ns}vServPrest/{ns}vServ'))
-        x_desc = ''
-        codigo_serv = ''
-        infDPS = root.find(f'.//{ns}infDPS')
-        serv_tag = 'cServ' if MODO == 'tomados' else 'serv'
-        serv = infDPS.find(f'.//{ns}{serv_tag}') if infDPS else None
-        if serv is not None:
-            desc_elt = serv.find(f'.//{ns}xDescServ')
-            if desc_elt is not None and desc_elt.text:
-                x_desc = desc_elt.text.strip()
-            cod_elt = serv.find(f'.//{ns}cTribNac')
-            if cod_elt is not None and cod_elt.text:
-                codigo_serv = cod_elt.text.strip()
-
-        tribFed = root.find(f'.//{ns}infDPS/{ns}valores/{ns}trib/{ns}tribFed')
-        irrf   = get_tag_value(tribFed, ['vRetIRRF'])
-        cp     = get_tag_value(tribFed, ['vRetCP'])
-        csll   = get_tag_value(tribFed, ['vRetCSLL'])
-        pis    = get_tag_value(tribFed, ['vPis'], 'piscofins')
-        cofins = get_tag_value(tribFed, ['vCofins'], 'piscofins')
-
-        # === CAMPOS ADICIONAIS ===
-        iss_retido = 'N/A'
-        valor_iss_retido = 0.0
-        tpRet = root.findtext(f'.//{ns}tpRetISSQN', '')
-        if tpRet == '2':
-            iss_retido = 'SIM'
-            valor_iss_retido = safe_float(root.findtext(f'.//{ns}vISSQN', ''))
-        elif tpRet == '1':
-            iss_retido = 'NÃO'
-            valor_iss_retido = 0.0
-
-        emit_documento = emit_cnpj if emit_cnpj else emit_cpf
-        toma_documento = toma_cnpj if toma_cnpj else toma_cpf
-
-        nome_arq = os.path.basename(xml_path)
-        situacao = SITUACOES_POR_ARQUIVO.get(nome_arq, "Autorizada")
-        if situacoes_dict and n_nfse:
-            situacao = situacoes_dict.get(n_nfse, situacao)
-
-        return {
-            'arquivo': nome_arq,
-            'numero_nota': n_nfse,
-            'emitente_nome': emit_nome,
-            'emitente_cnpj': emit_documento,
-            'tomador_nome': toma_nome,
-            'tomador_cnpj': toma_documento,
-            'data_emissao': data_emissao,
-            'valor_bc': v_bc,
-            'valor_liq': v_liq,
-            'valor_servico': v_serv,
-            'descricao_serv': x_desc,
-            'codigo_serv': codigo_serv,
-            'situacao': situacao,
-            'total_retencoes': v_total_ret,
-            'irrf': irrf,
-            'cp': cp,
-            'csll': csll,
-            'pis': pis,
-            'cofins': cofins,
-            'iss_retido': iss_retido,
-            'valor_iss_retido': valor_iss_retido
-        }
+        campo = CAMPOS_EM_QUALQUER_LUGAR.get(tag)
+        if campo:
+            if campo not in achados:
+                achados[campo] = elem.text or ''
+        elif tag == tag_dh and dh_modo is None:
+            dh_modo = elem
+        elif tag == TAG_INFDPS:
+            if primeiro_infdps:
+                primeiro_infdps = False
+                serv = next(elem.iter(tag_serv), None) if len(elem) else None
+                if serv is not None:
+                    _primeiros_descendentes(serv, CAMPOS_SERV, achados)
+            if 'v_serv' not in achados:
+                v_serv = _primeiro_no_caminho(elem, CAMINHO_VSERV)
+                if v_serv is not None:
+                    achados['v_serv'] = v_serv.text or ''
+            if 'tribFed' not in achados:
+                trib_fed = _primeiro_no_caminho(elem, CAMINHO_TRIBFED)
+                if trib_fed is not None:
+                    achados['tribFed'] = ''
+                    _primeiros_descendentes(trib_fed, CAMPOS_TRIBFED, achados)
+                    piscofins = next(trib_fed.iter(TAG_PISCOFINS), None)
+                    if piscofins is not None:
+                        _primeiros_descendentes(piscofins, CAMPOS_PISCOFINS, achados)
+
+    # `find(dhProc) or find(dhEmi)`: um elemento sem filhos é falso, então o
+    # dhProc só prevalece se tiver filhos
+    if dh_modo is not None and len(dh_modo):
+        achados['dh'] = dh_modo.text
+    else:
+        achados['dh'] = achados.get('dhEmi')
+    return achados
+
+def data_iso_para_br(texto):
+    """'AAAA-MM-DD...' -> 'DD/MM/AAAA' (mesmo resultado de strptime/strftime, sem o custo)."""
+    ano, mes, dia = texto[:4], texto[5:7], texto[8:10]
+    if texto[4:5] == texto[7:8] == '-' and (ano + mes + dia).isdigit() and ano >= '1000':
+        datetime.date(int(ano), int(mes), int(dia))  # valida a data
+        return f"{dia}/{mes}/{ano}"
+    return datetime.datetime.strptime(texto[:10], "%Y-%m-%d").strftime("%d/%m/%Y")
+
+def extrair_campos_xml(xml_path, modo):
+    """
+    Campos da nota sem a situação (que depende da execução). Recebe o modo
+    explicitamente para poder rodar em processos filhos do pool.
+    """
+    try:
+        campos = varrer_xml_nfse(xml_path, modo)
     except Exception as e:
         print(f"[ERRO PARSE] {xml_path}: {e}")
         return None
 
+    def texto(campo):
+        return campos.get(campo) or ''
+
+    data_emissao = ''
+    if campos['dh']:
+        try:
+            data_emissao = data_iso_para_br(campos['dh'])
+        except:
+            pass
+
+    iss_retido = 'N/A'
+    valor_iss_retido = 0.0
+    tpRet = texto('tpRet')
+    if tpRet == '2':
+        iss_retido = 'SIM'
+        valor_iss_retido = safe_float(texto('vISSQN'))
+    elif tpRet == '1':
+        iss_retido = 'NÃO'
+
+    return {
+        'arquivo': os.path.basename(xml_path),
+        'numero_nota': texto('n_nfse'),
+        'emitente_nome': texto('emit_nome'),
+        'emitente_cnpj': texto('emit_cnpj') or texto('emit_cpf'),
+        'tomador_nome': texto('toma_nome'),
+        'tomador_cnpj': texto('toma_cnpj') or texto('toma_cpf'),
+        'data_emissao': data_emissao,
+        'valor_bc': safe_float(campos.get('v_bc')),
+        'valor_liq': safe_float(campos.get('v_liq')),
+        'valor_servico': safe_float(campos.get('v_serv')),
+        'descricao_serv': texto('x_desc').strip(),
+        'codigo_serv': texto('codigo_serv').strip(),
+        'situacao': None,  # preenchida por aplicar_situacao
+        'total_retencoes': safe_float(campos.get('v_total_ret')),
+        'irrf': safe_float(campos.get('irrf')),
+        'cp': safe_float(campos.get('cp')),
+        'csll': safe_float(campos.get('csll')),
+        'pis': safe_float(campos.get('pis')),
+        'cofins': safe_float(campos.get('cofins')),
+        'iss_retido': iss_retido,
+        'valor_iss_retido': valor_iss_retido
+    }
+
 def limpar_nome_empresa(nome):
     if not nome:
         return "SEM_NOME"
@@ -422,6 +1611,228 @@ def criar_pasta_downloads(pasta):
 NOTAS_EXISTENTES = set()
 SITUACOES_POR_ARQUIVO = {}
 PDF_POR_ARQUIVO = {}
+# Serializa a organização (NOTAS_EXISTENTES, pastas das empresas, índice e relatórios)
+LOCK_ORGANIZACAO = threading.RLock()
+
+# ============================= ÍNDICE DE NOTAS (SQLITE) =============================
+# Índice persistente na raiz da pasta de downloads: evita reabrir todos os XMLs
+# a cada execução só para montar NOTAS_EXISTENTES.
+
+ARQUIVO_INDICE = "_indice_notas.sqlite3"
+
+def abrir_indice_notas(pasta_base):
+    con = sqlite3.connect(os.path.join(pasta_base, ARQUIVO_INDICE), timeout=TIMEOUT)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS notas (
+            modo        TEXT NOT NULL,
+            caminho     TEXT NOT NULL,
+            cnpj        TEXT,
+            numero      TEXT,
+            competencia TEXT,
+            situacao    TEXT,
+            mtime       REAL,
+            tamanho     INTEGER,
+            PRIMARY KEY (modo, caminho)
+        )""")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_notas_comp ON notas (modo, competencia, cnpj, numero)")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS cache_xml (
+            modo    TEXT NOT NULL,
+            caminho TEXT NOT NULL,
+            mtime   REAL,
+            tamanho INTEGER,
+            dados   TEXT,
+            PRIMARY KEY (modo, caminho)
+        )""")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS cache_pdf (
+            caminho TEXT PRIMARY KEY,
+            mtime   REAL,
+            tamanho INTEGER,
+            dados   TEXT
+        )""")
+    # Distribuição por NSU: último NSU recebido por empresa e os cancelamentos recebidos
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS nsu_adn (
+            cnpj       TEXT NOT NULL,
+            modo       TEXT NOT NULL,
+            ultimo_nsu INTEGER NOT NULL,
+            atualizado TEXT,
+            PRIMARY KEY (cnpj, modo)
+        )""")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS eventos_adn (
+            chave  TEXT PRIMARY KEY,
+            evento TEXT,
+            nsu    INTEGER,
+            cnpj   TEXT
+        )""")
+    return con
+
+def competencia_da_data(data_str):
+    """'dd/mm/aaaa' -> 'AAAA-MM' (formato ordenável usado no índice)."""
+    try:
+        dt = datetime.datetime.strptime(data_str.strip(), "%d/%m/%Y").date()
+        return f"{dt.year:04d}-{dt.month:02d}"
+    except:
+        return None
+
+def registrar_nota_no_indice(con, caminho, data, situacao=None):
+    key_cnpj = 'tomador_cnpj' if MODO == 'tomados' else 'emitente_cnpj'
+    st = os.stat(caminho)
+    cnpj = numero = competencia = None
+    if data:
+        cnpj = data[key_cnpj] or None
+        numero = data['numero_nota'] or None
+        competencia = competencia_da_data(data['data_emissao']) if data['data_emissao'] else None
+        situacao = situacao or data.get('situacao')
+    con.execute(
+        "INSERT OR REPLACE INTO notas (modo, caminho, cnpj, numero, competencia, situacao, mtime, tamanho) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (MODO, os.path.abspath(caminho), cnpj, numero, competencia, situacao, st.st_mtime, st.st_size))
+
+def remover_nota_do_indice(con, caminho):
+    con.execute("DELETE FROM notas WHERE modo = ? AND caminho = ?", (MODO, os.path.abspath(caminho)))
+
+RE_PASTA_MES = re.compile(r"\d{4}-\d{2}")
+
+def sincronizar_indice_notas(con, pasta_base, log_fn=print, competencias=None):
+    """
+    Percorre a pasta e reprocessa apenas XMLs novos ou alterados (mtime/tamanho);
+    os que sumiram saem do índice. Com `competencias` (AAAA-MM), pula as
+    subpastas de outros meses e só remove notas dessas competências.
+    """
+    conhecidos = {c: (m, t, comp) for c, m, t, comp in con.execute(
+        "SELECT caminho, mtime, tamanho, competencia FROM notas WHERE modo = ?", (MODO,))}
+    vistos = set()
+    reprocessados = 0
+    for root_dir, dirs, files in os.walk(pasta_base):
+        dirs[:] = [d for d in dirs if d != PASTA_ENTRADA
+                   and not (competencias and RE_PASTA_MES.fullmatch(d) and d not in competencias)]
+        # XMLs soltos na raiz ainda não foram organizados (entrada do modo uma a uma)
+        if os.path.samefile(root_dir, pasta_base):
+            continue
+        for file in files:
+            if not file.lower().endswith('.xml'):
+                continue
+            caminho = os.path.abspath(os.path.join(root_dir, file))
+            vistos.add(caminho)
+            try:
+                st = os.stat(caminho)
+            except OSError:
+                continue
+            if conhecidos.get(caminho, ())[:2] == (st.st_mtime, st.st_size):
+                continue
+            data = parse_xml_por_nota(caminho)
+            situacao = situacao_da_pasta(caminho) or "Autorizada"
+            registrar_nota_no_indice(con, caminho, data, situacao)
+            reprocessados += 1
+    removidos = {c for c, (_, _, comp) in conhecidos.items()
+                 if c not in vistos and (not competencias or comp in competencias)}
+    con.executemany("DELETE FROM notas WHERE modo = ? AND caminho = ?", [(MODO, c) for c in removidos])
+    con.commit()
+    log_fn(f"Índice de notas sincronizado: {reprocessados} XML(s) reprocessado(s), {len(removidos)} removido(s).")
+
+def registrar_cache_xml(con, caminho, data, st=None):
+    st = st or os.stat(caminho)
+    dados = dict(data, situacao=None)
+    con.execute("INSERT OR REPLACE INTO cache_xml (modo, caminho, mtime, tamanho, dados) VALUES (?, ?, ?, ?, ?)",
+                (MODO, os.path.abspath(caminho), st.st_mtime, st.st_size, json.dumps(dados, ensure_ascii=False)))
+
+def processar_em_pool(funcao, arquivos, limite, *args, log_fn=print):
+    """funcao(arquivo, *args) para cada arquivo; em pool de processos a partir de `limite` arquivos."""
+    if len(arquivos) >= limite and PARSE_WORKERS > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=PARSE_WORKERS) as pool:
+                return list(pool.map(funcao, arquivos, *(repeat(a) for a in args),
+                                     chunksize=max(1, len(arquivos) // (PARSE_WORKERS * 4))))
+        except Exception as e:
+            log_fn(f"[POOL] seguindo em série: {e}")
+    return [funcao(arquivo, *args) for arquivo in arquivos]
+
+def parse_xmls_com_cache(con, caminhos, situacoes_dict=None, log_fn=print):
+    """
+    Lê os XMLs reaproveitando o cache (caminho + mtime + tamanho) guardado no
+    índice; só os arquivos novos ou alterados são reprocessados, em paralelo
+    quando são muitos. Consulta no cache só os `caminhos` pedidos, então serve
+    tanto para a empresa inteira quanto para um lote do relatório em fluxo.
+    Retorna os dados na mesma ordem de `caminhos`.
+    """
+    caminhos = [os.path.abspath(c) for c in caminhos]
+    cache = {}
+    for i in range(0, len(caminhos), 500):
+        parte = caminhos[i:i + 500]
+        cache.update((c, (m, t, d)) for c, m, t, d in con.execute(
+            "SELECT caminho, mtime, tamanho, dados FROM cache_xml WHERE modo = ? AND caminho IN (%s)"
+            % ",".join("?" * len(parte)), (MODO, *parte)))
+    resultados = [None] * len(caminhos)
+    faltantes = []
+    for i, caminho_abs in enumerate(caminhos):
+        try:
+            st = os.stat(caminho_abs)
+        except OSError:
+            continue
+        guardado = cache.get(caminho_abs)
+        if guardado and guardado[:2] == (st.st_mtime, st.st_size):
+            resultados[i] = json.loads(guardado[2])
+        else:
+            faltantes.append((i, caminho_abs, st))
+    ler_xmls_sem_cache(con, faltantes, resultados, log_fn)
+    con.commit()
+    for caminho_abs, data in zip(caminhos, resultados):
+        if data:
+            aplicar_situacao(data, situacoes_dict, caminho_abs)
+    return resultados
+
+def descartar_cache_sumido(con, pasta_empresa):
+    """Tira do cache os XMLs da empresa que não existem mais no disco."""
+    prefixo = os.path.abspath(pasta_empresa) + os.sep
+    sumidos = [(MODO, c) for c, in con.execute(
+        "SELECT caminho FROM cache_xml WHERE modo = ? AND caminho >= ? AND caminho < ?",
+        (MODO, prefixo, prefixo + '\uffff')) if not os.path.exists(c)]
+    con.executemany("DELETE FROM cache_xml WHERE modo = ? AND caminho = ?", sumidos)
+    con.commit()
+
+def ler_xmls_sem_cache(con, faltantes, resultados, log_fn=print):
+    """Lê os XMLs de `faltantes` [(posição, caminho, stat)] e guarda cada resultado no cache."""
+    arquivos = [c for _, c, _ in faltantes]
+    with medir_fase("leitura dos XMLs"):
+        lidos = processar_em_pool(extrair_campos_xml, arquivos, LIMITE_POOL_XML, MODO, log_fn=log_fn)
+    contar("XMLs lidos", len(arquivos))
+    contar("XMLs do cache", len(resultados) - len(arquivos))
+    for (i, caminho_abs, st), data in zip(faltantes, lidos):
+        resultados[i] = data
+        if data:
+            registrar_cache_xml(con, caminho_abs, data, st)
+
+def extrair_dados_pdfs_com_cache(pasta_base, caminhos, log_fn=print):
+    """Dados do bloco do Simples de cada DANFSe, reaproveitando o cache por caminho + mtime + tamanho."""
+    resultados = [{}] * len(caminhos)
+    faltantes = []
+    with closing(abrir_indice_notas(pasta_base)) as con:
+        for i, caminho in enumerate(caminhos):
+            caminho_abs = os.path.abspath(caminho)
+            try:
+                st = os.stat(caminho_abs)
+            except OSError:
+                continue
+            guardado = con.execute("SELECT mtime, tamanho, dados FROM cache_pdf WHERE caminho = ?", (caminho_abs,)).fetchone()
+            if guardado and guardado[:2] == (st.st_mtime, st.st_size):
+                resultados[i] = json.loads(guardado[2])
+            else:
+                faltantes.append((i, caminho_abs, st))
+
+        with medir_fase("extração dos PDFs"):
+            lidos = processar_em_pool(extrair_dados_pdf, [c for _, c, _ in faltantes], LIMITE_POOL_PDF, log_fn=log_fn)
+        contar("PDFs extraídos", len(faltantes))
+        for (i, caminho_abs, st), dados_pdf in zip(faltantes, lidos):
+            if dados_pdf is None:
+                continue
+            resultados[i] = dados_pdf
+            con.execute("INSERT OR REPLACE INTO cache_pdf (caminho, mtime, tamanho, dados) VALUES (?, ?, ?, ?)",
+                        (caminho_abs, st.st_mtime, st.st_size, json.dumps(dados_pdf, ensure_ascii=False)))
+        con.commit()
+    return resultados
 
 def carregar_notas_existentes(pasta_base, competencia_str, log_fn=print):
     global NOTAS_EXISTENTES
@@ -430,53 +1841,155 @@ def carregar_notas_existentes(pasta_base, competencia_str, log_fn=print):
         return
     tipo = 'tomadas' if MODO == 'tomados' else 'prestadas'
     log_fn(f"Carregando notas {tipo} existentes da competência atual para evitar duplicidade...")
-    for root_dir, _, files in os.walk(pasta_base):
-        for file in files:
-            if file.lower().endswith('.xml'):
-                data = parse_xml_por_nota(os.path.join(root_dir, file))
-                if data and data['tomador_cnpj' if MODO == 'tomados' else 'emitente_cnpj'] and data['numero_nota'] and data['data_emissao'] and mesma_competencia(data['data_emissao'], competencia_str):
-                    NOTAS_EXISTENTES.add((data['tomador_cnpj' if MODO == 'tomados' else 'emitente_cnpj'], data['numero_nota']))
+    competencias = [competencia_da_data(f"01/{m}") for m in meses_da_competencia(competencia_str)]
+    with closing(abrir_indice_notas(pasta_base)) as con:
+        vazio = con.execute("SELECT 1 FROM notas WHERE modo = ? LIMIT 1", (MODO,)).fetchone() is None
+        if vazio:
+            log_fn("Índice de notas vazio; montando a partir dos XMLs existentes (apenas na primeira vez)...")
+        # XMLs acrescentados, trocados ou apagados fora do organizador: só os alterados são relidos,
+        # e os que sumiram não bloqueiam um novo download
+        sincronizar_indice_notas(con, pasta_base, log_fn, None if vazio else set(competencias))
+        linhas = con.execute(
+            "SELECT cnpj, numero FROM notas WHERE modo = ? AND competencia IN (%s) "
+            "AND cnpj IS NOT NULL AND numero IS NOT NULL" % ",".join("?" * len(competencias)),
+            (MODO, *competencias)).fetchall()
+        NOTAS_EXISTENTES = set(linhas)
     log_fn(f"Total de notas {tipo} da competência já registradas: {len(NOTAS_EXISTENTES)}")
 
-def gerar_relatorio_para_empresa(pasta_base, pasta_empresa, competencia_str, situacoes_dict, log_fn=print):
-    xml_paths = []
+# ============================= PLANILHA DO RELATÓRIO =============================
+
+def estilos_relatorio():
+    """Estilos nomeados compartilhados por todas as células do relatório."""
+    carregar_planilhas()
+    fino = Side(style="thin")
+    cabecalho = NamedStyle(
+        name="Relatorio Cabecalho",
+        font=Font(bold=True, color="FFFFFF"),
+        fill=PatternFill(start_color="4F81B3", fill_type="solid"),
+        border=Border(left=fino, right=fino, top=fino, bottom=fino),
+        alignment=Alignment(horizontal="center", vertical="center", wrap_text=True),
+    )
+    corpo = NamedStyle(
+        name="Relatorio Corpo",
+        font=copy(DEFAULT_FONT),
+        alignment=Alignment(horizontal="center", vertical="center", wrap_text=True),
+    )
+    return cabecalho, corpo
+
+def linhas_do_dataframe(df):
+    """Linhas do DataFrame como tuplas de valores Python (NaN vira célula vazia)."""
+    return df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+def escrever_relatorio_excel(caminho, colunas, linhas, aba='Detalhe_Notas'):
+    """
+    Grava o relatório numa única passada (openpyxl write_only): cabeçalho
+    destacado, largura das colunas, altura das linhas e células centralizadas
+    com quebra de texto. As linhas vão direto para o arquivo conforme são
+    consumidas, então `linhas` pode ser qualquer iterável (inclusive um gerador)
+    e a memória não cresce com o número de notas.
+    """
+    carregar_planilhas()
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(aba)
+    cabecalho, corpo = estilos_relatorio()
+    wb.add_named_style(cabecalho)
+    wb.add_named_style(corpo)
+
+    # No modo write_only dimensões só podem ser definidas antes da primeira linha
+    for col in range(1, len(colunas) + 1):
+        ws.column_dimensions[get_column_letter(col)].width = LARGURA_COLUNA_RELATORIO
+    ws.sheet_format.defaultRowHeight = ALTURA_LINHA_RELATORIO
+    ws.sheet_format.customHeight = True
+
+    def celula(valor, estilo):
+        c = WriteOnlyCell(ws, valor)
+        c.style = estilo
+        return c
+
+    ws.append([celula(nome, cabecalho.name) for nome in colunas])
+    for linha in linhas:
+        ws.append([celula(valor, corpo.name) for valor in linha])
+    wb.save(caminho)
+
+# Campo do XML -> coluna do relatório, na ordem da planilha (as duas últimas só
+# aparecem em Tomados, quando há DANFSe)
+COLUNAS_RELATORIO = {
+    'arquivo': 'Arquivo', 'numero_nota': 'Número da Nota', 'emitente_nome': 'Emitente',
+    'emitente_cnpj': 'CNPJ Emitente', 'tomador_nome': 'Tomador', 'tomador_cnpj': 'CNPJ Tomador',
+    'data_emissao': 'Data Emissão', 'valor_bc': 'Valor BC', 'valor_liq': 'Valor Líquido',
+    'valor_servico': 'Valor Serviço', 'descricao_serv': 'Descrição Serviço', 'codigo_serv': 'Cód. Serviço',
+    'situacao': 'Situação', 'total_retencoes': 'Total Retenções',
+    'irrf': 'IRRF', 'cp': 'CP', 'csll': 'CSLL', 'pis': 'PIS', 'cofins': 'COFINS',
+    'iss_retido': 'ISS RETIDO?', 'valor_iss_retido': 'VALOR DO ISS',
+    'optante_simples': 'OPTANTE PELO SIMPLES?', 'regime_apuracao': 'REGIME DE APURAÇÃO'
+}
+
+def caminhos_xml(pasta_empresa):
     for root_dir, _, files in os.walk(pasta_empresa):
         for f in files:
             if f.lower().endswith('.xml'):
-                xml_paths.append(os.path.join(root_dir, f))
-
-    dados = []
-    for caminho in tqdm(xml_paths, desc=f"Processando {os.path.basename(pasta_empresa)}"):
-        data = parse_xml_por_nota(caminho, situacoes_dict)
-        if data and (not data['data_emissao'] or mesma_competencia(data['data_emissao'], competencia_str)):
-            # Adicionar dados do PDF para Tomados
-            if MODO == 'tomados':
-                pdf_dir = os.path.dirname(caminho).replace('XML', 'PDF')
-                pdf_nome = f"NFSE N° {data['numero_nota']}.pdf"
-                pdf_path = os.path.join(pdf_dir, pdf_nome)
-                if os.path.exists(pdf_path):
-                    texto_pdf = extrair_texto_pdf(pdf_path)
-                    dados_pdf = parse_dados_nfse_pdf(texto_pdf)
-                    data['optante_simples'] = dados_pdf.get('simples_nacional', 'N/A')
-                    data['regime_apuracao'] = dados_pdf.get('regime_apuracao', 'N/A')
-            dados.append(data)
+                yield os.path.join(root_dir, f)
+
+def em_lotes(iteravel, tamanho):
+    iterador = iter(iteravel)
+    while True:
+        lote = list(islice(iterador, tamanho))
+        if not lote:
+            return
+        yield lote
 
-    if not dados:
+def gerar_relatorio_para_empresa(pasta_base, pasta_empresa, competencia_str, situacoes_dict, log_fn=print):
+    carregar_planilhas()
+    xml_paths = list(islice(caminhos_xml(pasta_empresa), LIMITE_RELATORIO_EM_FLUXO + 1))
+    if len(xml_paths) > LIMITE_RELATORIO_EM_FLUXO:
+        return gerar_relatorio_em_fluxo(pasta_base, pasta_empresa, competencia_str, situacoes_dict, log_fn)
+
+    with closing(abrir_indice_notas(pasta_base)) as con:
+        parseados = parse_xmls_com_cache(con, xml_paths, situacoes_dict, log_fn)
+        descartar_cache_sumido(con, pasta_empresa)
+    lidos = [(caminho, data) for caminho, data in zip(xml_paths, parseados) if data]
+    if not lidos:
+        log_fn(f"Nenhum dado encontrado em {os.path.basename(pasta_empresa)}")
+        return
+    df = pd.DataFrame([data for _, data in lidos])
+    caminhos = pd.Series([caminho for caminho, _ in lidos], dtype=object)
+
+    # Datas convertidas uma única vez; a competência vira uma máscara sobre o mês
+    # (notas sem data continuam no relatório, como antes)
+    datas = pd.to_datetime(df['data_emissao'], format='%d/%m/%Y', errors='coerce')
+    (ano_ini, mes_ini), (ano_fim, mes_fim) = limites_competencia(competencia_str)
+    meses = datas.dt.year * 12 + datas.dt.month
+    mascara = df['data_emissao'].fillna('').eq('') | meses.between(ano_ini * 12 + mes_ini, ano_fim * 12 + mes_fim)
+    df = df[mascara].reset_index(drop=True)
+    datas = datas[mascara].reset_index(drop=True)
+    caminhos = caminhos[mascara].reset_index(drop=True)
+
+    # Dados do DANFSe para Tomados, lidos em lote
+    if MODO == 'tomados' and len(df):
+        pdf_paths = [os.path.join(os.path.dirname(caminho).replace('XML', 'PDF'), f"NFSE N° {numero}.pdf")
+                     for caminho, numero in zip(caminhos, df['numero_nota'])]
+        com_pdf = [i for i, pdf_path in enumerate(pdf_paths) if os.path.exists(pdf_path)]
+        if com_pdf:
+            extraidos = extrair_dados_pdfs_com_cache(pasta_base, [pdf_paths[i] for i in com_pdf], log_fn)
+            for coluna, campo in (('optante_simples', 'simples_nacional'), ('regime_apuracao', 'regime_apuracao')):
+                valores = pd.Series(None, index=df.index, dtype=object)
+                valores.iloc[com_pdf] = [d.get(campo, 'N/A') for d in extraidos]
+                df[coluna] = valores
+
+    if df.empty:
         log_fn(f"Nenhum dado encontrado em {os.path.basename(pasta_empresa)}")
         return
 
-    df = pd.DataFrame(dados)
+    with medir_fase("gravar dataset"):
+        gravar_notas_no_dataset(pasta_base, competencia_str, df, log_fn, datas)
+
+    # Ordem cronológica pela data de verdade (não pelo texto dd/mm/aaaa) e pelo número como inteiro
+    df = (df.assign(_data=datas, _numero=pd.to_numeric(df['numero_nota'], errors='coerce'))
+            .sort_values(['_data', '_numero'], kind='mergesort')
+            .drop(columns=['_data', '_numero'])
+            .reset_index(drop=True))
     tipo = 'Tomados' if MODO == 'tomados' else 'Prestados'
-    df.rename(columns={
-        'arquivo': 'Arquivo', 'numero_nota': 'Número da Nota', 'emitente_nome': 'Emitente',
-        'emitente_cnpj': 'CNPJ Emitente', 'tomador_nome': 'Tomador', 'tomador_cnpj': 'CNPJ Tomador',
-        'data_emissao': 'Data Emissão', 'valor_bc': 'Valor BC', 'valor_liq': 'Valor Líquido',
-        'valor_servico': 'Valor Serviço', 'descricao_serv': 'Descrição Serviço', 'codigo_serv': 'Cód. Serviço',
-        'situacao': 'Situação', 'total_retencoes': 'Total Retenções',
-        'irrf': 'IRRF', 'cp': 'CP', 'csll': 'CSLL', 'pis': 'PIS', 'cofins': 'COFINS',
-        'iss_retido': 'ISS RETIDO?', 'valor_iss_retido': 'VALOR DO ISS',
-        'optante_simples': 'OPTANTE PELO SIMPLES?', 'regime_apuracao': 'REGIME DE APURAÇÃO'
-    }, inplace=True)
+    df.rename(columns=COLUNAS_RELATORIO, inplace=True)
 
     # Reordenar colunas para colocar VALOR DO ISS logo após ISS RETIDO?
     if 'ISS RETIDO?' in df.columns and 'VALOR DO ISS' in df.columns:
@@ -486,32 +1999,16 @@ def gerar_relatorio_para_empresa(pasta_base, pasta_empresa, competencia_str, sit
             cols.insert(idx + 1, cols.pop(cols.index('VALOR DO ISS')))
         df = df[cols]
 
-    df.sort_values(by=['Data Emissão', 'Número da Nota'], inplace=True, ignore_index=True)
-    for col in df.select_dtypes(include='object').columns:
-        df[col].replace('', 'N/A', inplace=True)
-        df[col].fillna('N/A', inplace=True)
+    # Texto vazio ou ausente vira N/A, numa passada só sobre as colunas de texto
+    texto = df.select_dtypes(include='object').columns
+    df[texto] = df[texto].mask(df[texto].isna() | df[texto].eq(''), 'N/A')
 
     nome_legivel = os.path.basename(pasta_empresa)
     rel_path = os.path.join(pasta_empresa, f"Relatório {tipo} - {nome_legivel} - {competencia_str.replace('/', '_')}.xlsx")
 
-    with pd.ExcelWriter(rel_path, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Detalhe_Notas', index=False)
-
-    wb = load_workbook(rel_path)
-    ws = wb['Detalhe_Notas']
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="4F81B3", fill_type="solid")
-    for col in range(1, ws.max_column + 1):
-        cell = ws.cell(1, col)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-        ws.column_dimensions[get_column_letter(col)].width = 15.43
-    for row in ws.iter_rows(min_row=1, max_row=ws.max_row):
-        ws.row_dimensions[row[0].row].height = 17.25
-        for cell in row:
-            cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    wb.save(rel_path)
+    with medir_fase("gravar planilha"):
+        escrever_relatorio_excel(rel_path, list(df.columns), linhas_do_dataframe(df))
+    contar("relatórios")
 
     log_fn("="*80)
     log_fn(f"RELATÓRIO GERADO: {nome_legivel}")
@@ -519,59 +2016,1245 @@ def gerar_relatorio_para_empresa(pasta_base, pasta_empresa, competencia_str, sit
     log_fn(f"Arquivo: {rel_path}")
     log_fn("="*80)
 
-def organizar_xmls_e_gerar_relatorios_rodada(pasta_base, competencia_str, novos_xmls, situacoes_dict, log_fn=print):
+def valor_da_celula(valor):
+    """Texto vazio ou ausente vira N/A, como no relatório montado em DataFrame."""
+    return 'N/A' if valor is None or valor == '' else valor
+
+def gerar_relatorio_em_fluxo(pasta_base, pasta_empresa, competencia_str, situacoes_dict, log_fn=print):
+    """
+    Mesmo relatório de gerar_relatorio_para_empresa, com memória limitada, para
+    empresas muito grandes. Os XMLs (e os DANFSe, em Tomados) são lidos em lotes.
+    As linhas da competência vão para uma base SQLite temporária, que devolve a
+    ordem cronológica, e de lá direto para a planilha; os totais são somados
+    no caminho.
+    """
+    carregar_planilhas()
+    (ano_ini, mes_ini), (ano_fim, mes_fim) = limites_competencia(competencia_str)
+    primeiro, ultimo = ano_ini * 12 + mes_ini, ano_fim * 12 + mes_fim
+    campos = list(COLUNAS_RELATORIO)
+    total_notas = 0
+    total_liquido = 0.0
+    com_pdf = False
+    descritor, temporario = tempfile.mkstemp(prefix="relatorio_", suffix=".sqlite3")
+    os.close(descritor)
+    dataset = DatasetEmFluxo(pasta_base, competencia_str, log_fn)
+    try:
+        with closing(sqlite3.connect(temporario)) as ordem, closing(abrir_indice_notas(pasta_base)) as indice:
+            ordem.execute("CREATE TABLE linhas (data TEXT, numero REAL, linha TEXT)")
+            lidos = 0
+            for lote in em_lotes(caminhos_xml(pasta_empresa), LOTE_RELATORIO_EM_FLUXO):
+                notas = []
+                for caminho, data in zip(lote, parse_xmls_com_cache(indice, lote, situacoes_dict, log_fn)):
+                    if not data:
+                        continue
+                    d = data['data_emissao']
+                    if d and not primeiro <= int(d[6:10]) * 12 + int(d[3:5]) <= ultimo:
+                        continue
+                    notas.append((caminho, data))
+                lidos += len(lote)
+
+                if MODO == 'tomados' and notas:
+                    pdf_paths = [os.path.join(os.path.dirname(caminho).replace('XML', 'PDF'),
+                                              f"NFSE N° {data['numero_nota']}.pdf") for caminho, data in notas]
+                    existentes = [i for i, pdf_path in enumerate(pdf_paths) if os.path.exists(pdf_path)]
+                    extraidos = extrair_dados_pdfs_com_cache(pasta_base, [pdf_paths[i] for i in existentes], log_fn)
+                    for i, dados_pdf in zip(existentes, extraidos):
+                        notas[i][1]['optante_simples'] = dados_pdf.get('simples_nacional', 'N/A')
+                        notas[i][1]['regime_apuracao'] = dados_pdf.get('regime_apuracao', 'N/A')
+                    com_pdf = com_pdf or bool(existentes)
+                if not notas:
+                    continue
+
+                with medir_fase("gravar dataset"):
+                    dataset.gravar(pd.DataFrame([data for _, data in notas]))
+                linhas = []
+                for _, data in notas:
+                    d = data['data_emissao']
+                    try:
+                        numero = float(data['numero_nota'])
+                    except ValueError:
+                        numero = None
+                    valores = [valor_da_celula(data.get(c)) for c in campos]
+                    linhas.append((f"{d[6:10]}-{d[3:5]}-{d[:2]}" if d else None, numero,
+                                   json.dumps(valores, ensure_ascii=False)))
+                    total_liquido += data['valor_liq']
+                ordem.executemany("INSERT INTO linhas (data, numero, linha) VALUES (?, ?, ?)", linhas)
+                total_notas += len(linhas)
+                log_fn(f"{os.path.basename(pasta_empresa)}: {lidos} XML(s) lido(s), {total_notas} na competência")
+            descartar_cache_sumido(indice, pasta_empresa)
+            dataset.fechar()
+
+            if not total_notas:
+                log_fn(f"Nenhum dado encontrado em {os.path.basename(pasta_empresa)}")
+                return
+            ordem.commit()
+            # Sem DANFSe em nenhuma nota as duas colunas do PDF ficam de fora, como no outro caminho
+            n_colunas = len(campos) if com_pdf else len(campos) - 2
+            linhas_ordenadas = (json.loads(linha)[:n_colunas] for linha, in ordem.execute(
+                "SELECT linha FROM linhas ORDER BY data IS NULL, data, numero IS NULL, numero, rowid"))
+
+            tipo = 'Tomados' if MODO == 'tomados' else 'Prestados'
+            nome_legivel = os.path.basename(pasta_empresa)
+            rel_path = os.path.join(pasta_empresa, f"Relatório {tipo} - {nome_legivel} - {competencia_str.replace('/', '_')}.xlsx")
+            with medir_fase("gravar planilha"):
+                escrever_relatorio_excel(rel_path, [COLUNAS_RELATORIO[c] for c in campos[:n_colunas]], linhas_ordenadas)
+            contar("relatórios")
+    finally:
+        dataset.descartar()
+        try:
+            os.remove(temporario)
+        except OSError:
+            pass
+
+    log_fn("="*80)
+    log_fn(f"RELATÓRIO GERADO: {nome_legivel}")
+    log_fn(f"Total notas: {total_notas} | Líquido: R$ {total_liquido:,.2f}")
+    log_fn(f"Arquivo: {rel_path}")
+    log_fn("="*80)
+
+def organizar_xmls_e_gerar_relatorios_rodada(pasta_base, competencia_str, novos_xmls, situacoes_dict, log_fn=print, pasta_origem=None):
+    """
+    Move os XMLs/PDFs recém-baixados de `pasta_origem` (padrão: a própria
+    pasta_base) para as pastas das empresas e regenera os relatórios delas.
+    """
+    with LOCK_ORGANIZACAO:
+        _organizar_xmls_e_gerar_relatorios(pasta_base, competencia_str, novos_xmls, situacoes_dict, log_fn,
+                                           pasta_origem or pasta_base)
+    registrar_no_diario(pasta_base, 'organizado', competencia_str, arquivos=list(novos_xmls),
+                        pasta=os.path.relpath(pasta_origem or pasta_base, pasta_base))
+
+def _organizar_xmls_e_gerar_relatorios(pasta_base, competencia_str, novos_xmls, situacoes_dict, log_fn, pasta_origem):
     global NOTAS_EXISTENTES, PDF_POR_ARQUIVO
     empresas = set()
     empresa_nomes = {}
     key_cnpj = 'tomador_cnpj' if MODO == 'tomados' else 'emitente_cnpj'
     key_nome = 'tomador_nome' if MODO == 'tomados' else 'emitente_nome'
-    for xml_file in novos_xmls:
-        caminho = os.path.join(pasta_base, xml_file)
-        data = parse_xml_por_nota(caminho, situacoes_dict)
-        if not data:
-            try: os.remove(caminho)
-            except: pass
-            continue
+    # Intervalo de vários meses: cada nota vai para a subpasta do seu mês (AAAA-MM)
+    varios_meses = len(meses_da_competencia(competencia_str)) > 1
+    with closing(abrir_indice_notas(pasta_base)) as indice:
+        for xml_file in novos_xmls:
+            caminho = os.path.join(pasta_origem, xml_file)
+            data = parse_xml_por_nota(caminho, situacoes_dict)
+            if not data:
+                try: os.remove(caminho)
+                except: pass
+                continue
 
-        chave = (data[key_cnpj], data['numero_nota'])
-        if chave in NOTAS_EXISTENTES:
-            log_fn(f"Duplicado ignorado: {data['numero_nota']}")
-            try: os.remove(caminho)
-            except: pass
-            pdf_assoc = PDF_POR_ARQUIVO.get(xml_file)
-            if pdf_assoc:
-                pdf_path = os.path.join(pasta_base, pdf_assoc)
-                try: os.remove(pdf_path)
+            chave = (data[key_cnpj], data['numero_nota'])
+            if chave in NOTAS_EXISTENTES:
+                log_fn(f"Duplicado ignorado: {data['numero_nota']}")
+                try: os.remove(caminho)
                 except: pass
+                remover_nota_do_indice(indice, caminho)
+                pdf_assoc = PDF_POR_ARQUIVO.get(xml_file)
+                if pdf_assoc:
+                    pdf_path = os.path.join(pasta_origem, pdf_assoc)
+                    try: os.remove(pdf_path)
+                    except: pass
+                continue
+            NOTAS_EXISTENTES.add(chave)
+
+            cnpj_emp = data[key_cnpj]
+            if cnpj_emp not in empresa_nomes:
+                empresa_nomes[cnpj_emp] = limpar_nome_empresa(data[key_nome])
+            nome_pasta = empresa_nomes[cnpj_emp]
+            pasta_emp = os.path.join(pasta_base, nome_pasta)
+            competencia_nota = competencia_da_nota(data['data_emissao'], competencia_str)
+            subpasta = "Canceladas" if data.get('situacao') == "Cancelada" else "Autorizadas"
+            if varios_meses:
+                dest = os.path.join(pasta_emp, competencia_da_data(f"01/{competencia_nota}"), subpasta)
+            else:
+                dest = os.path.join(pasta_emp, subpasta)
+            dest_xml = os.path.join(dest, "XML")
+            dest_pdf = os.path.join(dest, "PDF")
+            os.makedirs(dest_xml, exist_ok=True)
+            os.makedirs(dest_pdf, exist_ok=True)
+            destino_xml = os.path.join(dest_xml, xml_file)
+            with medir_fase("mover arquivos"):
+                os.replace(caminho, destino_xml)
+            contar("XMLs movidos")
+            remover_nota_do_indice(indice, caminho)
+            registrar_nota_no_indice(indice, destino_xml, data, data.get('situacao'))
+            registrar_cache_xml(indice, destino_xml, data)
+            indice.commit()
+
+            pdf_file = PDF_POR_ARQUIVO.get(xml_file)
+            if pdf_file:
+                pdf_path = os.path.join(pasta_origem, pdf_file)
+                if os.path.exists(pdf_path):
+                    novo_nome = f"NFSE N° {data['numero_nota'] or 'S_N'}.pdf"
+                    with medir_fase("mover arquivos"):
+                        os.replace(pdf_path, os.path.join(dest_pdf, novo_nome))
+
+            empresas.add((pasta_emp, competencia_nota))
+
+    # Um relatório por empresa e mês afetado
+    for emp, competencia_nota in sorted(empresas):
+        gerar_relatorio_para_empresa(pasta_base, emp, competencia_nota, situacoes_dict, log_fn)
+
+# ============================= DATASET CONSOLIDADO (PARQUET) =============================
+# Cada relatório gerado também grava as notas da empresa/mês (campos do XML +
+# do DANFSe) numa partição Parquet, substituída por inteiro a cada geração.
+# O resumo consolidado lê só as colunas de valores dessas partições, sem abrir
+# nenhum XML nem planilha.
+
+COLUNAS_TEXTO_DATASET = [
+    'arquivo', 'numero_nota', 'emitente_nome', 'emitente_cnpj', 'tomador_nome', 'tomador_cnpj',
+    'descricao_serv', 'codigo_serv', 'situacao', 'iss_retido', 'optante_simples', 'regime_apuracao',
+]
+COLUNAS_VALOR_DATASET = [
+    'valor_bc', 'valor_liq', 'valor_servico', 'total_retencoes',
+    'irrf', 'cp', 'csll', 'pis', 'cofins', 'valor_iss_retido',
+]
+_AVISO_SEM_PYARROW = []
+
+def esquema_dataset():
+    return pa.schema([('data_emissao', pa.date32())]
+                     + [(c, pa.string()) for c in COLUNAS_TEXTO_DATASET]
+                     + [(c, pa.float64()) for c in COLUNAS_VALOR_DATASET])
+
+def particionamento_dataset():
+    return ds.partitioning(pa.schema([('modo', pa.string()), ('competencia', pa.string()), ('cnpj', pa.string())]),
+                           flavor='hive')
+
+def avisar_sem_pyarrow(log_fn):
+    if not _AVISO_SEM_PYARROW:
+        _AVISO_SEM_PYARROW.append(True)
+        log_fn("pyarrow não instalado: dataset consolidado (Parquet) desativado.")
+
+def tabelas_do_dataset(df, datas=None):
+    """(cnpj, tabela Arrow) para cada CNPJ das notas de `df` (colunas com os nomes de extrair_campos_xml)."""
+    carregar_planilhas()
+    key_cnpj = 'tomador_cnpj' if MODO == 'tomados' else 'emitente_cnpj'
+    if datas is None:
+        datas = pd.to_datetime(df['data_emissao'], format='%d/%m/%Y', errors='coerce')
+    df = df.assign(data_emissao=datas.dt.date)
+    df = df.reindex(columns=['data_emissao'] + COLUNAS_TEXTO_DATASET + COLUNAS_VALOR_DATASET)
+    df[COLUNAS_VALOR_DATASET] = df[COLUNAS_VALOR_DATASET].fillna(0.0).astype(float)
+
+    esquema = esquema_dataset()
+    for cnpj, notas in df.groupby(df[key_cnpj].fillna('').replace('', 'sem_cnpj'), sort=False):
+        colunas = {'data_emissao': pa.array(notas['data_emissao'], type=pa.date32(), from_pandas=True)}
+        for c in COLUNAS_TEXTO_DATASET:
+            colunas[c] = pa.array(notas[c].map(str, na_action='ignore'), type=pa.string(), from_pandas=True)
+        for c in COLUNAS_VALOR_DATASET:
+            colunas[c] = pa.array(notas[c], type=pa.float64())
+        yield cnpj, pa.table(colunas, schema=esquema)
+
+def arquivo_do_dataset(pasta_base, competencia_str, cnpj):
+    competencia = competencia_da_data(f"01/{competencia_str}")
+    pasta = os.path.join(pasta_base, PASTA_DATASET, f"modo={MODO}", f"competencia={competencia}", f"cnpj={cnpj}")
+    os.makedirs(pasta, exist_ok=True)
+    return os.path.join(pasta, "notas.parquet")
+
+def gravar_notas_no_dataset(pasta_base, competencia_str, df, log_fn=print, datas=None):
+    """
+    Substitui as partições (modo, competência, CNPJ) da empresa pelas notas de
+    `df` (colunas com os nomes de extrair_campos_xml). `datas` são as datas de
+    emissão já convertidas, quando quem chama as tem.
+    """
+    if not carregar_pyarrow():
+        avisar_sem_pyarrow(log_fn)
+        return
+    for cnpj, tabela in tabelas_do_dataset(df, datas):
+        destino = arquivo_do_dataset(pasta_base, competencia_str, cnpj)
+        # Grava ao lado e troca: quem estiver lendo o dataset nunca vê um arquivo pela metade
+        pq.write_table(tabela, destino + ".tmp")
+        os.replace(destino + ".tmp", destino)
+
+class DatasetEmFluxo:
+    """
+    gravar_notas_no_dataset em lotes, para o relatório em fluxo: cada lote vira
+    um row group do arquivo da partição, e os arquivos só substituem os
+    anteriores em fechar().
+    """
+    def __init__(self, pasta_base, competencia_str, log_fn=print):
+        self.pasta_base = pasta_base
+        self.competencia_str = competencia_str
+        self.log_fn = log_fn
+        self.escritores = {}  # cnpj -> (destino, ParquetWriter)
+
+    def gravar(self, df):
+        if not carregar_pyarrow():
+            avisar_sem_pyarrow(self.log_fn)
+            return
+        for cnpj, tabela in tabelas_do_dataset(df):
+            if cnpj not in self.escritores:
+                destino = arquivo_do_dataset(self.pasta_base, self.competencia_str, cnpj)
+                self.escritores[cnpj] = (destino, pq.ParquetWriter(destino + ".tmp", tabela.schema))
+            self.escritores[cnpj][1].write_table(tabela)
+
+    def fechar(self):
+        for destino, escritor in self.escritores.values():
+            escritor.close()
+            os.replace(destino + ".tmp", destino)
+        self.escritores = {}
+
+    def descartar(self):
+        """Apaga o que foi gravado sem fechar (erro no meio do relatório)."""
+        for destino, escritor in self.escritores.values():
+            try:
+                escritor.close()
+                os.remove(destino + ".tmp")
+            except OSError:
+                pass
+        self.escritores = {}
+
+def gerar_resumo_consolidado(pastas_base, competencia_str, destino=None, log_fn=print):
+    """
+    Soma valores e retenções (IRRF, CP, CSLL, PIS, COFINS, ISS retido) de todas
+    as empresas a partir do dataset das `pastas_base` (ex.: Prestados e Tomados).
+    Notas canceladas entram só na contagem. Grava a planilha em `destino`
+    (padrão: "Resumo Consolidado - MM_AAAA.xlsx" na primeira pasta) e devolve o DataFrame.
+    """
+    if not carregar_pyarrow():
+        raise RuntimeError("o resumo consolidado precisa do pyarrow (pip install pyarrow)")
+    carregar_planilhas()
+    raizes = [os.path.join(p, PASTA_DATASET) for p in pastas_base if os.path.isdir(os.path.join(p, PASTA_DATASET))]
+    if not raizes:
+        log_fn("Nenhum dataset encontrado nas pastas informadas.")
+        return None
+    dataset = ds.dataset([ds.dataset(r, format='parquet', partitioning=particionamento_dataset()) for r in raizes])
+    competencias = [competencia_da_data(f"01/{m}") for m in meses_da_competencia(competencia_str)]
+    colunas = ['modo', 'cnpj', 'emitente_nome', 'tomador_nome', 'situacao'] + COLUNAS_VALOR_DATASET
+    tabela = dataset.to_table(columns=colunas, filter=ds.field('competencia').isin(competencias))
+    if not tabela.num_rows:
+        log_fn(f"Nenhuma nota da competência {competencia_str} no dataset.")
+        return None
+
+    df = tabela.to_pandas()
+    df['empresa'] = df['tomador_nome'].where(df['modo'] == 'tomados', df['emitente_nome'])
+    df['cancelada'] = df['situacao'] == 'Cancelada'
+    valores = df[COLUNAS_VALOR_DATASET].where(~df['cancelada'], 0.0)
+    df = pd.concat([df[['modo', 'cnpj', 'empresa', 'cancelada']], valores], axis=1)
+    resumo = df.groupby(['modo', 'cnpj'], sort=True).agg(
+        empresa=('empresa', 'first'), notas=('cancelada', 'size'), canceladas=('cancelada', 'sum'),
+        **{c: (c, 'sum') for c in COLUNAS_VALOR_DATASET}).reset_index()
+    # Linha de TOTAL no fim do bloco de cada modo
+    blocos = []
+    for modo, grupo in resumo.groupby('modo', sort=True):
+        total = grupo[['notas', 'canceladas'] + COLUNAS_VALOR_DATASET].sum()
+        blocos += [grupo, pd.DataFrame([{'modo': modo, 'cnpj': '', 'empresa': 'TOTAL', **total}])]
+    resumo = pd.concat(blocos, ignore_index=True)
+    resumo[['notas', 'canceladas']] = resumo[['notas', 'canceladas']].astype(int)
+    resumo['modo'] = resumo['modo'].str.capitalize()
+    resumo[COLUNAS_VALOR_DATASET] = resumo[COLUNAS_VALOR_DATASET].round(2)
+    resumo.rename(columns={
+        'modo': 'Modo', 'cnpj': 'CNPJ', 'empresa': 'Empresa', 'notas': 'Notas', 'canceladas': 'Canceladas',
+        'valor_bc': 'Valor BC', 'valor_liq': 'Valor Líquido', 'valor_servico': 'Valor Serviço',
+        'total_retencoes': 'Total Retenções', 'irrf': 'IRRF', 'cp': 'CP', 'csll': 'CSLL', 'pis': 'PIS',
+        'cofins': 'COFINS', 'valor_iss_retido': 'VALOR DO ISS',
+    }, inplace=True)
+
+    destino = destino or os.path.join(pastas_base[0], f"Resumo Consolidado - {competencia_str.replace('/', '_')}.xlsx")
+    escrever_relatorio_excel(destino, list(resumo.columns), linhas_do_dataframe(resumo), aba='Resumo')
+    for _, linha in resumo[resumo['Empresa'] == 'TOTAL'].iterrows():
+        log_fn(f"{linha['Modo']}: {linha['Notas']} notas | Retenções R$ {linha['Total Retenções']:,.2f} | "
+               f"ISS retido R$ {linha['VALOR DO ISS']:,.2f}")
+    log_fn(f"Resumo consolidado: {destino}")
+    return resumo
+
+# ============================= DIÁRIO DE EXECUÇÃO =============================
+# _diario_execucao_<modo>_<competência>.jsonl na raiz da pasta de downloads: uma
+# linha JSON por evento, só acrescentada e gravada em disco (fsync) na hora.
+# Eventos por empresa:
+#   inicio     - começo do download da empresa (cnpj, página de retomada)
+#   pagina     - página concluída: número, linhas lidas, pasta de entrada e
+#                arquivos baixados (XML, PDF, situação e número de cada nota)
+#   parcial    - o mesmo para a página em andamento quando a execução falhou
+#   fim        - lista percorrida até o fim (ou até a nota anterior à competência)
+#   organizado - XMLs de uma pasta de entrada movidos para as pastas das empresas
+# Uma empresa com "pagina" depois do último "fim" foi interrompida: a próxima
+# execução pula as páginas já concluídas, e os XMLs que ficaram na entrada são
+# organizados (reconciliar_pendentes) em vez de baixados de novo. Uma execução
+# que termina sem nada pendente apaga o diário (encerrar_diario): ele só guarda
+# o que a próxima execução precisa retomar, não o histórico.
+
+ARQUIVO_DIARIO = "_diario_execucao_{modo}_{competencia}.jsonl"
+LOCK_DIARIO = threading.Lock()
+
+def arquivo_diario(pasta_base, competencia_str):
+    return os.path.join(pasta_base, ARQUIVO_DIARIO.format(modo=MODO, competencia=competencia_str.replace('/', '_')))
+
+def registrar_no_diario(pasta_base, evento, competencia_str, **campos):
+    linha = json.dumps({'ev': evento, 'ts': datetime.datetime.now().isoformat(timespec='seconds'), 'modo': MODO,
+                        'competencia': competencia_str, **campos}, ensure_ascii=False)
+    with LOCK_DIARIO, open(arquivo_diario(pasta_base, competencia_str), 'a+b') as f:
+        # Última linha cortada por uma queda no meio da gravação não pode grudar na próxima
+        if f.tell():
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+        f.write(linha.encode('utf-8') + b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def ler_diario(pasta_base, competencia_str):
+    """Eventos do diário para o modo atual e a competência, na ordem em que foram gravados."""
+    eventos = []
+    try:
+        with open(arquivo_diario(pasta_base, competencia_str), encoding='utf-8') as f:
+            for linha in f:
+                try:
+                    ev = json.loads(linha)
+                except ValueError:
+                    continue
+                if ev.get('modo') == MODO and ev.get('competencia') == competencia_str:
+                    eventos.append(ev)
+    except FileNotFoundError:
+        pass
+    return eventos
+
+def ponto_de_retomada(pasta_base, competencia_str, cnpj):
+    """Última página concluída de uma execução interrompida da empresa (0 = começar do início)."""
+    ultima = 0
+    for ev in ler_diario(pasta_base, competencia_str):
+        if ev.get('cnpj') != cnpj:
+            continue
+        if ev['ev'] == 'pagina':
+            ultima = max(ultima, ev['pagina'])
+        elif ev['ev'] == 'fim':
+            ultima = 0
+    return ultima
+
+def iniciar_empresa_no_diario(empresa, competencia_str, log_fn=print):
+    """Assim que o CNPJ da empresa é conhecido: lê o ponto de retomada e registra o início."""
+    if 'retomar_apos' in empresa or not empresa.get('pasta_base') or not empresa.get('cnpj'):
+        return
+    empresa['retomar_apos'] = ponto_de_retomada(empresa['pasta_base'], competencia_str, empresa['cnpj'])
+    if empresa['retomar_apos']:
+        log_fn(f"Execução anterior interrompida: retomando depois da página {empresa['retomar_apos']}")
+    registrar_no_diario(empresa['pasta_base'], 'inicio', competencia_str, cnpj=empresa['cnpj'],
+                        retomar_apos=empresa['retomar_apos'])
+
+def pagina_ja_concluida(empresa, pagina):
+    return pagina <= empresa.get('retomar_apos', 0)
+
+def concluir_pagina(empresa, pagina, competencia_str, pasta, log_fn=print):
+    """
+    Registra a página no diário com os arquivos baixados desde a última
+    registrada; pagina=None marca uma página interrompida (evento "parcial").
+    """
+    iniciar_empresa_no_diario(empresa, competencia_str, log_fn)
+    if 'retomar_apos' not in empresa:
+        return
+    evento = 'pagina' if pagina is not None else 'parcial'
+    registrar_no_diario(empresa['pasta_base'], evento, competencia_str, cnpj=empresa['cnpj'], pagina=pagina,
+                        linhas=empresa.pop('linhas', 0), pasta=os.path.relpath(pasta, empresa['pasta_base']),
+                        arquivos=empresa.pop('arquivos', []))
+
+def reconciliar_pendentes(pasta_base, competencia_str, log_fn=print):
+    """
+    Organiza os XMLs que uma execução interrompida baixou (registrados no
+    diário) mas não chegou a mover, com a situação e o PDF anotados no diário.
+    Devolve quantos foram entregues ao organizador.
+    """
+    total = 0
+    for pasta_rel, arquivos in sorted(arquivos_pendentes(pasta_base, ler_diario(pasta_base, competencia_str)).items()):
+        pasta = os.path.normpath(os.path.join(pasta_base, pasta_rel))
+        novos = sorted(arquivos)
+        situacoes_dict = {}
+        for xml in novos:
+            arquivo = arquivos[xml]
+            SITUACOES_POR_ARQUIVO[xml] = arquivo['situacao']
+            if arquivo.get('pdf'):
+                PDF_POR_ARQUIVO[xml] = arquivo['pdf']
+            if arquivo.get('numero'):
+                situacoes_dict[arquivo['numero']] = arquivo['situacao']
+        log_fn(f"Retomada: {len(novos)} XML(s) baixados por uma execução interrompida em {pasta_rel}; organizando")
+        organizar_xmls_e_gerar_relatorios_rodada(pasta_base, competencia_str, novos, situacoes_dict, log_fn,
+                                                 pasta_origem=pasta)
+        total += len(novos)
+    return total
+
+def arquivos_pendentes(pasta_base, eventos):
+    """{pasta de entrada: {xml: arquivo do diário}} baixados, ainda na entrada e não organizados."""
+    pendentes = {}
+    for ev in eventos:
+        if ev['ev'] in ('pagina', 'parcial'):
+            for arquivo in ev['arquivos']:
+                pendentes.setdefault(ev['pasta'], {})[arquivo['xml']] = arquivo
+        elif ev['ev'] == 'organizado':
+            for xml in ev['arquivos']:
+                pendentes.get(ev['pasta'], {}).pop(xml, None)
+    for pasta_rel, arquivos in list(pendentes.items()):
+        pasta = os.path.normpath(os.path.join(pasta_base, pasta_rel))
+        for xml in [x for x in arquivos if not os.path.exists(os.path.join(pasta, x))]:
+            del arquivos[xml]
+        if not arquivos:
+            del pendentes[pasta_rel]
+    return pendentes
+
+def encerrar_diario(pasta_base, competencia_str, log_fn=print):
+    """
+    No fim da execução: apaga o diário da competência se toda empresa chegou
+    ao "fim" e não sobrou XML para organizar; senão ele fica para a retomada.
+    """
+    eventos = ler_diario(pasta_base, competencia_str)
+    ultimo = {}
+    for ev in eventos:
+        if ev.get('cnpj'):
+            ultimo[ev['cnpj']] = ev['ev']
+    interrompidas = [cnpj for cnpj, ev in ultimo.items() if ev != 'fim']
+    if interrompidas or arquivos_pendentes(pasta_base, eventos):
+        log_fn(f"Diário mantido para a retomada ({len(interrompidas)} empresa(s) interrompida(s))")
+        return False
+    try:
+        os.remove(arquivo_diario(pasta_base, competencia_str))
+    except FileNotFoundError:
+        pass
+    return True
+
+# ============================= ATUALIZAÇÃO DA SITUAÇÃO =============================
+# Notas canceladas depois do download continuam em Autorizadas. A atualização
+# só da situação percorre a lista filtrada lendo apenas a tabela (ícone de cada
+# nota), compara com a situação guardada no índice e move para Canceladas só
+# os pares XML/PDF que mudaram, refazendo só os relatórios afetados.
+
+def registros_da_lista(driver, log_fn=print, sessao=None):
+    """
+    Registros (extrair_linhas_da_pagina) de cada página da lista já filtrada,
+    sem baixar nada. Com `sessao`, as páginas 2..N são lidas por URL.
+    """
+    def pagina_do_navegador():
+        with medir_fase("leitura da página"):
+            WebDriverWait(driver, TIMEOUT_PAGINA).until(
+                EC.presence_of_all_elements_located((By.XPATH, "//table//tbody//tr[td]")))
+            return extrair_linhas_da_pagina(driver)
+
+    yield pagina_do_navegador()
+    if sessao is not None:
+        paginador = PaginadorLista(sessao, driver.page_source, driver.current_url)
+        if not paginador.tem_proxima:
+            return
+        with paginador:
+            for pg, url, leitor in paginador.paginas():
+                if isinstance(leitor, Exception):
+                    log_fn(f"Página {pg} por HTTP falhou ({str(leitor)[:80]}); continuando pelo navegador")
+                    driver.get(url)
+                    yield pagina_do_navegador()
+                    break
+                yield leitor.registros
+            else:
+                return
+    while True:
+        with medir_fase("troca de página"):
+            if not tem_proxima_pagina(driver, log_fn):
+                return
+        yield pagina_do_navegador()
+
+def cnpj_da_lista(driver, sessao, registros):
+    """CNPJ da empresa da sessão, lido do XML da primeira nota da lista (baixado num temporário)."""
+    if not registros:
+        return None
+    nota = registros[0]
+    revelar_links_da_nota(driver, nota)
+    if not nota['href_xml']:
+        return None
+    with tempfile.TemporaryDirectory() as pasta:
+        nome = baixar_arquivo_http(sessao, nota['href_xml'], pasta, '.xml')
+        return cnpj_da_nota_baixada(pasta, {'arquivo_xml': nome})
+
+def notas_do_indice(con, cnpj, competencia_str):
+    """(caminho, cnpj, número, competência AAAA-MM, situação) das notas da empresa nos meses da competência."""
+    competencias = [competencia_da_data(f"01/{m}") for m in meses_da_competencia(competencia_str)]
+    return con.execute(
+        "SELECT caminho, cnpj, numero, competencia, situacao FROM notas WHERE modo = ? AND cnpj = ? "
+        "AND competencia IN (%s)" % ",".join("?" * len(competencias)), (MODO, cnpj, *competencias)).fetchall()
+
+def canceladas_no_portal(con, cnpj, competencia_str, situacoes, log_fn=print):
+    """
+    Notas da empresa ainda não canceladas no índice cujo número aparece com o
+    ícone de cancelada em `situacoes` ({número: {situações}}, das linhas da
+    competência). Números repetidos (em Tomados, emitentes diferentes podem
+    coincidir) ficam de fora: não dá para saber qual das notas mudou.
+    """
+    notas = notas_do_indice(con, cnpj, competencia_str)
+    locais = {}
+    for nota in notas:
+        locais.setdefault(normalizar_numero_nota(nota[2]), []).append(nota)
+    mudaram = []
+    for numero, situacoes_numero in situacoes.items():
+        if "Cancelada" not in situacoes_numero or numero not in locais:
             continue
-        NOTAS_EXISTENTES.add(chave)
-
-        cnpj_emp = data[key_cnpj]
-        if cnpj_emp not in empresa_nomes:
-            empresa_nomes[cnpj_emp] = limpar_nome_empresa(data[key_nome])
-        nome_pasta = empresa_nomes[cnpj_emp]
-        pasta_emp = os.path.join(pasta_base, nome_pasta)
-        subpasta = "Canceladas" if data.get('situacao') == "Cancelada" else "Autorizadas"
-        dest = os.path.join(pasta_emp, subpasta)
-        dest_xml = os.path.join(dest, "XML")
-        dest_pdf = os.path.join(dest, "PDF")
-        os.makedirs(dest_xml, exist_ok=True)
-        os.makedirs(dest_pdf, exist_ok=True)
-        os.replace(caminho, os.path.join(dest_xml, xml_file))
-
-        pdf_file = PDF_POR_ARQUIVO.get(xml_file)
-        if pdf_file:
-            pdf_path = os.path.join(pasta_base, pdf_file)
-            if os.path.exists(pdf_path):
-                novo_nome = f"NFSE N° {data['numero_nota'] or 'S_N'}.pdf"
-                os.replace(pdf_path, os.path.join(dest_pdf, novo_nome))
-
-        empresas.add(pasta_emp)
-
-    for emp in empresas:
-        gerar_relatorio_para_empresa(pasta_base, emp, competencia_str, situacoes_dict, log_fn)
+        if len(situacoes_numero) > 1 or len(locais[numero]) > 1:
+            log_fn(f"Nº {numero}: mais de uma nota com este número; situação não alterada")
+            continue
+        nota = locais[numero][0]
+        if nota[4] != "Cancelada":
+            mudaram.append(nota)
+    return mudaram
+
+def mover_para_canceladas(pasta_base, notas, log_fn=print):
+    """
+    Move XML e DANFSe de cada nota (linhas de notas_do_indice) de Autorizadas
+    para Canceladas, atualiza o índice e os caches e refaz o relatório de cada
+    empresa e mês afetado. Devolve quantas notas foram movidas.
+    """
+    afetadas = {}
+    movidas = 0
+    with LOCK_ORGANIZACAO, closing(abrir_indice_notas(pasta_base)) as indice:
+        for caminho, cnpj, numero, competencia, _ in notas:
+            pasta_situacao = os.path.dirname(os.path.dirname(caminho))
+            if os.path.basename(pasta_situacao) != "Autorizadas" or not os.path.exists(caminho):
+                continue
+            dest = os.path.join(os.path.dirname(pasta_situacao), "Canceladas")
+            os.makedirs(os.path.join(dest, "XML"), exist_ok=True)
+            os.makedirs(os.path.join(dest, "PDF"), exist_ok=True)
+            destino_xml = os.path.abspath(os.path.join(dest, "XML", os.path.basename(caminho)))
+            pdf = os.path.join(pasta_situacao, "PDF", f"NFSE N° {numero or 'S_N'}.pdf")
+            destino_pdf = os.path.abspath(os.path.join(dest, "PDF", os.path.basename(pdf)))
+            with medir_fase("mover arquivos"):
+                os.replace(caminho, destino_xml)
+                if os.path.exists(pdf):
+                    os.replace(pdf, destino_pdf)
+            # os.replace mantém mtime e tamanho: os caches continuam válidos no caminho novo
+            indice.execute("UPDATE OR REPLACE notas SET caminho = ?, situacao = 'Cancelada' "
+                           "WHERE modo = ? AND caminho = ?", (destino_xml, MODO, caminho))
+            indice.execute("UPDATE OR REPLACE cache_xml SET caminho = ? WHERE modo = ? AND caminho = ?",
+                           (destino_xml, MODO, caminho))
+            indice.execute("UPDATE OR REPLACE cache_pdf SET caminho = ? WHERE caminho = ?",
+                           (destino_pdf, os.path.abspath(pdf)))
+            indice.commit()
+            movidas += 1
+            log_fn(f"Cancelada depois do download: Nº {numero} → {os.path.relpath(destino_xml, pasta_base)}")
+            pasta_emp = os.path.join(pasta_base, os.path.relpath(caminho, pasta_base).split(os.sep)[0])
+            afetadas.setdefault((pasta_emp, f"{competencia[5:]}/{competencia[:4]}"), set()).add(cnpj)
+        if movidas:
+            contar("notas canceladas depois", movidas)
+
+        for (pasta_emp, competencia_nota), cnpjs in sorted(afetadas.items()):
+            # A situação de cada nota do relatório sai do índice, já com as mudanças
+            situacoes_dict = {}
+            for cnpj in cnpjs:
+                situacoes_dict.update((numero, situacao) for _, _, numero, _, situacao
+                                      in notas_do_indice(indice, cnpj, competencia_nota) if numero)
+            gerar_relatorio_para_empresa(pasta_base, pasta_emp, competencia_nota, situacoes_dict, log_fn)
+    return movidas
+
+def atualizar_situacoes_da_empresa(driver, pasta_base, competencia_str, cnpj=None, log_fn=print):
+    """
+    Atualização só da situação, com a lista já filtrada no navegador: lê as
+    páginas sem baixar notas e move para Canceladas as que foram canceladas
+    depois do download. Sem `cnpj` (login manual), ele sai do XML da primeira
+    nota da lista. Devolve {'cnpj', 'lidas', 'canceladas'}.
+    """
+    situacoes = {}
+    lidas = 0
+    with closing(criar_sessao_http(driver)) as sessao:
+        for pagina, registros in enumerate(registros_da_lista(driver, log_fn, sessao), 1):
+            if pagina == 1 and not cnpj:
+                cnpj = cnpj_da_lista(driver, sessao, registros)
+            anterior = False
+            for i, registro in enumerate(registros, 1):
+                nota = selecionar_nota(registro, i, competencia_str, {}, lambda msg: None)
+                if nota == "ANTERIOR":
+                    anterior = True
+                    break
+                if nota and nota['numero']:
+                    situacoes.setdefault(normalizar_numero_nota(nota['numero']), set()).add(nota['situacao'])
+                    lidas += 1
+            contar("páginas")
+            if anterior:
+                break
+    log_fn(f"Situação lida no portal: {lidas} nota(s) da competência, "
+           f"{sum('Cancelada' in s for s in situacoes.values())} cancelada(s)")
+    if not cnpj:
+        log_fn("CNPJ da empresa não identificado; nada a atualizar")
+        return {'cnpj': None, 'lidas': lidas, 'canceladas': 0}
+
+    with closing(abrir_indice_notas(pasta_base)) as con:
+        mudaram = canceladas_no_portal(con, cnpj, competencia_str, situacoes, log_fn)
+    canceladas = mover_para_canceladas(pasta_base, mudaram, log_fn) if mudaram else 0
+    log_fn(f"Notas movidas para Canceladas: {canceladas}")
+    return {'cnpj': cnpj, 'lidas': lidas, 'canceladas': canceladas}
+
+# ============================= VÁRIAS EMPRESAS EM PARALELO =============================
+# N navegadores, cada um com perfil e pasta de entrada próprios, consomem uma
+# fila de empresas. Os XMLs baixados seguem para uma única thread organizadora,
+# que move os arquivos para as pastas das empresas e gera os relatórios.
+
+RE_SEPARADOR_LISTA = re.compile(r"[;,\t]")
+
+def ler_lista_empresas(caminho):
+    """
+    Lê a lista de empresas: uma por linha, "CNPJ;senha;nome" (senha e nome
+    opcionais; aceita ; , ou tab). Linhas vazias ou iniciadas por # são ignoradas.
+    Sem senha, o login é feito manualmente no navegador aberto para a empresa.
+    """
+    empresas = []
+    with open(caminho, encoding='utf-8-sig') as f:
+        for linha in f:
+            linha = linha.strip()
+            if not linha or linha.startswith('#'):
+                continue
+            campos = [c.strip() for c in RE_SEPARADOR_LISTA.split(linha)] + ['', '']
+            cnpj = re.sub(r"\D", "", campos[0])
+            if not cnpj:
+                continue
+            empresas.append({'cnpj': cnpj, 'senha': campos[1], 'nome': campos[2] or cnpj})
+    return empresas
+
+def fazer_login(driver, empresa, log_fn=print):
+    """Entra no portal com CNPJ/senha da lista (ou espera o login manual) e abre a lista de notas."""
+    driver.get(URL_PORTAL)
+    if empresa['senha']:
+        inscricao = WebDriverWait(driver, TIMEOUT).until(EC.presence_of_element_located((By.ID, "Inscricao")))
+        inscricao.send_keys(empresa['cnpj'])
+        driver.find_element(By.ID, "Senha").send_keys(empresa['senha'], Keys.ENTER)
+    else:
+        log_fn(f"Aguardando login manual de {empresa['nome']} no navegador...")
+    WebDriverWait(driver, TIMEOUT_LOGIN).until(lambda d: "login" not in d.current_url.lower())
+    driver.get(URL_LISTA[MODO])
+
+def executar_empresas_em_paralelo(empresas, pasta_base, competencia_str, navegadores=NAVEGADORES_PARALELOS,
+                                  log_fn=print, headless=False, somente_situacao=False):
+    """
+    Baixa as notas de todas as `empresas` com até `navegadores` Chromes ao mesmo
+    tempo. Devolve um resumo por empresa: {'cnpj', 'nome', 'situacao', 'novos',
+    'puladas', 'canceladas', 'erro'}, com situacao 'ok', 'sem movimento' ou
+    'erro'; 'puladas' são as notas que já existiam e nem foram baixadas.
+    Com `somente_situacao` nada é baixado: só as notas canceladas depois do
+    download vão para Canceladas ('canceladas').
+    """
+    carregar_selenium()
+    resumo = [{'cnpj': e['cnpj'], 'nome': e['nome'], 'situacao': 'ok', 'novos': 0, 'puladas': 0, 'canceladas': 0,
+               'erro': None} for e in empresas]
+    fila = queue.Queue()
+    for item in zip(empresas, resumo):
+        fila.put(item)
+    para_organizar = queue.Queue()
+
+    def organizador():
+        with perfilar_thread():
+            while True:
+                item = para_organizar.get()
+                if item is None:
+                    return
+                pasta, novos, situacoes_dict, log, registro, desempenho = item
+                try:
+                    with perfil_ativo(desempenho), medir_fase("organizar + relatórios"):
+                        organizar_xmls_e_gerar_relatorios_rodada(pasta_base, competencia_str, novos, situacoes_dict,
+                                                                 log, pasta_origem=pasta)
+                except Exception as e:
+                    registro['situacao'] = 'erro'
+                    registro['erro'] = f"organização: {str(e)[:200]}"
+                    log(f"ERRO ao organizar: {str(e)[:100]}")
+                exportar_perfil(pasta_base, desempenho, competencia_str, log)
+
+    def navegador(n):
+        with perfilar_thread():
+            _navegador(n)
+
+    def _navegador(n):
+        navegador = navegadores_abertos[n - 1]
+        try:
+            while True:
+                try:
+                    empresa, registro = fila.get_nowait()
+                except queue.Empty:
+                    return
+                log = lambda msg, e=empresa: log_fn(f"[{n}] {e['nome']}: {msg}")
+                desempenho = novo_perfil(empresa['cnpj'], empresa['nome'])
+                with perfil_ativo(desempenho):
+                    organizar = baixar_empresa(empresa, registro, navegador, log)
+                if organizar:
+                    para_organizar.put(organizar + (desempenho,))
+                else:
+                    exportar_perfil(pasta_base, desempenho, competencia_str, log)
+        finally:
+            navegador.fechar()
+
+    def baixar_empresa(empresa, registro, navegador, log):
+        """Baixa uma empresa; devolve o item para o organizador, ou None se não houver XMLs novos."""
+        pasta = navegador.pasta
+        sessao = None
+        filtrando = False
+        try:
+            xml_antes = {f for f in os.listdir(pasta) if f.lower().endswith('.xml')}
+            with medir_fase("abrir navegador"):
+                driver = navegador.sessao_limpa()
+            with medir_fase("login"):
+                fazer_login(driver, empresa, log)
+            filtrando = True
+            with medir_fase("filtro por competência"):
+                aplicar_filtro_por_competencia(driver, competencia_str, log)
+            filtrando = False
+            if somente_situacao:
+                registro['canceladas'] = atualizar_situacoes_da_empresa(driver, pasta_base, competencia_str,
+                                                                        empresa['cnpj'], log)['canceladas']
+                return None
+            sessao = criar_sessao_http(driver) if MOTOR_DOWNLOAD == 'http' else None
+            sessao_empresa = {'cnpj': empresa['cnpj'], 'pasta_base': pasta_base}
+            situacoes_dict = baixar_notas_da_empresa(driver, competencia_str, pasta, log, sessao, sessao_empresa)
+            novos = sorted({f for f in os.listdir(pasta) if f.lower().endswith('.xml')} - xml_antes)
+            registro['novos'] = len(novos)
+            registro['puladas'] = sessao_empresa['puladas']
+            log(f"Novos XMLs: {len(novos)}")
+            if novos:
+                return pasta, novos, situacoes_dict, log, registro
+        except TimeoutException as e:
+            # Tabela vazia depois do filtro: a empresa não tem notas na competência
+            registro['situacao'] = 'sem movimento' if filtrando else 'erro'
+            registro['erro'] = None if filtrando else (e.msg or "tempo esgotado")
+            log("SEM MOVIMENTO" if filtrando else "ERRO: tempo esgotado")
+        except Exception as e:
+            registro['situacao'] = 'erro'
+            registro['erro'] = str(e)[:200] or type(e).__name__
+            log(f"ERRO: {str(e)[:100]}")
+        finally:
+            if sessao:
+                sessao.close()
+        return None
+
+    # Um Chrome por thread, aberto já no início e reaproveitado entre as empresas
+    navegadores_abertos = []
+    for n in range(1, max(1, min(navegadores, len(empresas))) + 1):
+        pasta = os.path.join(pasta_base, PASTA_ENTRADA, f"navegador_{n}")
+        criar_pasta_downloads(pasta)
+        navegadores_abertos.append(NavegadorReutilizado(
+            pasta, os.path.join(pasta_perfis(), f"navegador_{n}"), headless,
+            log_fn=lambda msg, n=n: log_fn(f"[{n}] {msg}")).aquecer())
+
+    thread_organizador = threading.Thread(target=organizador, daemon=True)
+    thread_organizador.start()
+    threads = [threading.Thread(target=navegador, args=(n,), daemon=True)
+               for n in range(1, len(navegadores_abertos) + 1)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    para_organizar.put(None)
+    thread_organizador.join()
+    return resumo
+
+# ============================= DISTRIBUIÇÃO POR NSU (ADN) =============================
+# O ADN devolve os documentos do contribuinte (NFS-e e eventos) em lotes
+# ordenados por NSU, cada XML compactado com gzip e codificado em base64. O
+# último NSU recebido fica no índice, por CNPJ e modo: cada execução pede só o
+# que é novo. As notas esperam em _entrada/adn/<CNPJ>/AAAA-MM até a competência
+# delas ser organizada, pelo mesmo organizador usado com o portal; cada empresa
+# tem a sua entrada e só organiza as próprias notas.
+
+TAGS_CANCELAMENTO = ('e101101', 'e105102')  # cancelamento / cancelamento por substituição
+
+def criar_sessao_adn(empresa):
+    carregar_http()
+    sessao = requests.Session()
+    adapter = HTTPAdapter(pool_connections=DOWNLOAD_WORKERS, pool_maxsize=DOWNLOAD_WORKERS, max_retries=2)
+    sessao.mount("https://", adapter)
+    sessao.mount("http://", adapter)
+    sessao.headers["Accept"] = "application/json"
+    certificado = empresa.get('certificado')
+    if certificado:
+        # Um .pem com certificado e chave, ou [certificado, chave]
+        sessao.cert = tuple(certificado) if isinstance(certificado, (list, tuple)) else certificado
+    return sessao
+
+def pasta_entrada_adn(pasta_base, cnpj):
+    return os.path.join(pasta_base, PASTA_ENTRADA, PASTA_ADN, cnpj)
+
+def ultimo_nsu(con, cnpj):
+    linha = con.execute("SELECT ultimo_nsu FROM nsu_adn WHERE cnpj = ? AND modo = ?", (cnpj, MODO)).fetchone()
+    return linha[0] if linha else 0
+
+def gravar_ultimo_nsu(con, cnpj, nsu):
+    con.execute("INSERT OR REPLACE INTO nsu_adn (cnpj, modo, ultimo_nsu, atualizado) VALUES (?, ?, ?, ?)",
+                (cnpj, MODO, nsu, datetime.datetime.now().isoformat(timespec='seconds')))
+
+def consultar_lote_adn(sessao, cnpj, nsu):
+    """Próximo lote de documentos com NSU maior que `nsu`; lista vazia quando não há mais nada."""
+    resp = sessao.get(f"{URL_ADN}/DFe/{nsu}", params={'cnpjConsulta': cnpj, 'lote': 'true'}, timeout=TIMEOUT)
+    if resp.status_code == 404:
+        return []
+    resp.raise_for_status()
+    corpo = resp.json()
+    if corpo.get('StatusProcessamento') == 'REJEICAO':
+        erros = "; ".join(f"{e.get('Codigo', '')} {e.get('Descricao', '')}".strip() for e in corpo.get('Erros') or [])
+        raise RuntimeError(f"ADN rejeitou a consulta: {erros or 'sem detalhes'}")
+    return corpo.get('LoteDFe') or []
+
+def cancelamento_do_evento(conteudo):
+    """(chave da NFS-e, tag do evento) se o evento for um cancelamento; senão None."""
+    chave = evento = None
+    for elem in ET.fromstring(conteudo).iter():
+        tag = elem.tag.rsplit('}', 1)[-1]
+        if tag == 'chNFSe' and chave is None:
+            chave = (elem.text or '').strip()
+        elif tag in TAGS_CANCELAMENTO:
+            evento = tag
+    return (chave, evento) if chave and evento else None
+
+def guardar_nota_adn(raiz, chave, conteudo, cnpj):
+    """
+    Grava a NFS-e em raiz/AAAA-MM/<chave>.xml se a empresa for a parte do modo
+    (emitente em prestados, tomador em tomados). Devolve a pasta, ou None.
+    """
+    key_cnpj = 'tomador_cnpj' if MODO == 'tomados' else 'emitente_cnpj'
+    temporario = os.path.join(raiz, f"{chave}.xml.part")
+    with open(temporario, 'wb') as f:
+        f.write(conteudo)
+    data = extrair_campos_xml(temporario, MODO)
+    if not data or data[key_cnpj] != cnpj:
+        os.remove(temporario)
+        return None
+    pasta = os.path.join(raiz, competencia_da_data(data['data_emissao']) or "sem_data")
+    os.makedirs(pasta, exist_ok=True)
+    os.replace(temporario, os.path.join(pasta, f"{chave}.xml"))
+    return pasta
+
+def baixar_danfse_adn(sessao, chave, pasta, perfil=None):
+    with medir_fase("download da nota", perfil), sessao.get(f"{URL_ADN_DANFSE}/{chave}", stream=True, timeout=TIMEOUT) as resp:
+        resp.raise_for_status()
+        destino = os.path.join(pasta, f"DANFSe_{chave}.pdf")
+        parcial = destino + ".part"
+        with open(parcial, 'wb') as f:
+            for bloco in resp.iter_content(64 * 1024):
+                f.write(bloco)
+        os.replace(parcial, destino)
+
+def sincronizar_empresa_por_nsu(empresa, pasta_base, log_fn=print):
+    """
+    Recebe os documentos da empresa com NSU maior que o último guardado. O NSU
+    só avança depois que o lote inteiro está gravado em disco, então uma
+    execução interrompida repete no máximo o último lote. Devolve os totais
+    {'documentos', 'notas', 'cancelamentos', 'ignorados'}.
+    """
+    cnpj = empresa['cnpj']
+    perfil = perfil_atual()
+    raiz = pasta_entrada_adn(pasta_base, cnpj)
+    os.makedirs(raiz, exist_ok=True)
+    totais = dict.fromkeys(('documentos', 'notas', 'cancelamentos', 'ignorados'), 0)
+    with closing(criar_sessao_adn(empresa)) as sessao, closing(abrir_indice_notas(pasta_base)) as con:
+        nsu = ultimo_nsu(con, cnpj)
+        log_fn(f"Consultando o ADN a partir do NSU {nsu}")
+        for _ in range(MAX_LOTES_NSU):
+            with medir_fase("consulta NSU"):
+                lote = consultar_lote_adn(sessao, cnpj, nsu)
+            if not lote:
+                break
+            notas = []
+            for doc in sorted(lote, key=lambda d: int(d['NSU'])):
+                conteudo = gzip.decompress(base64.b64decode(doc['ArquivoXml']))
+                tipo = str(doc.get('TipoDocumento', '')).upper()
+                if tipo == 'NFSE':
+                    pasta = guardar_nota_adn(raiz, doc['ChaveAcesso'], conteudo, cnpj)
+                    if pasta:
+                        notas.append((doc['ChaveAcesso'], pasta))
+                    else:
+                        totais['ignorados'] += 1
+                elif tipo == 'EVENTO':
+                    cancelamento = cancelamento_do_evento(conteudo)
+                    if cancelamento:
+                        con.execute("INSERT OR REPLACE INTO eventos_adn (chave, evento, nsu, cnpj) VALUES (?, ?, ?, ?)",
+                                    (*cancelamento, int(doc['NSU']), cnpj))
+                        totais['cancelamentos'] += 1
+                else:
+                    totais['ignorados'] += 1
+                nsu = max(nsu, int(doc['NSU']))
+
+            if DANFSE_POR_NSU and notas:
+                with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+                    futuros = [(chave, pool.submit(baixar_danfse_adn, sessao, chave, pasta, perfil))
+                               for chave, pasta in notas]
+                    for chave, futuro in futuros:
+                        try:
+                            futuro.result()
+                        except Exception as e:
+                            log_fn(f"DANFSe ignorado ({chave}): {str(e)[:80]}")
+
+            gravar_ultimo_nsu(con, cnpj, nsu)
+            con.commit()
+            totais['documentos'] += len(lote)
+            totais['notas'] += len(notas)
+            contar("documentos NSU", len(lote))
+            contar("notas baixadas", len(notas))
+            log_fn(f"Lote até o NSU {nsu}: {len(lote)} documento(s), {len(notas)} nota(s) da empresa")
+        else:
+            log_fn(f"Limite de {MAX_LOTES_NSU} lotes atingido; o restante vem na próxima execução")
+    log_fn(f"ADN: {totais['documentos']} documento(s), {totais['notas']} nota(s) nova(s), "
+           f"{totais['cancelamentos']} cancelamento(s); último NSU {nsu}")
+    return totais
+
+def chaves_canceladas(con, chaves):
+    canceladas = set()
+    chaves = list(chaves)
+    for i in range(0, len(chaves), 500):
+        parte = chaves[i:i + 500]
+        canceladas.update(c for c, in con.execute(
+            "SELECT chave FROM eventos_adn WHERE chave IN (%s)" % ",".join("?" * len(parte)), parte))
+    return canceladas
+
+def organizar_notas_adn(pasta_base, competencia_str, cnpj, log_fn=print):
+    """
+    Entrega ao organizador as notas da empresa recebidas por NSU que caem nos
+    meses da competência, com a situação tirada dos eventos de cancelamento.
+    Notas de outros meses continuam na entrada até a competência delas ser
+    pedida. Devolve quantos XMLs foram entregues.
+    """
+    raiz = pasta_entrada_adn(pasta_base, cnpj)
+    total = 0
+    for mes in meses_da_competencia(competencia_str):
+        pasta = os.path.join(raiz, competencia_da_data(f"01/{mes}"))
+        if not os.path.isdir(pasta):
+            continue
+        novos = sorted(f for f in os.listdir(pasta) if f.lower().endswith('.xml'))
+        if not novos:
+            continue
+        with closing(abrir_indice_notas(pasta_base)) as con:
+            canceladas = chaves_canceladas(con, (os.path.splitext(xml)[0] for xml in novos))
+        for xml in novos:
+            chave = os.path.splitext(xml)[0]
+            SITUACOES_POR_ARQUIVO[xml] = "Cancelada" if chave in canceladas else "Autorizada"
+            pdf = f"DANFSe_{chave}.pdf"
+            if os.path.exists(os.path.join(pasta, pdf)):
+                PDF_POR_ARQUIVO[xml] = pdf
+        log_fn(f"{len(novos)} nota(s) recebida(s) por NSU em {mes} ({len(canceladas)} cancelada(s)); organizando")
+        organizar_xmls_e_gerar_relatorios_rodada(pasta_base, competencia_str, novos, {}, log_fn, pasta_origem=pasta)
+        total += len(novos)
+    return total
+
+def canceladas_por_evento(con, cnpj, competencia_str):
+    """Notas já organizadas (XML <chave>.xml) cujo cancelamento chegou depois, como evento."""
+    notas = [n for n in notas_do_indice(con, cnpj, competencia_str) if n[4] != "Cancelada"]
+    canceladas = chaves_canceladas(con, (os.path.splitext(os.path.basename(n[0]))[0] for n in notas))
+    return [n for n in notas if os.path.splitext(os.path.basename(n[0]))[0] in canceladas]
+
+def executar_empresas_por_nsu(empresas, pasta_base, competencia_str, log_fn=print):
+    """
+    Mesmo contrato de executar_empresas_em_paralelo, sem navegador: cada
+    empresa é sincronizada pelo ADN e as notas da competência são organizadas.
+    Cancelamentos de notas organizadas em execuções anteriores já chegam como
+    eventos: essas notas vão para Canceladas ('canceladas' no resumo).
+    """
+    resumo = []
+    for empresa in empresas:
+        registro = {'cnpj': empresa['cnpj'], 'nome': empresa['nome'], 'situacao': 'ok', 'novos': 0,
+                    'puladas': 0, 'canceladas': 0, 'erro': None}
+        resumo.append(registro)
+        log = lambda msg, e=empresa: log_fn(f"[NSU] {e['nome']}: {msg}")
+        desempenho = novo_perfil(empresa['cnpj'], empresa['nome'])
+        try:
+            with perfil_ativo(desempenho):
+                registro['documentos'] = sincronizar_empresa_por_nsu(empresa, pasta_base, log)['documentos']
+                with medir_fase("organizar + relatórios"):
+                    registro['novos'] = organizar_notas_adn(pasta_base, competencia_str, empresa['cnpj'], log)
+                    with closing(abrir_indice_notas(pasta_base)) as con:
+                        mudaram = canceladas_por_evento(con, empresa['cnpj'], competencia_str)
+                    if mudaram:
+                        registro['canceladas'] = mover_para_canceladas(pasta_base, mudaram, log)
+        except Exception as e:
+            registro['situacao'] = 'erro'
+            registro['erro'] = str(e)[:200] or type(e).__name__
+            log(f"ERRO: {str(e)[:100]}")
+        exportar_perfil(pasta_base, desempenho, competencia_str, log)
+    return resumo
+
+# ============================= EXECUÇÃO SEM INTERFACE (JOB) =============================
+# python Portal_Nacional.py --job fechamento.json
+#
+# {
+#   "navegadores": 3,
+#   "perfilar": false,                                        (opcional: cProfile em _desempenho/)
+#   "consolidar": false,                                      (opcional: resumo consolidado no fim)
+#   "resumo": "Z:/01 FISCAL/NFSe/resumo_fechamento.json",      (opcional)
+#   "tarefas": [
+#     {"modo": "Prestados", "competencias": ["11/2025"], "pasta": "Z:/01 FISCAL/NFSe/PRESTADOS",
+#      "empresas": [{"cnpj": "11222333000181", "senha": "...", "nome": "ALFA"}]},
+#     {"modo": "Tomados", "competencias": ["11/2025"], "pasta": "Z:/01 FISCAL/NFSe/TOMADOS",
+#      "lista": "Z:/01 FISCAL/NFSe/empresas.txt"},
+#     {"modo": "Tomados", "competencias": ["11/2025"], "pasta": "Z:/01 FISCAL/NFSe/TOMADOS",
+#      "backend": "nsu", "certificado": "Z:/01 FISCAL/certificado.pem",
+#      "lista": "Z:/01 FISCAL/NFSe/empresas.txt"},
+#     {"modo": "Prestados", "competencias": ["10/2025"], "pasta": "Z:/01 FISCAL/NFSe/PRESTADOS",
+#      "somente_situacao": true, "lista": "Z:/01 FISCAL/NFSe/empresas.txt"}
+#   ]
+# }
+#
+# Um job com uma única tarefa pode trazer modo/competencias/pasta/empresas na raiz.
+# "backend": "nsu" baixa pelo ADN em vez do portal (sem navegador nem senha); o
+# certificado (.pem com a chave, ou [certificado, chave]) vale para todas as
+# empresas da tarefa e pode ser trocado por empresa.
+# "somente_situacao": true não baixa nada: lê a lista do portal e move para
+# Canceladas as notas canceladas depois do download (pelo ADN isso já acontece
+# em toda execução, com os eventos de cancelamento).
+# Código de saída: 0 tudo certo, 1 alguma empresa com erro, 2 job inválido.
+
+SAIDA_OK = 0
+SAIDA_COM_ERROS = 1
+SAIDA_JOB_INVALIDO = 2
+
+class JobInvalido(ValueError):
+    pass
+
+def caminho_certificado(base, certificado):
+    """Certificado do job (caminho ou [certificado, chave]) com caminhos relativos ao arquivo do job."""
+    if not certificado:
+        return None
+    if isinstance(certificado, (list, tuple)):
+        return [os.path.join(base, c) for c in certificado]
+    return os.path.join(base, certificado)
+
+def ler_job(caminho):
+    """Lê e valida o arquivo do job; devolve (configuração geral, lista de tarefas normalizadas)."""
+    try:
+        with open(caminho, encoding='utf-8-sig') as f:
+            job = json.load(f)
+    except (OSError, ValueError) as e:
+        raise JobInvalido(f"não foi possível ler o job: {e}")
+    if not isinstance(job, dict):
+        raise JobInvalido("o job deve ser um objeto JSON")
+
+    base = os.path.dirname(os.path.abspath(caminho))
+    tarefas = []
+    for i, t in enumerate(job.get('tarefas') or [job], 1):
+        modo = str(t.get('modo', '')).strip().lower()
+        if modo not in ('prestados', 'tomados'):
+            raise JobInvalido(f"tarefa {i}: modo deve ser Prestados ou Tomados")
+        competencias = t.get('competencias') or ([t['competencia']] if t.get('competencia') else [])
+        if isinstance(competencias, str):
+            competencias = [competencias]
+        for comp in competencias:
+            if not limites_competencia(comp):
+                raise JobInvalido(f"tarefa {i}: competência inválida {comp!r} (use MM/AAAA ou MM/AAAA-MM/AAAA)")
+        if not competencias:
+            raise JobInvalido(f"tarefa {i}: informe ao menos uma competência")
+        if not t.get('pasta'):
+            raise JobInvalido(f"tarefa {i}: informe a pasta de destino")
+        backend = str(t.get('backend') or 'portal').strip().lower()
+        if backend not in ('portal', 'nsu'):
+            raise JobInvalido(f"tarefa {i}: backend deve ser portal ou nsu")
+        certificado = caminho_certificado(base, t.get('certificado'))
+        if t.get('lista'):
+            try:
+                empresas = ler_lista_empresas(os.path.join(base, t['lista']))
+            except OSError as e:
+                raise JobInvalido(f"tarefa {i}: {e}")
+        else:
+            empresas = []
+            for e in t.get('empresas') or []:
+                cnpj = re.sub(r"\D", "", str(e.get('cnpj', '')))
+                empresas.append({'cnpj': cnpj, 'senha': e.get('senha') or '', 'nome': e.get('nome') or cnpj,
+                                 'certificado': caminho_certificado(base, e.get('certificado'))})
+        if not empresas or not all(e['cnpj'] for e in empresas):
+            raise JobInvalido(f"tarefa {i}: lista de empresas vazia ou sem CNPJ")
+        for e in empresas:
+            e['certificado'] = e.get('certificado') or certificado
+        tarefas.append({'modo': modo, 'competencias': competencias, 'backend': backend,
+                        'somente_situacao': bool(t.get('somente_situacao')),
+                        'pasta': os.path.join(base, t['pasta']), 'empresas': empresas})
+    return job, tarefas
+
+def executar_job(caminho_job, log_fn=print, perfilar=False):
+    """Roda todas as tarefas do job sem interface e grava o resumo em JSON; devolve o código de saída."""
+    global MODO, PASTA_DOWNLOADS, COMPETENCIA_DESEJADA, SITUACOES_POR_ARQUIVO, PDF_POR_ARQUIVO, PERFILAR_EXECUCAO
+    try:
+        job, tarefas = ler_job(caminho_job)
+    except JobInvalido as e:
+        log_fn(f"JOB INVÁLIDO: {e}")
+        return SAIDA_JOB_INVALIDO
+    PERFILAR_EXECUCAO = perfilar or bool(job.get('perfilar'))
+
+    navegadores = int(job.get('navegadores') or NAVEGADORES_PARALELOS)
+    inicio = datetime.datetime.now()
+    zerar_tempos()
+    resumo = {'job': os.path.abspath(caminho_job), 'inicio': inicio.isoformat(timespec='seconds'), 'tarefas': []}
+    for tarefa in tarefas:
+        MODO = tarefa['modo']
+        PASTA_DOWNLOADS = tarefa['pasta']
+        criar_pasta_downloads(PASTA_DOWNLOADS)
+        for competencia in tarefa['competencias']:
+            COMPETENCIA_DESEJADA = competencia
+            log_fn("=" * 90)
+            log_fn(f"{MODO} - Competência {competencia} - {len(tarefa['empresas'])} empresa(s) - {PASTA_DOWNLOADS}")
+            log_fn("=" * 90)
+            # Sem interface não há quem faça login manual (pelo ADN não há login)
+            nsu = tarefa['backend'] == 'nsu'
+            com_senha = [e for e in tarefa['empresas'] if e['senha'] or nsu]
+            empresas_resumo = [{'cnpj': e['cnpj'], 'nome': e['nome'], 'situacao': 'erro', 'novos': 0, 'puladas': 0,
+                                'canceladas': 0, 'erro': "sem senha (login manual não é possível sem interface)"}
+                               for e in tarefa['empresas'] if not (e['senha'] or nsu)]
+            with medir_fase("carregar notas existentes"):
+                carregar_notas_existentes(PASTA_DOWNLOADS, competencia, log_fn)
+            SITUACOES_POR_ARQUIVO = {}
+            PDF_POR_ARQUIVO = {}
+            reconciliar_pendentes(PASTA_DOWNLOADS, competencia, log_fn)
+            if com_senha:
+                with perfilar_thread():
+                    if nsu:
+                        empresas_resumo = executar_empresas_por_nsu(com_senha, PASTA_DOWNLOADS, competencia, log_fn)
+                    else:
+                        empresas_resumo = executar_empresas_em_paralelo(
+                            com_senha, PASTA_DOWNLOADS, competencia, navegadores, log_fn, headless=True,
+                            somente_situacao=tarefa['somente_situacao']) + empresas_resumo
+                salvar_cprofile(PASTA_DOWNLOADS, log_fn)
+            encerrar_diario(PASTA_DOWNLOADS, competencia, log_fn)
+            resumo['tarefas'].append({'modo': MODO, 'competencia': competencia, 'pasta': PASTA_DOWNLOADS,
+                                      'backend': tarefa['backend'], 'somente_situacao': tarefa['somente_situacao'],
+                                      'empresas': empresas_resumo})
+
+    if job.get('consolidar'):
+        # Um resumo por competência, juntando as pastas (ex.: Prestados e Tomados) que a baixaram
+        resumo['consolidados'] = []
+        for competencia in dict.fromkeys(c for t in tarefas for c in t['competencias']):
+            pastas = list(dict.fromkeys(t['pasta'] for t in tarefas if competencia in t['competencias']))
+            try:
+                if gerar_resumo_consolidado(pastas, competencia, log_fn=log_fn) is not None:
+                    resumo['consolidados'].append(competencia)
+            except Exception as e:
+                log_fn(f"ERRO no resumo consolidado de {competencia}: {str(e)[:100]}")
+
+    fim = datetime.datetime.now()
+    empresas = [e for t in resumo['tarefas'] for e in t['empresas']]
+    erros = sum(1 for e in empresas if e['situacao'] == 'erro')
+    codigo = SAIDA_COM_ERROS if erros else SAIDA_OK
+    with _LOCK_TEMPOS:
+        tempos = {fase: {'segundos': round(total, 3), 'vezes': n} for fase, (total, n) in TEMPOS_FASES.items()}
+        contadores = dict(CONTADORES)
+    resumo.update({
+        'fim': fim.isoformat(timespec='seconds'),
+        'duracao_s': round((fim - inicio).total_seconds(), 1),
+        'empresas': len(empresas),
+        'com_erro': erros,
+        'sem_movimento': sum(1 for e in empresas if e['situacao'] == 'sem movimento'),
+        'xmls_novos': sum(e['novos'] for e in empresas),
+        'ja_existentes': sum(e['puladas'] for e in empresas),
+        'canceladas_depois': sum(e['canceladas'] for e in empresas),
+        'codigo_saida': codigo,
+        'tempos': tempos,
+        'contadores': contadores,
+    })
+    destino = job.get('resumo') or os.path.join(
+        tarefas[0]['pasta'], f"_resumo_job_{inicio:%Y%m%d_%H%M%S}.json")
+    destino = os.path.join(os.path.dirname(os.path.abspath(caminho_job)), destino)
+    with open(destino, 'w', encoding='utf-8') as f:
+        json.dump(resumo, f, ensure_ascii=False, indent=2)
+
+    resumo_tempos(log_fn)
+    log_fn(f"Empresas: {len(empresas)} | com erro: {erros} | XMLs novos: {resumo['xmls_novos']} | "
+           f"canceladas depois do download: {resumo['canceladas_depois']}")
+    log_fn(f"Resumo: {destino}")
+    return codigo
 
 # ============================= INTERFACE CUSTOMTKINTER =============================
+def criar_log_em_arquivo():
+    """Logger com o log completo da interface em PASTA_LOGS (rotação por tamanho)."""
+    logger = logging.getLogger("nfse_portal_nacional")
+    if not logger.handlers:
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        try:
+            os.makedirs(PASTA_LOGS, exist_ok=True)
+            handler = RotatingFileHandler(os.path.join(PASTA_LOGS, "nfse_portal_nacional.log"),
+                                          maxBytes=TAMANHO_ARQUIVO_LOG, backupCount=ARQUIVOS_LOG_ANTIGOS,
+                                          encoding='utf-8')
+        except OSError as e:
+            print("Log em arquivo desativado:", e)
+            handler = logging.NullHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(threadName)s %(message)s"))
+        logger.addHandler(handler)
+    return logger
+
 ctk.set_appearance_mode("system")
 ctk.set_default_color_theme("dark-blue")
 
@@ -588,6 +3271,11 @@ class NFSeDownloaderApp:
 
         self.root.after(5000, self.checar_updates_auto)
 
+        # Qualquer thread chama self.log; só o mainloop mexe na caixa de log
+        self.fila_log = queue.Queue()
+        self.log_arquivo = criar_log_em_arquivo()
+        self.root.after(INTERVALO_LOG_MS, self._esvaziar_fila_log)
+
         # Header
         header = ctk.CTkFrame(root, height=80, corner_radius=0, fg_color="#1e40af")
         header.pack(fill="x")
@@ -622,7 +3310,19 @@ class NFSeDownloaderApp:
         r2.pack(fill="x", padx=30, pady=10)
         ctk.CTkLabel(r2, text="Competência (MM/AAAA):", font=self.font_bold, width=180, anchor="w").pack(side="left", padx=30)
         self.var_comp = ctk.StringVar(value=COMPETENCIA_DESEJADA_DEFAULT)
-        ctk.CTkEntry(r2, textvariable=self.var_comp, width=100, height=45, font=self.font_normal, placeholder_text="ex: 11/2025").pack(side="left", padx=15)
+        ctk.CTkEntry(r2, textvariable=self.var_comp, width=170, height=45, font=self.font_normal, placeholder_text="ex: 11/2025").pack(side="left", padx=15)
+        ctk.CTkLabel(r2, text="ou intervalo: 09/2025-11/2025", font=self.font_normal).pack(side="left", padx=5)
+
+        # Lista de empresas (opcional): com ela, vários navegadores trabalham em paralelo
+        r3 = ctk.CTkFrame(cfg)
+        r3.pack(fill="x", padx=30, pady=10)
+        ctk.CTkLabel(r3, text="Lista de empresas:", font=self.font_bold, width=180, anchor="w").pack(side="left", padx=30)
+        self.var_lista = ctk.StringVar(value="")
+        ctk.CTkEntry(r3, textvariable=self.var_lista, height=45, font=self.font_normal, placeholder_text="opcional: CNPJ;senha;nome por linha").pack(side="left", fill="x", expand=True, padx=(15,0))
+        self.var_navegadores = ctk.StringVar(value=str(NAVEGADORES_PARALELOS))
+        ctk.CTkButton(r3, text="Procurar...", width=130, height=45, font=self.font_bold, fg_color="#2563eb", hover_color="#1d4ed8", command=self.escolher_lista).pack(side="right", padx=(15,0))
+        ctk.CTkEntry(r3, textvariable=self.var_navegadores, width=50, height=45, font=self.font_normal).pack(side="right", padx=(15,0))
+        ctk.CTkLabel(r3, text="Navegadores:", font=self.font_normal).pack(side="right", padx=(15,0))
 
         # Botões
         btnspace = ctk.CTkFrame(main, fg_color="transparent")
@@ -630,6 +3330,11 @@ class NFSeDownloaderApp:
         ctk.CTkButton(btnspace, text="Limpar Log", width=160, height=50, font=self.font_bold, fg_color="#dc2626", hover_color="#b91c1c", command=self.limpar_log).pack(side="left", padx=20)
         self.btn_update = ctk.CTkButton(btnspace, text="Verificar Updates", width=220, height=50, font=self.font_bold, fg_color="#2563eb", hover_color="#1d4ed8", command=self.checar_updates_auto)
         self.btn_update.pack(side="left", padx=12)
+        self.var_perfilar = ctk.BooleanVar(value=PERFILAR_EXECUCAO)
+        ctk.CTkCheckBox(btnspace, text="Perfilar (cProfile)", variable=self.var_perfilar, font=self.font_normal).pack(side="left", padx=12)
+        # Só lê a lista do portal e move para Canceladas o que foi cancelado depois do download
+        self.var_situacao = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(btnspace, text="Só atualizar situação", variable=self.var_situacao, font=self.font_normal).pack(side="left", padx=12)
         self.btn_start = ctk.CTkButton(btnspace, text="Baixar NFS-e", width=350, height=55,
         font=self.font_bold, fg_color="#1e40af", hover_color="#1d4ed8",
         command=self.iniciar_download)
@@ -652,10 +3357,24 @@ class NFSeDownloaderApp:
         self.btn_start.configure(text=f"Baixar NFS-e {tipo}")
 
     def log(self, msg):
-        self.txt_log.insert("end", msg + "\n")
-        self.txt_log.see("end")
-        self.root.update_idletasks()
-        print(msg)
+        self.log_arquivo.info(msg)
+        self.fila_log.put(msg)
+
+    def _esvaziar_fila_log(self):
+        linhas = []
+        try:
+            while len(linhas) < LOTE_LOG:
+                linhas.append(self.fila_log.get_nowait())
+        except queue.Empty:
+            pass
+        if linhas:
+            self.txt_log.insert("end", "\n".join(linhas) + "\n")
+            excesso = int(self.txt_log.index("end-1c").split(".")[0]) - 1 - MAX_LINHAS_LOG
+            if excesso > 0:
+                self.txt_log.delete("1.0", f"{excesso + 1}.0")
+            self.txt_log.see("end")
+        # Fila ainda cheia: volta logo em vez de esperar o intervalo
+        self.root.after(1 if len(linhas) == LOTE_LOG else INTERVALO_LOG_MS, self._esvaziar_fila_log)
 
     def limpar_log(self):
         self.txt_log.delete("0.0", "end")
@@ -667,82 +3386,168 @@ class NFSeDownloaderApp:
             global PASTA_DOWNLOADS
             PASTA_DOWNLOADS = p
 
+    def escolher_lista(self):
+        p = filedialog.askopenfilename(filetypes=[("Lista de empresas", "*.txt *.csv"), ("Todos", "*.*")])
+        if p:
+            self.var_lista.set(p)
+
     def iniciar_download(self):
         self.btn_start.configure(state="disabled", text="Processando...")
         thread = threading.Thread(target=self._run_download)
         thread.start()
 
     def _run_download(self):
+        global PERFILAR_EXECUCAO
+        PERFILAR_EXECUCAO = self.var_perfilar.get()
         try:
-            self._rodar_multiempresas()
+            # Selenium só é importado agora, nesta thread, com a janela já na tela
+            carregar_selenium()
+            with perfilar_thread():
+                pasta = self._rodar_multiempresas()
+            if pasta and PERFILAR_EXECUCAO:
+                salvar_cprofile(pasta, self.log)
+            else:
+                # Perfil de uma tentativa que não chegou a rodar não entra no da próxima
+                with _LOCK_TEMPOS:
+                    _CPROFILES.clear()
         finally:
             self.root.after(0, lambda: self.btn_start.configure(state="normal", text=f"Baixar NFS-e {'Tomados' if MODO == 'tomados' else 'Prestados'}"))
 
     def _rodar_multiempresas(self):
+        """Roda as empresas da tela; devolve a pasta de downloads usada (None se nada rodou)."""
         global COMPETENCIA_DESEJADA, SITUACOES_POR_ARQUIVO, PDF_POR_ARQUIVO, PASTA_DOWNLOADS
         COMPETENCIA_DESEJADA = self.var_comp.get().strip() or COMPETENCIA_DESEJADA_DEFAULT
+        if not limites_competencia(COMPETENCIA_DESEJADA):
+            self.log(f"Competência inválida: {COMPETENCIA_DESEJADA} (use MM/AAAA ou MM/AAAA-MM/AAAA)")
+            return None
         PASTA_DOWNLOADS = self.var_pasta.get().strip() or PASTA_DOWNLOADS_DEFAULT
         tipo = 'tomados' if MODO == 'tomados' else 'prestados'
         secao = 'Tomadas' if MODO == 'tomados' else 'Emitidas'
+        self.somente_situacao = self.var_situacao.get()
+        acao = "Atualizando a situação das notas" if self.somente_situacao else "Iniciando"
         self.log("\n" + "="*90)
-        self.log(f"Iniciando {tipo} - Competência: {COMPETENCIA_DESEJADA}")
+        self.log(f"{acao} {tipo} - Competência: {COMPETENCIA_DESEJADA}")
         self.log("="*90)
 
-        carregar_notas_existentes(PASTA_DOWNLOADS, COMPETENCIA_DESEJADA, self.log)
+        zerar_tempos()
+        lista = self.var_lista.get().strip()
+        navegador = None
+        if not lista:
+            # O Chrome abre enquanto o índice de notas é carregado
+            criar_pasta_downloads(PASTA_DOWNLOADS)
+            navegador = NavegadorReutilizado(PASTA_DOWNLOADS, log_fn=self.log).aquecer()
+        with medir_fase("carregar notas existentes"):
+            carregar_notas_existentes(PASTA_DOWNLOADS, COMPETENCIA_DESEJADA, self.log)
         SITUACOES_POR_ARQUIVO = {}
         PDF_POR_ARQUIVO = {}
+        reconciliar_pendentes(PASTA_DOWNLOADS, COMPETENCIA_DESEJADA, self.log)
+
+        if lista:
+            self._rodar_em_paralelo(lista)
+        else:
+            try:
+                self._rodar_uma_a_uma(navegador)
+            finally:
+                navegador.fechar()
+
+        encerrar_diario(PASTA_DOWNLOADS, COMPETENCIA_DESEJADA, self.log)
+        self.log("\n" + "="*90)
+        resumo_tempos(self.log)
+        self.log("PROCESSO FINALIZADO COM SUCESSO!")
+        self.log("="*90)
+        return PASTA_DOWNLOADS
 
+    def _rodar_uma_a_uma(self, navegador):
+        """Uma empresa por vez: login manual e confirmação antes da próxima, no mesmo Chrome."""
         empresa = 0
         while True:
             empresa += 1
             self.log(f"\n{'='*20} EMPRESA #{empresa} {'='*20}")
-            driver = None
-            try:
-                criar_pasta_downloads(PASTA_DOWNLOADS)
-                xml_antes = {f for f in os.listdir(PASTA_DOWNLOADS) if f.lower().endswith('.xml')}
-                driver = criar_driver(headless=False)
+            desempenho = novo_perfil(nome=f"EMPRESA #{empresa}")
+            with perfil_ativo(desempenho):
+                self._baixar_empresa(empresa, desempenho, navegador)
+            exportar_perfil(PASTA_DOWNLOADS, desempenho, COMPETENCIA_DESEJADA, self.log)
+
+            if not messagebox.askyesno("Próxima empresa", "Deseja processar outro CNPJ?"):
+                break
+
+    def _baixar_empresa(self, empresa, desempenho, navegador):
+        sessao = None
+        filtrando = False
+        try:
+            criar_pasta_downloads(PASTA_DOWNLOADS)
+            xml_antes = {f for f in os.listdir(PASTA_DOWNLOADS) if f.lower().endswith('.xml')}
+            with medir_fase("abrir navegador"):
+                driver = navegador.sessao_limpa(PASTA_DOWNLOADS)
                 driver.get(URL_PORTAL)
 
-                # ✅ APLICA O FILTRO ANTES DE QUALQUER DOWNLOAD
+            # ✅ APLICA O FILTRO ANTES DE QUALQUER DOWNLOAD (o tempo inclui o login manual)
+            filtrando = True
+            with medir_fase("login + filtro por competência"):
                 aplicar_filtro_por_competencia(driver, COMPETENCIA_DESEJADA, self.log)
+            filtrando = False
+
+            if self.somente_situacao:
+                with medir_fase("atualizar situação"):
+                    desempenho['cnpj'] = atualizar_situacoes_da_empresa(driver, PASTA_DOWNLOADS, COMPETENCIA_DESEJADA,
+                                                                        log_fn=self.log)['cnpj']
+                return
 
-                situacoes_dict = {}
-                pagina = 1
-                while True:
-                    self.log(f"--- PÁGINA {pagina} ---")
-                    res = processar_pagina(driver, COMPETENCIA_DESEJADA, situacoes_dict, self.log)
-                    aguardar_downloads(PASTA_DOWNLOADS, log_fn=self.log)
-                    if res == -1:
-                        break
-                    if res == 0 and not tem_proxima_pagina(driver, self.log):
-                        break
-                    if res > 0 and not tem_proxima_pagina(driver, self.log):
-                        break
-                    pagina += 1
-
-                xml_depois = {f for f in os.listdir(PASTA_DOWNLOADS) if f.lower().endswith('.xml')}
-                novos = sorted(xml_depois - xml_antes)
-                self.log(f"Novos XMLs nesta empresa: {len(novos)}")
-                if novos:
+            sessao = criar_sessao_http(driver) if MOTOR_DOWNLOAD == 'http' else None
+            sessao_empresa = {'cnpj': None, 'pasta_base': PASTA_DOWNLOADS}
+            situacoes_dict = baixar_notas_da_empresa(driver, COMPETENCIA_DESEJADA, PASTA_DOWNLOADS, self.log, sessao,
+                                                     sessao_empresa)
+            desempenho['cnpj'] = sessao_empresa['cnpj']
+
+            xml_depois = {f for f in os.listdir(PASTA_DOWNLOADS) if f.lower().endswith('.xml')}
+            novos = sorted(xml_depois - xml_antes)
+            self.log(f"Novos XMLs nesta empresa: {len(novos)}")
+            if novos:
+                with medir_fase("organizar + relatórios"):
                     organizar_xmls_e_gerar_relatorios_rodada(PASTA_DOWNLOADS, COMPETENCIA_DESEJADA, novos, situacoes_dict, self.log)
-            except Exception as e:
+        except Exception as e:
+            if filtrando and isinstance(e, TimeoutException):
+                # Tabela vazia depois do filtro: a empresa não tem notas na competência
                 self.log(f"ERRO na empresa {empresa}: SEM MOVIMENTO")
-            finally:
-                if driver:
-                    try:
-                        driver.quit()
-                    except:
-                        pass
-
-            if not messagebox.askyesno("Próxima empresa", "Deseja processar outro CNPJ?"):
-                break
+            else:
+                self.log(f"ERRO na empresa {empresa}: {str(e)[:100]}")
+                self.log("O que já foi baixado fica no diário; rodar de novo retoma desta empresa.")
+        finally:
+            if sessao:
+                sessao.close()
 
-        self.log("\n" + "="*90)
-        self.log("PROCESSO FINALIZADO COM SUCESSO!")
-        self.log("="*90)
+    def _rodar_em_paralelo(self, lista):
+        try:
+            empresas = ler_lista_empresas(lista)
+        except OSError as e:
+            self.log(f"ERRO ao ler a lista de empresas: {e}")
+            return
+        try:
+            navegadores = max(1, int(self.var_navegadores.get()))
+        except ValueError:
+            navegadores = NAVEGADORES_PARALELOS
+        self.log(f"{len(empresas)} empresa(s) na lista, {navegadores} navegador(es) em paralelo")
+        criar_pasta_downloads(PASTA_DOWNLOADS)
+        resumo = executar_empresas_em_paralelo(empresas, PASTA_DOWNLOADS, COMPETENCIA_DESEJADA, navegadores, self.log,
+                                               somente_situacao=self.somente_situacao)
+        self.log("\n" + "-"*90)
+        for r in resumo:
+            if r['situacao'] == 'erro':
+                estado = f"ERRO ({r['erro'][:60]})"
+            elif self.somente_situacao:
+                estado = f"{r['situacao']}, {r['canceladas']} cancelada(s) depois do download"
+            else:
+                estado = f"{r['situacao']}, {r['novos']} novo(s), {r['puladas']} já existente(s)"
+            self.log(f"{r['cnpj']} | {r['nome'][:40]:<40} | {estado}")
+        self.log(f"Empresas com erro: {sum(1 for r in resumo if r['situacao'] == 'erro')}/{len(resumo)}")
 
     def checar_updates_auto(self):
+        # A consulta vai à rede: fora do mainloop, para não congelar a janela
+        threading.Thread(target=self._checar_updates, daemon=True).start()
+
+    def _checar_updates(self):
         try:
+            import velopack
             manager = velopack.UpdateManager("https://api.github.com/repos/Pilotto-Contabilidade/Puxar-Notas-PORTAL-NACIONAL/releases")
             self.log("Iniciando verificação de updates...")
             update_info = manager.check_for_updates()
@@ -753,10 +3558,27 @@ class NFSeDownloaderApp:
 
 # ============================= FINAL =============================
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     try:
+        import velopack
         velopack.App().run()
     except Exception as e:
         print("Velopack not loaded:", e)
+    if "--job" in sys.argv or "--consolidar" in sys.argv:
+        ap = argparse.ArgumentParser(description="Download de NFS-e do Portal Nacional sem interface")
+        acao = ap.add_mutually_exclusive_group(required=True)
+        acao.add_argument("--job", help="arquivo JSON com empresas, modo, competências e pastas")
+        acao.add_argument("--consolidar", metavar="MM/AAAA", help="só gera o resumo consolidado a partir do dataset")
+        ap.add_argument("--perfilar", action="store_true", help="roda sob cProfile e grava o perfil em _desempenho/")
+        ap.add_argument("--pasta", action="append", help="com --consolidar: pasta de downloads (repita para Prestados e Tomados)")
+        ap.add_argument("--destino", help="com --consolidar: planilha a gerar")
+        args = ap.parse_args()
+        if args.consolidar:
+            if not args.pasta or not limites_competencia(args.consolidar):
+                ap.error("--consolidar precisa de uma competência válida e ao menos uma --pasta")
+            resumo = gerar_resumo_consolidado(args.pasta, args.consolidar, args.destino)
+            sys.exit(SAIDA_OK if resumo is not None else SAIDA_COM_ERROS)
+        sys.exit(executar_job(args.job, perfilar=args.perfilar))
     root = ctk.CTk()
     app = NFSeDownloaderApp(root)
     root.mainloop()
@@ -0,0 +1,149 @@
+"""
+Benchmark da gravação da planilha do relatório: escrever_relatorio_excel
+(uma passada, openpyxl write_only, estilos nomeados compartilhados) contra o
+fluxo anterior (pd.ExcelWriter -> load_workbook -> Alignment por célula -> save).
+
+Mede tempo e pico de memória Python (tracemalloc) de cada um e confere que as
+duas planilhas têm os mesmos valores e a mesma formatação.
+
+    python benchmarks/bench_excel.py --linhas 50000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.styles import Font, Alignment, PatternFill
+from openpyxl.utils import get_column_letter
+
+import Portal_Nacional as PN
+
+COLUNAS = [
+    'Arquivo', 'Número da Nota', 'Emitente', 'CNPJ Emitente', 'Tomador', 'CNPJ Tomador',
+    'Data Emissão', 'Valor BC', 'Valor Líquido', 'Valor Serviço', 'Descrição Serviço', 'Cód. Serviço',
+    'Situação', 'Total Retenções', 'IRRF', 'CP', 'CSLL', 'PIS', 'COFINS', 'ISS RETIDO?', 'VALOR DO ISS',
+]
+
+def gerar_linha(i, rnd):
+    v = round(rnd.uniform(100, 50000), 2)
+    return (
+        f"NFS{i:044d}.xml", str(i), "ALFA SERVICOS DE CONTABILIDADE LTDA", "11222333000181",
+        "BETA TECNOLOGIA E SISTEMAS S/A", "22333444000172", f"{rnd.randint(1, 28):02d}/11/2025",
+        v, round(v * 0.95, 2), v, "Serviços de consultoria contábil referentes à competência", "010101",
+        rnd.choice(["Autorizada", "Cancelada"]), round(v * 0.05, 2),
+        round(v * 0.015, 2), 0.0, round(v * 0.01, 2), round(v * 0.0065, 2), round(v * 0.03, 2),
+        rnd.choice(["SIM", "NÃO", "N/A"]), round(v * 0.02, 2),
+    )
+
+def gerar_dataframe(linhas):
+    rnd = random.Random(42)
+    return pd.DataFrame([gerar_linha(i, rnd) for i in range(linhas)], columns=COLUNAS)
+
+# ----------------------------------------------------------------------------
+# Fluxo anterior (referência)
+# ----------------------------------------------------------------------------
+def escrever_legado(df, rel_path):
+    with pd.ExcelWriter(rel_path, engine='openpyxl') as writer:
+        df.to_excel(writer, sheet_name='Detalhe_Notas', index=False)
+
+    wb = load_workbook(rel_path)
+    ws = wb['Detalhe_Notas']
+    header_font = Font(bold=True, color="FFFFFF")
+    header_fill = PatternFill(start_color="4F81B3", fill_type="solid")
+    for col in range(1, ws.max_column + 1):
+        cell = ws.cell(1, col)
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = Alignment(horizontal="center", vertical="center")
+        ws.column_dimensions[get_column_letter(col)].width = 15.43
+    for row in ws.iter_rows(min_row=1, max_row=ws.max_row):
+        ws.row_dimensions[row[0].row].height = 17.25
+        for cell in row:
+            cell.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
+    wb.save(rel_path)
+
+def escrever_novo(df, rel_path):
+    PN.escrever_relatorio_excel(rel_path, list(df.columns), PN.linhas_do_dataframe(df))
+
+def medir(funcao, *args):
+    """Tempo sem instrumentação e, numa segunda execução, o pico com tracemalloc."""
+    inicio = time.perf_counter()
+    funcao(*args)
+    duracao = time.perf_counter() - inicio
+    tracemalloc.start()
+    funcao(*args)
+    pico = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return duracao, pico / 2**20
+
+def medir_gerador(linhas, rel_path):
+    """Escritor novo alimentado por um gerador: pico de memória sem o DataFrame."""
+    def escrever():
+        rnd = random.Random(42)
+        PN.escrever_relatorio_excel(rel_path, COLUNAS, (gerar_linha(i, rnd) for i in range(linhas)))
+    return medir(escrever)
+
+def formato(cell):
+    """Atributos de formatação que aparecem na planilha."""
+    f, b, a = cell.font, cell.border, cell.alignment
+    bordas = tuple(getattr(getattr(b, lado), "style", None) for lado in ("left", "right", "top", "bottom"))
+    return (f.name, f.sz, f.b, f.color and (f.color.type, f.color.value), cell.fill.fill_type,
+            cell.fill.fgColor.rgb, bordas, a.horizontal, a.vertical, bool(a.wrap_text))
+
+def conferir(caminho_a, caminho_b, amostras=200):
+    """Mesmos valores e mesma formatação visível em linhas amostradas."""
+    a = load_workbook(caminho_a, read_only=False)['Detalhe_Notas']
+    b = load_workbook(caminho_b, read_only=False)['Detalhe_Notas']
+    if (a.max_row, a.max_column) != (b.max_row, b.max_column):
+        return False
+    rnd = random.Random(0)
+    linhas = [1, 2, a.max_row] + [rnd.randint(1, a.max_row) for _ in range(amostras)]
+    for r in linhas:
+        for c in range(1, a.max_column + 1):
+            ca, cb = a.cell(r, c), b.cell(r, c)
+            if ca.value != cb.value:
+                return False
+            if formato(ca) != formato(cb):
+                return False
+    largura = lambda ws: ws.column_dimensions[get_column_letter(1)].width
+    altura_b = b.sheet_format.defaultRowHeight if b.sheet_format.customHeight else None
+    return largura(a) == largura(b) and a.row_dimensions[2].height == altura_b
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--linhas", type=int, default=50000)
+    ap.add_argument("--sem-conferencia", action="store_true", help="não compara as duas planilhas")
+    args = ap.parse_args()
+
+    df = gerar_dataframe(args.linhas)
+    with tempfile.TemporaryDirectory() as pasta:
+        legado = os.path.join(pasta, "legado.xlsx")
+        novo = os.path.join(pasta, "novo.xlsx")
+        gerador = os.path.join(pasta, "gerador.xlsx")
+
+        t_legado, m_legado = medir(escrever_legado, df, legado)
+        t_novo, m_novo = medir(escrever_novo, df, novo)
+        print(f"{args.linhas} linhas x {len(COLUNAS)} colunas")
+        print(f"legado (3 passadas): {t_legado:7.2f}s | pico {m_legado:7.1f} MiB")
+        print(f"passada única:       {t_novo:7.2f}s | pico {m_novo:7.1f} MiB | {t_legado / t_novo:.2f}x")
+
+        # Memória plana: o pico do escritor não deve crescer com o número de linhas
+        for n in (args.linhas // 10, args.linhas):
+            t, m = medir_gerador(n, gerador)
+            print(f"gerador {n:>7} linhas: {t:7.2f}s | pico {m:7.1f} MiB")
+
+        if not args.sem_conferencia:
+            ok = conferir(legado, novo)
+            print(f"Planilhas equivalentes: {'sim' if ok else 'NÃO'}")
+            return 0 if ok else 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
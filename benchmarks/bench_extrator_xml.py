@@ -0,0 +1,156 @@
+"""
+Benchmark da leitura de XML: extrair_campos_xml (uma única varredura da árvore)
+contra a implementação anterior com ElementTree + ~25 buscas './/'.
+
+Também confere, arquivo a arquivo e nos dois modos, que os dicionários são
+idênticos.
+
+    python benchmarks/bench_extrator_xml.py --notas 3000
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import datetime
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import Portal_Nacional as PN
+from nfse_sintetica import gerar_corpus, NS
+
+# ----------------------------------------------------------------------------
+# Implementação anterior (referência)
+# ----------------------------------------------------------------------------
+def _get_tag_value(parent, tags, sub_parent=None):
+    ns = NS
+    if parent is None:
+        return 0.0
+    base = parent if sub_parent is None else parent.find(f'.//{{{ns}}}{sub_parent}')
+    if base is None:
+        return 0.0
+    for tag_name in tags:
+        elem = base.find(f'.//{{{ns}}}{tag_name}')
+        if elem is not None and elem.text:
+            return PN.safe_float(elem.text.strip())
+    return 0.0
+
+def extrair_legado(xml_path, modo):
+    try:
+        root = ET.parse(xml_path).getroot()
+        ns = '{%s}' % NS
+        emit_nome = root.findtext(f'.//{ns}emit/{ns}xNome', '')
+        emit_cnpj = root.findtext(f'.//{ns}emit/{ns}CNPJ', '')
+        emit_cpf = root.findtext(f'.//{ns}emit/{ns}CPF', '')
+        toma_nome = root.findtext(f'.//{ns}toma/{ns}xNome', '')
+        toma_cnpj = root.findtext(f'.//{ns}toma/{ns}CNPJ', '')
+        toma_cpf = root.findtext(f'.//{ns}toma/{ns}CPF', '')
+        n_nfse = root.findtext(f'.//{ns}infNFSe/{ns}nNFSe', '')
+        dh_tag = 'dhProc' if modo == 'tomados' else 'dhEmi'
+        dhEmi = root.find(f'.//{ns}{dh_tag}') or root.find(f'.//{ns}dhEmi')
+        data_emissao = ''
+        if dhEmi is not None and dhEmi.text:
+            try:
+                data_emissao = datetime.datetime.strptime(dhEmi.text[:10], "%Y-%m-%d").strftime("%d/%m/%Y")
+            except Exception:
+                pass
+        v_bc = PN.safe_float(root.findtext(f'.//{ns}valores/{ns}vBC'))
+        v_liq = PN.safe_float(root.findtext(f'.//{ns}valores/{ns}vLiq'))
+        v_total_ret = PN.safe_float(root.findtext(f'.//{ns}valores/{ns}vTotalRet'))
+        v_serv = PN.safe_float(root.findtext(f'.//{ns}infDPS/{ns}valores/{ns}vServPrest/{ns}vServ'))
+        x_desc = ''
+        codigo_serv = ''
+        infDPS = root.find(f'.//{ns}infDPS')
+        serv_tag = 'cServ' if modo == 'tomados' else 'serv'
+        serv = infDPS.find(f'.//{ns}{serv_tag}') if infDPS else None
+        if serv is not None:
+            desc_elt = serv.find(f'.//{ns}xDescServ')
+            if desc_elt is not None and desc_elt.text:
+                x_desc = desc_elt.text.strip()
+            cod_elt = serv.find(f'.//{ns}cTribNac')
+            if cod_elt is not None and cod_elt.text:
+                codigo_serv = cod_elt.text.strip()
+        tribFed = root.find(f'.//{ns}infDPS/{ns}valores/{ns}trib/{ns}tribFed')
+        iss_retido = 'N/A'
+        valor_iss_retido = 0.0
+        tpRet = root.findtext(f'.//{ns}tpRetISSQN', '')
+        if tpRet == '2':
+            iss_retido = 'SIM'
+            valor_iss_retido = PN.safe_float(root.findtext(f'.//{ns}vISSQN', ''))
+        elif tpRet == '1':
+            iss_retido = 'NÃO'
+        return {
+            'arquivo': os.path.basename(xml_path), 'numero_nota': n_nfse,
+            'emitente_nome': emit_nome, 'emitente_cnpj': emit_cnpj if emit_cnpj else emit_cpf,
+            'tomador_nome': toma_nome, 'tomador_cnpj': toma_cnpj if toma_cnpj else toma_cpf,
+            'data_emissao': data_emissao, 'valor_bc': v_bc, 'valor_liq': v_liq, 'valor_servico': v_serv,
+            'descricao_serv': x_desc, 'codigo_serv': codigo_serv, 'situacao': None,
+            'total_retencoes': v_total_ret,
+            'irrf': _get_tag_value(tribFed, ['vRetIRRF']), 'cp': _get_tag_value(tribFed, ['vRetCP']),
+            'csll': _get_tag_value(tribFed, ['vRetCSLL']),
+            'pis': _get_tag_value(tribFed, ['vPis'], 'piscofins'),
+            'cofins': _get_tag_value(tribFed, ['vCofins'], 'piscofins'),
+            'iss_retido': iss_retido, 'valor_iss_retido': valor_iss_retido,
+        }
+    except Exception:
+        return None
+
+# ----------------------------------------------------------------------------
+# Casos de borda (além do corpus sintético)
+# ----------------------------------------------------------------------------
+CASOS_BORDA = {
+    "vazios.xml": f'<NFSe xmlns="{NS}"><infNFSe><nNFSe></nNFSe><emit><CNPJ/><CPF>123</CPF><xNome>  X  </xNome></emit>'
+                  f'<DPS><infDPS><dhEmi>2025-11-03</dhEmi><serv><cServ><xDescServ>   </xDescServ><cTribNac>01</cTribNac>'
+                  f'</cServ></serv><valores><trib><tribMun><tpRetISSQN>2</tpRetISSQN></tribMun><tribFed><vRetIRRF></vRetIRRF>'
+                  f'<piscofins><vPis>1,5</vPis></piscofins><vRetIRRF>9</vRetIRRF></tribFed></trib></valores></infDPS></DPS>'
+                  f'</infNFSe></NFSe>',
+    "dhproc_com_filho.xml": f'<NFSe xmlns="{NS}"><infNFSe><dhProc>2025-10-01<x/></dhProc><DPS><infDPS><dhEmi>2025-11-02'
+                            f'</dhEmi></infDPS></DPS></infNFSe></NFSe>',
+    "sem_infdps.xml": f'<NFSe xmlns="{NS}"><infNFSe><nNFSe>7</nNFSe><dhProc>2025-11-09T10:00:00</dhProc>'
+                      f'<valores><vBC>abc</vBC><vLiq>10.5</vLiq></valores><tpRetISSQN> 2</tpRetISSQN></infNFSe></NFSe>',
+    "outro_ns.xml": '<NFSe xmlns="http://outro"><infNFSe><nNFSe>1</nNFSe></infNFSe></NFSe>',
+    "quebrado.xml": f'<NFSe xmlns="{NS}"><infNFSe>',
+}
+
+def medir(funcao, caminhos, modo, repeticoes):
+    melhor = float("inf")
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        for c in caminhos:
+            funcao(c, modo)
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--notas", type=int, default=3000)
+    ap.add_argument("--repeticoes", type=int, default=3)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        caminhos = gerar_corpus(pasta, args.notas)
+        for nome, conteudo in CASOS_BORDA.items():
+            with open(os.path.join(pasta, nome), "w", encoding="utf-8") as f:
+                f.write(conteudo)
+        todos = caminhos + [os.path.join(pasta, n) for n in CASOS_BORDA]
+
+        divergencias = 0
+        for modo in ("prestados", "tomados"):
+            for c in todos:
+                novo = PN.extrair_campos_xml(c, modo)
+                if novo != extrair_legado(c, modo) or (novo and list(novo) != list(extrair_legado(c, modo))):
+                    divergencias += 1
+                    print(f"DIVERGÊNCIA [{modo}] {os.path.basename(c)}")
+        print(f"Equivalência: {len(todos) * 2 - divergencias}/{len(todos) * 2} arquivos idênticos")
+
+        for modo in ("prestados", "tomados"):
+            t_legado = medir(extrair_legado, caminhos, modo, args.repeticoes)
+            t_novo = medir(PN.extrair_campos_xml, caminhos, modo, args.repeticoes)
+            print(f"[{modo}] legado: {len(caminhos) / t_legado:8.0f} notas/s | "
+                  f"passada única: {len(caminhos) / t_novo:8.0f} notas/s | {t_legado / t_novo:.2f}x")
+        return 1 if divergencias else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+Benchmark da abertura do navegador por empresa: Chrome novo a cada empresa
+(criar_driver + quit, como antes) contra o NavegadorReutilizado (um Chrome
+aberto, contexto de navegação novo a cada empresa).
+
+Para cada "empresa" faz login no portal simulado (mock_portal.py) e abre a
+lista de notas. Confere que a sessão não vaza: logo depois de sessao_limpa()
+a lista tem de redirecionar para o login. Requer Chrome/chromedriver.
+
+    python benchmarks/bench_navegador.py --empresas 10 --headless
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import Portal_Nacional as PN
+from mock_portal import PortalSimulado, gerar_notas_da_empresa
+from nfse_sintetica import EMPRESAS
+
+def empresa(i):
+    cnpj, nome = EMPRESAS[i % len(EMPRESAS)]
+    return {'cnpj': cnpj, 'senha': 'senha', 'nome': nome}
+
+def sessao_vazou(driver):
+    """Sem login, a lista de notas deveria redirecionar para a página de login."""
+    driver.get(PN.URL_LISTA[PN.MODO])
+    return "login" not in driver.current_url.lower()
+
+def rodar_frio(empresas, pasta, headless):
+    for i in range(empresas):
+        driver = PN.criar_driver(headless=headless, pasta=pasta)
+        try:
+            PN.fazer_login(driver, empresa(i), lambda msg: None)
+        finally:
+            driver.quit()
+
+def rodar_reutilizado(empresas, pasta, headless, limite):
+    vazamentos = 0
+    navegador = PN.NavegadorReutilizado(pasta, headless=headless, limite=limite, log_fn=print)
+    try:
+        for i in range(empresas):
+            driver = navegador.sessao_limpa()
+            vazamentos += sessao_vazou(driver)
+            PN.fazer_login(driver, empresa(i), lambda msg: None)
+    finally:
+        navegador.fechar()
+    return vazamentos
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--empresas", type=int, default=10)
+    ap.add_argument("--limite", type=int, default=PN.EMPRESAS_POR_NAVEGADOR, help="empresas por navegador")
+    ap.add_argument("--headless", action="store_true")
+    args = ap.parse_args()
+
+    notas = {'prestados': gerar_notas_da_empresa(15, 'prestados', EMPRESAS[0][0])}
+    with PortalSimulado(notas) as portal, tempfile.TemporaryDirectory() as pasta:
+        PN.MODO = 'prestados'
+        PN.URL_PORTAL = portal.url
+        PN.URL_LISTA = {'prestados': portal.url + "/Notas/Emitidas", 'tomados': portal.url + "/Notas/Recebidas"}
+
+        # A primeira abertura resolve o chromedriver; fica fora das duas medições
+        PN.criar_driver(headless=args.headless, pasta=pasta).quit()
+
+        inicio = time.perf_counter()
+        rodar_frio(args.empresas, pasta, args.headless)
+        frio = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        vazamentos = rodar_reutilizado(args.empresas, pasta, args.headless, args.limite)
+        quente = time.perf_counter() - inicio
+
+    print(f"{args.empresas} empresas | login + lista de notas em cada uma")
+    print(f"Chrome novo por empresa: {frio:6.2f}s | {frio / args.empresas:.2f}s por empresa")
+    print(f"Chrome reutilizado:      {quente:6.2f}s | {quente / args.empresas:.2f}s por empresa | {frio / quente:.2f}x")
+    print(f"Sessões que vazaram para a empresa seguinte: {vazamentos}")
+    return 1 if vazamentos else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""
+Validação e benchmark do backend de distribuição por NSU contra o ADN simulado
+(mock_adn.py), sem rede e sem navegador:
+
+1. primeira execução interrompida por um HTTP 500 no meio da sincronização;
+2. segunda execução retoma do último NSU gravado e completa a competência
+   (nenhuma nota duplicada, canceladas em Canceladas, DANFSe junto de cada XML);
+3. terceira execução não recebe nada (uma única consulta);
+4. notas publicadas depois chegam sozinhas na quarta execução;
+5. o cancelamento de uma nota já organizada a leva para Canceladas na quinta;
+6. com duas empresas na mesma execução, cada uma organiza só as próprias notas
+   (as do mês anterior, que esperavam na entrada desde a primeira execução);
+7. uma execução num processo novo, com uma nota nova, regera o relatório e o
+   dataset da empresa sem perder a situação das notas que já estão em
+   Canceladas (a situação em memória da execução anterior não existe mais).
+
+    python benchmarks/bench_nsu.py --notas 500 --por-lote 50 --latencia 0.05
+    python benchmarks/bench_nsu.py --modo tomados --verbose
+"""
+import os
+import sys
+import time
+import glob
+import json
+import random
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import Portal_Nacional as PN
+from mock_adn import ADNSimulado, gerar_notas_adn
+from nfse_sintetica import EMPRESAS, gerar_nota
+
+def esperadas(notas, modo, cnpj, competencia):
+    """Chaves que devem terminar organizadas: a empresa é a parte do modo e a emissão cai na competência."""
+    def parte(n):
+        emit = n["emit"][0][:11] if n["emit_cpf"] else n["emit"][0]
+        toma = n["toma"][0][:11] if n["toma_cpf"] else n["toma"][0]
+        return emit if modo == "prestados" else toma
+    return {n["chave"]: n["cancelada"] for n in notas
+            if parte(n) == cnpj and n["dh_emi"].strftime("%m/%Y") == competencia}
+
+def organizadas(pasta_base):
+    """{chave: cancelada?} dos XMLs nas pastas das empresas, e o número de PDFs."""
+    xmls, pdfs = {}, 0
+    for root_dir, dirs, files in os.walk(pasta_base):
+        dirs[:] = [d for d in dirs if not d.startswith("_")]
+        for f in files:
+            if f.lower().endswith(".xml"):
+                xmls[os.path.splitext(f)[0]] = f"{os.sep}Canceladas{os.sep}" in root_dir + os.sep
+            elif f.lower().endswith(".pdf"):
+                pdfs += 1
+    return xmls, pdfs
+
+def rodar(adn, empresas, pasta_base, competencia, log_fn):
+    PN.SITUACOES_POR_ARQUIVO.clear()
+    PN.PDF_POR_ARQUIVO.clear()
+    PN.carregar_notas_existentes(pasta_base, competencia, log_fn)
+    requisicoes = adn.requisicoes
+    inicio = time.perf_counter()
+    resumo = PN.executar_empresas_por_nsu(empresas if isinstance(empresas, list) else [empresas], pasta_base,
+                                          competencia, log_fn)
+    registro = resumo if isinstance(empresas, list) else resumo[0]
+    return registro, time.perf_counter() - inicio, adn.requisicoes - requisicoes
+
+def filho(modo, url_adn, pasta_base, competencia):
+    """Uma execução da empresa num processo novo, como um job agendado; imprime o registro em JSON."""
+    cnpj, nome = EMPRESAS[0]
+    PN.MODO = modo
+    PN.URL_ADN = url_adn + "/contribuintes"
+    PN.URL_ADN_DANFSE = url_adn + "/danfse"
+    PN.PASTA_DOWNLOADS = pasta_base
+    PN.carregar_notas_existentes(pasta_base, competencia, lambda msg: None)
+    empresa = {'cnpj': cnpj, 'nome': nome, 'senha': '', 'certificado': None}
+    print(json.dumps(PN.executar_empresas_por_nsu([empresa], pasta_base, competencia, lambda msg: None)[0]))
+
+def em_canceladas(pasta_base):
+    """Chaves dos XMLs organizados em Canceladas, de todas as empresas."""
+    chaves = []
+    for root_dir, dirs, files in os.walk(pasta_base):
+        dirs[:] = [d for d in dirs if not d.startswith("_")]
+        if os.path.basename(os.path.dirname(root_dir)) == "Canceladas":
+            chaves += [os.path.splitext(f)[0] for f in files if f.lower().endswith(".xml")]
+    return chaves
+
+def canceladas_no_relatorio(pasta_base, competencia):
+    """Linhas com situação Cancelada na planilha da competência e no dataset da empresa (None sem pyarrow)."""
+    from openpyxl import load_workbook
+    planilhas = glob.glob(os.path.join(pasta_base, "*", f"Relatório * - {competencia.replace('/', '_')}.xlsx"))
+    linhas = list(load_workbook(planilhas[0], read_only=True).active.iter_rows(values_only=True))
+    coluna = linhas[0].index("Situação")
+    na_planilha = sum(linha[coluna] == "Cancelada" for linha in linhas[1:])
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        return na_planilha, None
+    mes, ano = competencia.split("/")
+    arquivo = os.path.join(pasta_base, PN.PASTA_DATASET, f"modo={PN.MODO}", f"competencia={ano}-{mes}",
+                           f"cnpj={EMPRESAS[0][0]}", "notas.parquet")
+    return na_planilha, pq.read_table(arquivo, columns=["situacao"]).column("situacao").to_pylist().count("Cancelada")
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--notas", type=int, default=200, help="notas emitidas e recebidas da empresa na competência")
+    ap.add_argument("--competencia", default="11/2025")
+    ap.add_argument("--modo", choices=("prestados", "tomados"), default="prestados")
+    ap.add_argument("--por-lote", type=int, default=50)
+    ap.add_argument("--latencia", type=float, default=0.0, help="segundos por resposta do ADN")
+    ap.add_argument("--verbose", action="store_true", help="mostra o log do aplicativo")
+    ap.add_argument("--filho", nargs=4, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.filho:
+        return filho(*args.filho)
+
+    mes, ano = (int(p) for p in args.competencia.split("/"))
+    cnpj, nome = EMPRESAS[0]
+    empresa = {'cnpj': cnpj, 'nome': nome, 'senha': '', 'certificado': None}
+    notas = gerar_notas_adn(args.notas, cnpj, (ano, mes))
+    log_fn = print if args.verbose else (lambda msg: None)
+    falhas = []
+
+    def conferir(etapa, condicao):
+        print(f"  [{'ok' if condicao else 'FALHOU'}] {etapa}")
+        if not condicao:
+            falhas.append(etapa)
+
+    with ADNSimulado(notas, args.por_lote, args.latencia) as adn, tempfile.TemporaryDirectory() as pasta_base:
+        PN.MODO = args.modo
+        PN.URL_ADN = adn.url + "/contribuintes"
+        PN.URL_ADN_DANFSE = adn.url + "/danfse"
+        PN.PASTA_DOWNLOADS = pasta_base
+        PN.zerar_tempos()
+        alvo = esperadas(notas, args.modo, cnpj, args.competencia)
+        documentos = len(adn.documentos.get(cnpj, []))
+        print(f"Modo {args.modo} | {documentos} documentos para {cnpj} | {len(alvo)} notas na competência "
+              f"({sum(alvo.values())} canceladas) | lotes de {args.por_lote} | latência {args.latencia}s")
+
+        adn.falhar_na_requisicao = 3
+        r1, t1, q1 = rodar(adn, empresa, pasta_base, args.competencia, log_fn)
+        print(f"1ª execução (interrompida): {r1['situacao']} | {q1} consultas | {t1:.2f}s")
+        conferir("a falha do ADN aparece como erro da empresa", r1['situacao'] == 'erro')
+
+        r2, t2, q2 = rodar(adn, empresa, pasta_base, args.competencia, log_fn)
+        xmls, pdfs = organizadas(pasta_base)
+        print(f"2ª execução (retomada):     {r2['documentos']} documentos, {r2['novos']} notas | {q2} consultas | "
+              f"{t2:.2f}s | {r2['documentos'] / t2 * 60:.0f} documentos/min")
+        conferir("retomou do último NSU gravado (2 lotes antes da falha)",
+                 r2['documentos'] == documentos - 2 * args.por_lote)
+        conferir("todas as notas da competência organizadas, sem duplicatas", set(xmls) == set(alvo))
+        conferir("canceladas em Canceladas, autorizadas em Autorizadas", xmls == alvo)
+        conferir("um DANFSe por nota", pdfs == len(xmls))
+
+        r3, t3, q3 = rodar(adn, empresa, pasta_base, args.competencia, log_fn)
+        print(f"3ª execução (sem novidades): {r3['documentos']} documentos | {q3} consulta(s) | {t3:.2f}s")
+        conferir("nada novo: uma consulta e nenhum documento", (r3['documentos'], r3['novos'], q3) == (0, 0, 1))
+
+        rnd = random.Random(7)
+        parte = {"cnpj_emit": cnpj} if args.modo == "prestados" else {"cnpj_toma": cnpj}
+        novas = [gerar_nota(900000 + i, (ano, mes), rnd=rnd, **parte) for i in range(5)]
+        for nota in novas:
+            nota["emit_cpf"] = nota["toma_cpf"] = False
+        adn.publicar(novas, cancelamentos=novas[:1])
+        r4, t4, q4 = rodar(adn, empresa, pasta_base, args.competencia, log_fn)
+        xmls, _ = organizadas(pasta_base)
+        print(f"4ª execução (5 notas novas, 1 cancelada): {r4['documentos']} documentos, {r4['novos']} notas | "
+              f"{q4} consultas | {t4:.2f}s")
+        conferir("só os documentos novos", r4['documentos'] == 6 and r4['novos'] == 5)
+        conferir("nota nova cancelada em Canceladas", xmls.get(novas[0]["chave"]) is True)
+
+        adn.publicar([], cancelamentos=novas[1:2])
+        r5, t5, q5 = rodar(adn, empresa, pasta_base, args.competencia, log_fn)
+        xmls, pdfs = organizadas(pasta_base)
+        print(f"5ª execução (cancelamento de nota já organizada): {r5['documentos']} documento(s), "
+              f"{r5['canceladas']} movida(s) para Canceladas | {q5} consultas | {t5:.2f}s")
+        conferir("nota cancelada depois vai para Canceladas, com o DANFSe",
+                 r5['canceladas'] == 1 and xmls.get(novas[1]["chave"]) is True and pdfs == len(xmls))
+
+        cnpj_b, nome_b = EMPRESAS[1]
+        notas_b = gerar_notas_adn(args.notas // 4, cnpj_b, (ano, mes), semente=99)
+        adn.publicar(notas_b)
+        anterior = f"{mes - 1:02d}/{ano}" if mes > 1 else f"12/{ano - 1}"
+        todas = notas + novas + notas_b
+        r6, t6, q6 = rodar(adn, [{'cnpj': cnpj_b, 'nome': nome_b, 'senha': '', 'certificado': None}, empresa],
+                           pasta_base, anterior, log_fn)
+        esperado = [len(esperadas(todas, args.modo, c, anterior)) for c in (cnpj_b, cnpj)]
+        por_empresa = " | ".join(f"{r['nome'][:12]}: {r['novos']} notas" for r in r6)
+        print(f"6ª execução (duas empresas, competência {anterior}): {por_empresa} | {q6} consultas | {t6:.2f}s")
+        conferir("cada empresa organiza só as próprias notas", [r['novos'] for r in r6] == esperado)
+
+        nova = gerar_nota(910000, (ano, mes), rnd=rnd, **parte)
+        nova["emit_cpf"] = nova["toma_cpf"] = False
+        adn.publicar([nova])
+        todas.append(nova)
+        inicio = time.perf_counter()
+        saida = subprocess.run([sys.executable, os.path.abspath(__file__), "--modo", args.modo, "--filho", args.modo,
+                                adn.url, pasta_base, args.competencia], capture_output=True, text=True, check=True)
+        r7, t7 = json.loads(saida.stdout.strip().splitlines()[-1]), time.perf_counter() - inicio
+        alvo = esperadas(todas, args.modo, cnpj, args.competencia)
+        # Além da nota nova, chegam as da competência que a outra empresa enviou na 6ª execução
+        novos = len(alvo) - len(esperadas(notas + novas, args.modo, cnpj, args.competencia))
+        # Referência: o que está em Canceladas no disco (números repetidos entre as empresas sintéticas
+        # são descartados pelo organizador como duplicados)
+        canceladas = sum(chave in alvo for chave in em_canceladas(pasta_base))
+        na_planilha, no_dataset = canceladas_no_relatorio(pasta_base, args.competencia)
+        print(f"7ª execução (processo novo, 1 nota nova): {r7['novos']} nota(s) de {novos} | relatório com {na_planilha} "
+              f"cancelada(s), dataset com {no_dataset} | {canceladas} esperada(s) | {t7:.2f}s")
+        conferir("o relatório regerado em outro processo mantém as canceladas",
+                 r7['novos'] == novos and na_planilha == canceladas and no_dataset in (None, canceladas))
+
+    PN.resumo_tempos(print)
+    print("Resultado:", "OK" if not falhas else f"{len(falhas)} verificação(ões) falharam")
+    return 1 if falhas else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
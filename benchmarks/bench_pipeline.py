@@ -0,0 +1,105 @@
+"""
+Benchmark ponta a ponta contra o portal simulado (mock_portal.py): Chrome de
+verdade (Selenium), login, filtro por competência, processar_pagina em todas as
+páginas e organizar_xmls_e_gerar_relatorios_rodada no fim, exatamente como o
+aplicativo faz para uma empresa.
+
+Mostra notas por minuto e o tempo de cada fase (medir_fase), para volumes e
+latências configuráveis. Requer Chrome/chromedriver (Selenium Manager).
+
+    python benchmarks/bench_pipeline.py --notas 200 --latencia-pagina 0.3 --latencia-download 0.15
+    python benchmarks/bench_pipeline.py --modo tomados --motor navegador --headless
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import Portal_Nacional as PN
+from mock_portal import PortalSimulado, gerar_notas_da_empresa
+from nfse_sintetica import EMPRESAS
+
+def rodar_empresa(pasta_base, competencia, headless, log_fn):
+    """Uma empresa completa (mesmas chamadas de executar_empresas_em_paralelo); devolve nº de XMLs novos."""
+    pasta = os.path.join(pasta_base, PN.PASTA_ENTRADA, "navegador_1")
+    PN.criar_pasta_downloads(pasta)
+    driver = None
+    sessao = None
+    try:
+        with PN.medir_fase("abrir navegador"):
+            driver = PN.criar_driver(headless=headless, pasta=pasta)
+        with PN.medir_fase("login"):
+            PN.fazer_login(driver, {'cnpj': EMPRESAS[0][0], 'senha': 'senha', 'nome': EMPRESAS[0][1]}, log_fn)
+        with PN.medir_fase("filtro por competência"):
+            PN.aplicar_filtro_por_competencia(driver, competencia, log_fn)
+        sessao = PN.criar_sessao_http(driver) if PN.MOTOR_DOWNLOAD == 'http' else None
+        situacoes_dict = PN.baixar_notas_da_empresa(driver, competencia, pasta, log_fn, sessao,
+                                                    {'cnpj': EMPRESAS[0][0]})
+    finally:
+        if sessao:
+            sessao.close()
+        if driver:
+            driver.quit()
+    novos = sorted(f for f in os.listdir(pasta) if f.lower().endswith('.xml'))
+    with PN.medir_fase("organizar + relatórios"):
+        PN.organizar_xmls_e_gerar_relatorios_rodada(pasta_base, competencia, novos, situacoes_dict, log_fn,
+                                                     pasta_origem=pasta)
+    return len(novos)
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--notas", type=int, default=100, help="notas da empresa na competência")
+    ap.add_argument("--competencia", default="11/2025")
+    ap.add_argument("--modo", choices=("prestados", "tomados"), default="prestados")
+    ap.add_argument("--motor", choices=("http", "navegador"), default=PN.MOTOR_DOWNLOAD)
+    ap.add_argument("--por-pagina", type=int, default=15)
+    ap.add_argument("--latencia-pagina", type=float, default=0.0, help="segundos por página/redirect")
+    ap.add_argument("--latencia-download", type=float, default=0.0, help="segundos por arquivo")
+    ap.add_argument("--janela-paginacao", type=int, help="paginação só com N páginas em volta da atual, sem \"Última\"")
+    ap.add_argument("--headless", action="store_true")
+    ap.add_argument("--verbose", action="store_true", help="mostra o log do aplicativo")
+    args = ap.parse_args()
+
+    mes, ano = (int(p) for p in args.competencia.split("/"))
+    notas = {args.modo: gerar_notas_da_empresa(args.notas, args.modo, EMPRESAS[0][0], (ano, mes))}
+    esperadas = sum(1 for n in notas[args.modo]
+                    if (n["dh_emi"] if args.modo == "prestados" else n["dh_proc"]).strftime("%m/%Y") == args.competencia)
+    log_fn = print if args.verbose else (lambda msg: None)
+
+    with PortalSimulado(notas, args.por_pagina, args.latencia_pagina, args.latencia_download,
+                        janela_paginacao=args.janela_paginacao) as portal, \
+            tempfile.TemporaryDirectory() as pasta_base:
+        PN.MODO = args.modo
+        PN.MOTOR_DOWNLOAD = args.motor
+        PN.URL_PORTAL = portal.url
+        PN.URL_LISTA = {'prestados': portal.url + "/Notas/Emitidas", 'tomados': portal.url + "/Notas/Recebidas"}
+        PN.PASTA_DOWNLOADS = pasta_base
+        PN.SITUACOES_POR_ARQUIVO.clear()
+        PN.PDF_POR_ARQUIVO.clear()
+        PN.zerar_tempos()
+        with PN.medir_fase("carregar notas existentes"):
+            PN.carregar_notas_existentes(pasta_base, args.competencia, log_fn)
+
+        inicio = time.perf_counter()
+        baixadas = rodar_empresa(pasta_base, args.competencia, args.headless, log_fn)
+        total = time.perf_counter() - inicio
+
+        organizadas = sum(1 for _, _, arquivos in os.walk(pasta_base)
+                          for f in arquivos if f.lower().endswith('.xml'))
+        relatorios = sum(1 for _, _, arquivos in os.walk(pasta_base)
+                         for f in arquivos if f.lower().endswith('.xlsx'))
+
+    print(f"Modo {args.modo} | motor {args.motor} | {args.por_pagina} por página | "
+          f"latência página {args.latencia_pagina}s, download {args.latencia_download}s")
+    print(f"Notas na competência: {esperadas} | baixadas: {baixadas} | organizadas: {organizadas} | "
+          f"relatórios: {relatorios} | requisições de arquivo: {portal.downloads}")
+    print(f"Tempo total: {total:.2f}s | {baixadas / total * 60:.1f} notas/min")
+    PN.resumo_tempos(print)
+    return 0 if baixadas == organizadas == esperadas else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+Benchmark de memória do relatório de uma empresa muito grande: o caminho em
+memória (DataFrame com todas as notas) contra o relatório em fluxo
+(gerar_relatorio_em_fluxo, em lotes de LOTE_RELATORIO_EM_FLUXO).
+
+Gera as notas sintéticas uma vez e roda cada caminho num processo separado,
+com o índice de notas vazio (tudo é lido dos XMLs) e PARSE_WORKERS=1, para
+que a memória medida seja toda do processo. Mostra tempo, pico de memória
+Python (tracemalloc) e pico de RSS, em dois volumes: no fluxo o pico não deve
+crescer com o número de notas. Num volume pequeno confere que os dois caminhos
+geram a mesma planilha, o mesmo resumo e o mesmo dataset.
+
+    python benchmarks/bench_relatorio_fluxo.py --notas 100000
+    python benchmarks/bench_relatorio_fluxo.py --notas 20000 --modo tomados --com-pdf
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+COMPETENCIA = "11/2025"
+
+def gerar_empresa(pasta, quantidade, com_pdf):
+    """Pasta de empresa como o organizador deixa: Autorizadas/XML e Autorizadas/PDF."""
+    from nfse_sintetica import gerar_corpus
+    pasta_xml = os.path.join(pasta, "Autorizadas", "XML")
+    gerar_corpus(pasta_xml, quantidade, com_pdf=com_pdf)
+    if com_pdf:
+        pasta_pdf = os.path.join(pasta, "Autorizadas", "PDF")
+        os.makedirs(pasta_pdf, exist_ok=True)
+        for f in os.listdir(pasta_xml):
+            if f.lower().endswith(".pdf"):
+                os.replace(os.path.join(pasta_xml, f), os.path.join(pasta_pdf, f))
+    return pasta
+
+def filho(caminho, modo, pasta_empresa, pasta_base):
+    """Roda um caminho do relatório neste processo e imprime as medidas em JSON."""
+    import Portal_Nacional as PN
+    PN.MODO = modo
+    PN.PARSE_WORKERS = 1
+    PN.LIMITE_RELATORIO_EM_FLUXO = 0 if caminho == "fluxo" else sys.maxsize - 1
+    log = []
+
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    PN.gerar_relatorio_para_empresa(pasta_base, pasta_empresa, COMPETENCIA, {}, log.append)
+    tempo = time.perf_counter() - inicio
+    pico = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # A planilha sai na pasta da empresa, compartilhada entre as execuções
+    for f in os.listdir(pasta_empresa):
+        if f.lower().endswith(".xlsx"):
+            shutil.move(os.path.join(pasta_empresa, f), os.path.join(pasta_base, f))
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 if resource else None
+    print(json.dumps({"tempo": tempo, "pico": pico, "rss": rss,
+                      "resumo": [linha for linha in log if linha.startswith("Total notas")]}))
+
+def medir(caminho, modo, pasta_empresa):
+    """Executa `caminho` num processo novo; devolve (medidas, pasta_base com planilha e dataset)."""
+    pasta_base = tempfile.mkdtemp(prefix=f"bench_{caminho}_")
+    saida = subprocess.run([sys.executable, os.path.abspath(__file__), "--filho", caminho, modo,
+                            pasta_empresa, pasta_base], capture_output=True, text=True, check=True)
+    return json.loads(saida.stdout.strip().splitlines()[-1]), pasta_base
+
+def mesma_saida(base_a, base_b):
+    """Mesma planilha (valores e formatos, na mesma ordem) e mesmo dataset nos dois caminhos."""
+    from openpyxl import load_workbook
+    import pyarrow.dataset as ds
+
+    def planilha(base):
+        nome = next(f for f in os.listdir(base) if f.lower().endswith(".xlsx"))
+        ws = load_workbook(os.path.join(base, nome), read_only=True).active
+        return [tuple((c.value, c.number_format) for c in linha) for linha in ws.iter_rows()]
+
+    def dataset(base):
+        tabela = ds.dataset(os.path.join(base, "_dataset"), format="parquet", partitioning="hive").to_table()
+        return tabela.to_pandas().sort_values("arquivo").reset_index(drop=True)
+
+    return planilha(base_a) == planilha(base_b) and dataset(base_a).equals(dataset(base_b))
+
+def mb(n):
+    return f"{n / 2**20:8.1f} MB" if n is not None else "       -   "
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--notas", type=int, default=100000, help="notas da empresa no volume maior")
+    ap.add_argument("--conferencia", type=int, default=2000, help="notas da conferência entre os dois caminhos")
+    ap.add_argument("--modo", choices=("prestados", "tomados"), default="prestados")
+    ap.add_argument("--com-pdf", action="store_true", help="grava também os DANFSe (Tomados lê os PDFs)")
+    ap.add_argument("--filho", nargs=4, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.filho:
+        return filho(*args.filho)
+
+    import Portal_Nacional as PN
+    falhas = []
+    with tempfile.TemporaryDirectory() as raiz:
+        empresa = gerar_empresa(os.path.join(raiz, "conferencia"), args.conferencia, args.com_pdf)
+        (memoria, base_memoria), (fluxo, base_fluxo) = (medir(c, args.modo, empresa) for c in ("memoria", "fluxo"))
+        iguais = memoria["resumo"] == fluxo["resumo"] and mesma_saida(base_memoria, base_fluxo)
+        for base in (base_memoria, base_fluxo):
+            shutil.rmtree(base, ignore_errors=True)
+        print(f"Conferência com {args.conferencia} notas: {'mesma saída' if iguais else 'SAÍDAS DIFERENTES'}")
+        if not iguais:
+            falhas.append("conferência")
+
+        print(f"Modo {args.modo} | lotes de {PN.LOTE_RELATORIO_EM_FLUXO} | PARSE_WORKERS=1 | "
+              f"pico Python (tracemalloc) e pico de RSS do processo")
+        picos = {}
+        for quantidade in (args.notas // 10, args.notas):
+            inicio = time.perf_counter()
+            empresa = gerar_empresa(os.path.join(raiz, str(quantidade)), quantidade, args.com_pdf)
+            print(f"{quantidade} notas geradas em {time.perf_counter() - inicio:.1f}s")
+            for caminho in ("memoria", "fluxo"):
+                r, base = medir(caminho, args.modo, empresa)
+                shutil.rmtree(base, ignore_errors=True)
+                picos[caminho, quantidade] = r["pico"]
+                print(f"  {caminho:8} {r['tempo']:7.1f}s | Python {mb(r['pico'])} | RSS {mb(r['rss'])} | "
+                      f"{r['resumo'][0] if r['resumo'] else 'sem relatório'}")
+            shutil.rmtree(empresa, ignore_errors=True)
+
+    crescimento = picos["fluxo", args.notas] / picos["fluxo", args.notas // 10]
+    print(f"Pico do fluxo com 10x mais notas: {crescimento:.2f}x "
+          f"(em memória: {picos['memoria', args.notas] / picos['memoria', args.notas // 10]:.2f}x)")
+    print("Resultado:", "OK" if not falhas else "a conferência falhou")
+    return 1 if falhas else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+Validação e benchmark da atualização só da situação contra o portal simulado
+(mock_portal.py): baixa a competência de uma empresa como o aplicativo faz,
+cancela algumas notas no portal e roda atualizar_situacoes_da_empresa.
+
+Confere que nenhuma nota foi baixada de novo, que só os pares XML/PDF das
+notas canceladas foram para Canceladas e que o relatório mostra a situação
+nova; compara o tempo com o do download completo. Requer Chrome/chromedriver.
+
+    python benchmarks/bench_situacao.py --notas 200 --canceladas 5 --latencia-pagina 0.3 --headless
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import Portal_Nacional as PN
+from mock_portal import PortalSimulado, gerar_notas_da_empresa
+from nfse_sintetica import EMPRESAS
+from bench_pipeline import rodar_empresa
+from openpyxl import load_workbook
+
+def pastas_por_situacao(pasta_base):
+    """{'Autorizadas'/'Canceladas': (XMLs, PDFs)} nas pastas das empresas."""
+    totais = {}
+    for root_dir, dirs, files in os.walk(pasta_base):
+        dirs[:] = [d for d in dirs if not d.startswith("_")]
+        for situacao in ("Autorizadas", "Canceladas"):
+            if f"{os.sep}{situacao}{os.sep}" in root_dir + os.sep:
+                xmls, pdfs = totais.get(situacao, (0, 0))
+                totais[situacao] = (xmls + sum(f.lower().endswith(".xml") for f in files),
+                                    pdfs + sum(f.lower().endswith(".pdf") for f in files))
+    return totais
+
+def canceladas_no_relatorio(pasta_base):
+    numeros = set()
+    for root_dir, dirs, files in os.walk(pasta_base):
+        dirs[:] = [d for d in dirs if not d.startswith("_")]
+        for f in files:
+            if f.lower().endswith(".xlsx"):
+                linhas = load_workbook(os.path.join(root_dir, f), read_only=True).active.iter_rows(values_only=True)
+                cabecalho = next(linhas)
+                numero, situacao = cabecalho.index("Número da Nota"), cabecalho.index("Situação")
+                numeros.update(str(linha[numero]) for linha in linhas if linha[situacao] == "Cancelada")
+    return numeros
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--notas", type=int, default=100, help="notas da empresa na competência")
+    ap.add_argument("--canceladas", type=int, default=5, help="notas canceladas no portal depois do download")
+    ap.add_argument("--competencia", default="11/2025")
+    ap.add_argument("--modo", choices=("prestados", "tomados"), default="prestados")
+    ap.add_argument("--por-pagina", type=int, default=15)
+    ap.add_argument("--latencia-pagina", type=float, default=0.0, help="segundos por página/redirect")
+    ap.add_argument("--latencia-download", type=float, default=0.0, help="segundos por arquivo")
+    ap.add_argument("--headless", action="store_true")
+    ap.add_argument("--verbose", action="store_true", help="mostra o log do aplicativo")
+    args = ap.parse_args()
+
+    mes, ano = (int(p) for p in args.competencia.split("/"))
+    cnpj, nome = EMPRESAS[0]
+    notas = {args.modo: gerar_notas_da_empresa(args.notas, args.modo, cnpj, (ano, mes))}
+    for nota in notas[args.modo]:
+        nota["emit_cpf"] = nota["toma_cpf"] = False
+    data_da_lista = "dh_emi" if args.modo == "prestados" else "dh_proc"
+    da_competencia = [n for n in notas[args.modo] if n[data_da_lista].strftime("%m/%Y") == args.competencia]
+    log_fn = print if args.verbose else (lambda msg: None)
+    falhas = []
+
+    def conferir(etapa, condicao):
+        print(f"  [{'ok' if condicao else 'FALHOU'}] {etapa}")
+        if not condicao:
+            falhas.append(etapa)
+
+    with PortalSimulado(notas, args.por_pagina, args.latencia_pagina, args.latencia_download) as portal, \
+            tempfile.TemporaryDirectory() as pasta_base:
+        PN.MODO = args.modo
+        PN.URL_PORTAL = portal.url
+        PN.URL_LISTA = {'prestados': portal.url + "/Notas/Emitidas", 'tomados': portal.url + "/Notas/Recebidas"}
+        PN.PASTA_DOWNLOADS = pasta_base
+        PN.SITUACOES_POR_ARQUIVO.clear()
+        PN.PDF_POR_ARQUIVO.clear()
+        PN.carregar_notas_existentes(pasta_base, args.competencia, log_fn)
+
+        inicio = time.perf_counter()
+        baixadas = rodar_empresa(pasta_base, args.competencia, args.headless, log_fn)
+        t_download = time.perf_counter() - inicio
+        antes = pastas_por_situacao(pasta_base)
+        print(f"Download completo: {baixadas} notas em {t_download:.2f}s | {antes}")
+
+        alvo = [n for n in da_competencia if not n["cancelada"]][:args.canceladas]
+        for nota in alvo:
+            nota["cancelada"] = True
+        downloads = portal.downloads
+        PN.zerar_tempos()
+        PN.carregar_notas_existentes(pasta_base, args.competencia, log_fn)
+        driver = PN.criar_driver(headless=args.headless, pasta=os.path.join(pasta_base, PN.PASTA_ENTRADA))
+        try:
+            inicio = time.perf_counter()
+            PN.fazer_login(driver, {'cnpj': cnpj, 'senha': 'senha', 'nome': nome}, log_fn)
+            PN.aplicar_filtro_por_competencia(driver, args.competencia, log_fn)
+            r = PN.atualizar_situacoes_da_empresa(driver, pasta_base, args.competencia, cnpj, log_fn)
+            t_situacao = time.perf_counter() - inicio
+        finally:
+            driver.quit()
+        depois = pastas_por_situacao(pasta_base)
+        print(f"Só a situação: {r['lidas']} notas lidas, {r['canceladas']} movidas em {t_situacao:.2f}s "
+              f"({t_download / t_situacao:.1f}x mais rápido) | {depois}")
+
+        conferir("nenhum arquivo baixado de novo", portal.downloads == downloads)
+        conferir("só as notas canceladas depois foram movidas", r['canceladas'] == len(alvo))
+        xmls_a, pdfs_a = antes.get("Canceladas", (0, 0))
+        conferir("XML e DANFSe juntos em Canceladas",
+                 depois.get("Canceladas") == (xmls_a + len(alvo), pdfs_a + len(alvo)))
+        esperadas = {str(n["numero"]) for n in da_competencia if n["cancelada"]}
+        conferir("relatório com a situação nova", canceladas_no_relatorio(pasta_base) == esperadas)
+
+    PN.resumo_tempos(print)
+    print("Resultado:", "OK" if not falhas else f"{len(falhas)} verificação(ões) falharam")
+    return 1 if falhas else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
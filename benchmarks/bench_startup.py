@@ -0,0 +1,128 @@
+"""
+Benchmark da abertura do aplicativo: custo de importação de cada dependência
+pesada, de `import Portal_Nacional` e o tempo até a primeira janela.
+
+Cada medida roda num processo Python novo (sem nada importado antes), repetida
+`--repeticoes` vezes; mostra a mediana. Confere que nenhum módulo pesado é
+importado junto com Portal_Nacional: eles só devem entrar quando um download,
+um relatório ou a leitura de PDFs começa. A primeira janela é medida do início
+do processo até o primeiro `update()` da NFSeDownloaderApp e só roda com
+display (no Linux, DISPLAY definido).
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --repeticoes 10 --importtime
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+MODULOS = ["customtkinter", "selenium.webdriver.chrome.webdriver", "requests", "pandas", "openpyxl", "pdfplumber",
+           "pyarrow.parquet", "velopack"]
+PESADOS = ["selenium", "requests", "pandas", "openpyxl", "pdfplumber", "pyarrow", "velopack"]
+
+MEDIR_IMPORTACAO = """
+import sys, time, json, importlib
+inicio = time.perf_counter()
+try:
+    importlib.import_module(sys.argv[1])
+    erro = None
+except Exception as e:
+    erro = f"{type(e).__name__}: {e}"
+print(json.dumps({"tempo": time.perf_counter() - inicio, "erro": erro, "modulos": sorted(sys.modules)}))
+"""
+
+PRIMEIRA_JANELA = """
+import sys, time, json
+import Portal_Nacional as PN
+root = PN.ctk.CTk()
+app = PN.NFSeDownloaderApp(root)
+root.update()
+print(json.dumps({"fim": time.time()}))
+root.destroy()
+"""
+
+def importar(modulo):
+    """Importa `modulo` num processo novo; devolve (segundos, erro, módulos carregados)."""
+    saida = subprocess.run([sys.executable, "-c", MEDIR_IMPORTACAO, modulo], capture_output=True, text=True,
+                           cwd=RAIZ)
+    r = json.loads(saida.stdout.strip().splitlines()[-1])
+    return r["tempo"], r["erro"], r["modulos"]
+
+def primeira_janela():
+    """Segundos do início do processo até a janela pintada (inclui o arranque do Python)."""
+    inicio = time.time()
+    saida = subprocess.run([sys.executable, "-c", PRIMEIRA_JANELA], capture_output=True, text=True, cwd=RAIZ)
+    if saida.returncode != 0:
+        raise RuntimeError(saida.stderr.strip().splitlines()[-1] if saida.stderr.strip() else "falhou")
+    return json.loads(saida.stdout.strip().splitlines()[-1])["fim"] - inicio
+
+def importtime():
+    """As 15 importações mais caras de Portal_Nacional segundo -X importtime (cumulativo, em ms)."""
+    saida = subprocess.run([sys.executable, "-X", "importtime", "-c", "import Portal_Nacional"],
+                           capture_output=True, text=True, cwd=RAIZ)
+    linhas = []
+    for linha in saida.stderr.splitlines():
+        partes = linha.split("|")
+        if len(partes) == 3 and partes[1].strip().isdigit():
+            linhas.append((int(partes[1]) / 1000, partes[2].rstrip()))
+    return sorted(linhas, reverse=True)[:15]
+
+def mediana(funcao, repeticoes):
+    return statistics.median(funcao() for _ in range(repeticoes))
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--repeticoes", type=int, default=5)
+    ap.add_argument("--importtime", action="store_true", help="mostra as importações mais caras de Portal_Nacional")
+    args = ap.parse_args()
+    falhas = []
+
+    print(f"Importação em processo novo (mediana de {args.repeticoes})")
+    for modulo in MODULOS:
+        tempos = []
+        for _ in range(args.repeticoes):
+            tempo, erro, _ = importar(modulo)
+            if erro:
+                break
+            tempos.append(tempo)
+        medida = f"{statistics.median(tempos) * 1000:8.0f} ms" if not erro else f"indisponível ({erro})"
+        print(f"  {modulo:36} {medida}")
+
+    tempos, carregados = [], []
+    for _ in range(args.repeticoes):
+        tempo, erro, carregados = importar("Portal_Nacional")
+        if erro:
+            print(f"  {'Portal_Nacional':36} falhou ({erro})")
+            return 1
+        tempos.append(tempo)
+    print(f"  {'Portal_Nacional':36} {statistics.median(tempos) * 1000:8.0f} ms")
+    antecipados = [m for m in PESADOS if m in carregados]
+    print("Módulos pesados importados junto com Portal_Nacional:", ", ".join(antecipados) or "nenhum")
+    if antecipados:
+        falhas.append("importação sob demanda")
+
+    if sys.platform.startswith("linux") and not os.environ.get("DISPLAY"):
+        print("Primeira janela: sem display, medida pulada")
+    else:
+        try:
+            print(f"Primeira janela: {mediana(primeira_janela, args.repeticoes):.2f}s desde o início do processo")
+        except RuntimeError as e:
+            print(f"Primeira janela: não abriu ({e})")
+            falhas.append("primeira janela")
+
+    if args.importtime:
+        print("Importações mais caras de Portal_Nacional (-X importtime, cumulativo):")
+        for ms, nome in importtime():
+            print(f"  {ms:8.1f} ms {nome}")
+
+    print("Resultado:", "OK" if not falhas else f"falhou: {', '.join(falhas)}")
+    return 1 if falhas else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""
+Servidor local que imita a distribuição por NSU do ADN (adn.nfse.gov.br) o
+suficiente para exercitar o backend "nsu" do aplicativo:
+
+- /contribuintes/DFe/<nsu>?cnpjConsulta=<cnpj>&lote=true devolve, em JSON, o
+  próximo lote (até `por_lote` documentos com NSU maior que <nsu>) com cada XML
+  compactado em gzip e codificado em base64 (ArquivoXml); sem documentos novos
+  responde 404 com StatusProcessamento NENHUM_DOCUMENTO_LOCALIZADO;
+- /danfse/<chave> devolve o DANFSe sintético da nota.
+
+Cada documento vai para o emitente e para o tomador (quem aparece no XML), com
+uma sequência de NSU por CNPJ. Os cancelamentos entram como eventos (e101101)
+depois das notas. publicar() acrescenta documentos com o servidor no ar, para
+simular notas novas entre duas execuções, e falhar_na_requisicao derruba uma
+consulta com HTTP 500 para simular uma execução interrompida.
+
+    python benchmarks/mock_adn.py --notas 300 --porta 8766
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import base64
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from nfse_sintetica import gerar_xml, gerar_pdf, gerar_evento_cancelamento, EMPRESAS
+from mock_portal import ManipuladorPortal, gerar_notas_da_empresa
+
+BASE = "/contribuintes"
+
+def compactar(xml):
+    return base64.b64encode(gzip.compress(xml.encode("utf-8"))).decode("ascii")
+
+def destinatarios(nota):
+    """CNPJ/CPF de emitente e tomador como aparecem no XML (quem recebe o documento)."""
+    emit = nota["emit"][0][:11] if nota["emit_cpf"] else nota["emit"][0]
+    toma = nota["toma"][0][:11] if nota["toma_cpf"] else nota["toma"][0]
+    return list(dict.fromkeys((emit, toma)))
+
+def gerar_notas_adn(quantidade, cnpj, competencia=(2025, 11), fracao_cancelada=0.1, meses_anteriores=1, semente=42):
+    """Notas emitidas e recebidas pela empresa, em ordem de processamento (como o ADN as numera)."""
+    emitidas = gerar_notas_da_empresa(quantidade, "prestados", cnpj, competencia, fracao_cancelada, meses_anteriores,
+                                      semente)
+    recebidas = gerar_notas_da_empresa(quantidade, "tomados", cnpj, competencia, fracao_cancelada, meses_anteriores,
+                                       semente + 1)
+    # O emitente das recebidas é sorteado e pode sair a própria empresa, com números que colidem com as emitidas
+    notas = emitidas + [n for n in recebidas if n["emit"][0] != cnpj]
+    notas.sort(key=lambda n: n["dh_proc"])
+    return notas
+
+class ADNSimulado:
+    """ADN em thread própria, com os documentos de `notas` (formato de nfse_sintetica.gerar_nota)."""
+    def __init__(self, notas=(), por_lote=50, latencia=0.0, porta=0):
+        self.por_lote = por_lote
+        self.latencia = latencia
+        self.documentos = {}   # cnpj -> [documento], NSU = posição + 1
+        self.por_chave = {}
+        self.requisicoes = 0
+        self.danfses = 0
+        self.falhar_na_requisicao = None
+        self._lock = threading.Lock()
+        self.publicar(notas)
+        adn = self
+
+        class Handler(ManipuladorADN):
+            pass
+        Handler.adn = adn
+        self.servidor = ThreadingHTTPServer(("127.0.0.1", porta), Handler)
+        self.servidor.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, porta = self.servidor.server_address[:2]
+        return f"http://{host}:{porta}"
+
+    def publicar(self, notas, cancelamentos=None):
+        """
+        Acrescenta as notas e, depois delas, os eventos de cancelamento das
+        canceladas (ou das notas em `cancelamentos`, já publicadas ou não).
+        """
+        notas = list(notas)
+        with self._lock:
+            for nota in notas:
+                self.por_chave[nota["chave"]] = nota
+                documento = {"TipoDocumento": "NFSE", "ChaveAcesso": nota["chave"],
+                             "DataHoraGeracao": f"{nota['dh_proc']:%Y-%m-%dT%H:%M:%S}", "ArquivoXml": compactar(gerar_xml(nota))}
+                for destino in destinatarios(nota):
+                    self.documentos.setdefault(destino, []).append(documento)
+            canceladas = cancelamentos if cancelamentos is not None else [n for n in notas if n["cancelada"]]
+            for nota in canceladas:
+                nota["cancelada"] = True
+                documento = {"TipoDocumento": "EVENTO", "ChaveAcesso": nota["chave"],
+                             "DataHoraGeracao": f"{nota['dh_proc']:%Y-%m-%dT%H:%M:%S}",
+                             "ArquivoXml": compactar(gerar_evento_cancelamento(nota))}
+                for destino in destinatarios(nota):
+                    self.documentos.setdefault(destino, []).append(documento)
+
+    def lote(self, cnpj, nsu):
+        with self._lock:
+            docs = self.documentos.get(cnpj, [])
+            return [dict(doc, NSU=i) for i, doc in enumerate(docs[nsu:nsu + self.por_lote], nsu + 1)]
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self.servidor.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def parar(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.parar()
+
+class ManipuladorADN(ManipuladorPortal):
+    adn = None
+
+    def _json(self, corpo, status=200):
+        self._responder(json.dumps(corpo), "application/json", status)
+
+    def do_GET(self):
+        partes = urlsplit(self.path)
+        caminho = partes.path.rstrip("/")
+        params = {k: v[0] for k, v in parse_qs(partes.query).items()}
+        time.sleep(self.adn.latencia)
+
+        if caminho.startswith("/danfse/"):
+            nota = self.adn.por_chave.get(caminho.rsplit("/", 1)[-1])
+            if not nota:
+                return self._json({"Erros": [{"Codigo": "E404", "Descricao": "NFS-e não encontrada"}]}, 404)
+            with self.adn._lock:
+                self.adn.danfses += 1
+            return self._responder(gerar_pdf(nota), "application/pdf")
+
+        if not caminho.startswith(BASE + "/DFe/"):
+            return self._json({"Erros": [{"Codigo": "E404", "Descricao": "recurso inexistente"}]}, 404)
+        with self.adn._lock:
+            self.adn.requisicoes += 1
+            falhar = self.adn.requisicoes == self.adn.falhar_na_requisicao
+        if falhar:
+            return self._json({"Erros": [{"Codigo": "E500", "Descricao": "erro interno"}]}, 500)
+        try:
+            nsu = int(caminho.rsplit("/", 1)[-1])
+        except ValueError:
+            return self._json({"StatusProcessamento": "REJEICAO",
+                               "Erros": [{"Codigo": "E1", "Descricao": "NSU inválido"}]}, 400)
+        cnpj = params.get("cnpjConsulta", "")
+        lote = self.adn.lote(cnpj, nsu)
+        if not lote:
+            return self._json({"StatusProcessamento": "NENHUM_DOCUMENTO_LOCALIZADO", "LoteDFe": []}, 404)
+        self._json({"StatusProcessamento": "DOCUMENTOS_LOCALIZADOS", "LoteDFe": lote})
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--notas", type=int, default=300, help="notas emitidas e recebidas da competência por empresa")
+    ap.add_argument("--competencia", default="11/2025")
+    ap.add_argument("--por-lote", type=int, default=50)
+    ap.add_argument("--latencia", type=float, default=0.0)
+    ap.add_argument("--porta", type=int, default=8766)
+    args = ap.parse_args()
+
+    mes, ano = (int(p) for p in args.competencia.split("/"))
+    adn = ADNSimulado(gerar_notas_adn(args.notas, EMPRESAS[0][0], (ano, mes)), args.por_lote, args.latencia, args.porta)
+    print(f"ADN simulado em {adn.url}{BASE} (DANFSe em {adn.url}/danfse). Ctrl+C para sair.")
+    try:
+        adn.servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        adn.servidor.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""
+Servidor local que imita o Emissor Nacional (nfse.gov.br/EmissorNacional) o
+suficiente para exercitar o caminho real do Selenium:
+
+- /EmissorNacional/Login com os campos Inscricao/Senha (grava o cookie de sessão);
+- /EmissorNacional/Notas/Emitidas e /Notas/Recebidas com o formulário de filtro
+  (datainicio/datafim + botão Filtrar), a tabela com td-data/td-datahora,
+  td-numero e os ícones tb-gerada.svg/tb-cancelada.svg, e a paginação ?pg=
+  com os links "Próxima" e "Última" (li.disabled na última página) ou, com
+  `janela_paginacao`, só os números das páginas em volta da atual e a "Próxima";
+- /EmissorNacional/Notas/Download/NFSe/<chave> e /Download/DANFSe/<chave>,
+  que servem XML e DANFSe sintéticos (nfse_sintetica) como anexo.
+
+Sem o cookie de sessão as páginas redirecionam para o login e os downloads
+devolvem HTML, como o portal faz quando a sessão expira. A latência de cada
+resposta pode ser injetada para simular o portal real.
+
+    python benchmarks/mock_portal.py --notas 300 --porta 8765
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import datetime
+import threading
+from html import escape
+from urllib.parse import urlsplit, parse_qs, urlencode
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from nfse_sintetica import gerar_nota, gerar_xml, gerar_pdf, EMPRESAS
+
+BASE = "/EmissorNacional"
+COOKIE_SESSAO = "ASP.NET_SessionId"
+SECOES = {"Emitidas": "prestados", "Recebidas": "tomados"}
+
+# Em Tomados o portal só monta os links do menu da linha depois do clique
+JS_MENU_DINAMICO = """
+document.addEventListener('click', function (ev) {
+    var gatilho = ev.target.closest('[data-chave]');
+    if (!gatilho) return;
+    var ul = gatilho.parentNode.querySelector('ul');
+    if (ul.children.length) return;
+    var chave = gatilho.getAttribute('data-chave');
+    ul.innerHTML = '<li><a href="%(base)s/Notas/Download/NFSe/' + chave + '">Download XML</a></li>' +
+                   '<li><a href="%(base)s/Notas/Download/DANFSe/' + chave + '">Download DANFSe</a></li>';
+});
+""" % {"base": BASE}
+
+def gerar_notas_da_empresa(quantidade, modo, cnpj, competencia=(2025, 11), fracao_cancelada=0.1,
+                           meses_anteriores=1, semente=42):
+    """
+    Notas de uma empresa, da mais recente para a mais antiga: `quantidade` na
+    competência e mais algumas em cada um dos `meses_anteriores` meses.
+    """
+    rnd = random.Random(semente)
+    ano, mes = competencia
+    notas = []
+    numero = 1
+    for atraso in range(meses_anteriores, -1, -1):
+        a, m = (ano, mes - atraso) if mes > atraso else (ano - 1, mes - atraso + 12)
+        total = quantidade if atraso == 0 else max(1, quantidade // 10)
+        for _ in range(total):
+            kwargs = {"cnpj_emit": cnpj} if modo == "prestados" else {"cnpj_toma": cnpj}
+            notas.append(gerar_nota(numero, (a, m), cancelada=rnd.random() < fracao_cancelada, rnd=rnd, **kwargs))
+            numero += 1
+    chave_data = "dh_emi" if modo == "prestados" else "dh_proc"
+    notas.sort(key=lambda n: n[chave_data], reverse=True)
+    return notas
+
+class PortalSimulado:
+    """
+    Portal em thread própria. `notas` é {'prestados': [...], 'tomados': [...]}
+    no formato de nfse_sintetica.gerar_nota.
+    """
+    def __init__(self, notas, por_pagina=15, latencia_pagina=0.0, latencia_download=0.0, porta=0,
+                 menu_dinamico_tomados=True, janela_paginacao=None):
+        self.notas = notas
+        self.por_pagina = por_pagina
+        self.janela_paginacao = janela_paginacao
+        self.latencia_pagina = latencia_pagina
+        self.latencia_download = latencia_download
+        self.menu_dinamico_tomados = menu_dinamico_tomados
+        self.por_chave = {n["chave"]: n for lista in notas.values() for n in lista}
+        self.sessoes = set()
+        self.downloads = 0
+        self._lock = threading.Lock()
+        self._arquivos = {}
+        portal = self
+
+        class Handler(ManipuladorPortal):
+            pass
+        Handler.portal = portal
+        self.servidor = ThreadingHTTPServer(("127.0.0.1", porta), Handler)
+        self.servidor.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, porta = self.servidor.server_address[:2]
+        return f"http://{host}:{porta}{BASE}"
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self.servidor.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def parar(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.parar()
+
+    def arquivo(self, chave, tipo):
+        """XML/PDF gerado uma única vez por nota (o custo de geração não entra na latência)."""
+        with self._lock:
+            if (chave, tipo) not in self._arquivos:
+                nota = self.por_chave[chave]
+                self._arquivos[(chave, tipo)] = gerar_xml(nota).encode("utf-8") if tipo == "xml" else gerar_pdf(nota)
+            self.downloads += 1
+            return self._arquivos[(chave, tipo)]
+
+class ManipuladorPortal(BaseHTTPRequestHandler):
+    portal = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    # ------------------------------------------------------------------ util
+    def _sessao_valida(self):
+        for parte in self.headers.get("Cookie", "").split(";"):
+            nome, _, valor = parte.strip().partition("=")
+            if nome == COOKIE_SESSAO and valor in self.portal.sessoes:
+                return True
+        return False
+
+    def _responder(self, corpo, tipo="text/html; charset=utf-8", status=200, cabecalhos=None):
+        if isinstance(corpo, str):
+            corpo = corpo.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(corpo)))
+        for nome, valor in (cabecalhos or {}).items():
+            self.send_header(nome, valor)
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def _redirecionar(self, destino, cabecalhos=None):
+        self._responder("", status=302, cabecalhos=dict(cabecalhos or {}, Location=destino))
+
+    # ---------------------------------------------------------------- rotas
+    def do_GET(self):
+        partes = urlsplit(self.path)
+        caminho = partes.path.rstrip("/")
+        params = {k: v[0] for k, v in parse_qs(partes.query).items()}
+
+        if caminho in (BASE + "/Login", BASE + "/Login/Entrar"):
+            return self._responder(pagina_login())
+        if caminho.startswith(BASE + "/Notas/Download/"):
+            time.sleep(self.portal.latencia_download)
+            return self._download(caminho)
+
+        time.sleep(self.portal.latencia_pagina)
+        if not self._sessao_valida():
+            return self._redirecionar(BASE + "/Login")
+        if caminho in (BASE, BASE + "/Dashboard"):
+            return self._responder(pagina_inicial())
+        secao = caminho.rsplit("/", 1)[-1]
+        if caminho.startswith(BASE + "/Notas/") and secao in SECOES:
+            return self._responder(self._pagina_lista(secao, params))
+        self._responder("<h1>404</h1>", status=404)
+
+    def do_POST(self):
+        tamanho = int(self.headers.get("Content-Length") or 0)
+        campos = {k: v[0] for k, v in parse_qs(self.rfile.read(tamanho).decode("utf-8")).items()}
+        if urlsplit(self.path).path.rstrip("/") != BASE + "/Login":
+            return self._responder("<h1>404</h1>", status=404)
+        if not campos.get("Inscricao") or not campos.get("Senha"):
+            return self._responder(pagina_login("Informe CPF/CNPJ e senha."))
+        sessao = os.urandom(12).hex()
+        self.portal.sessoes.add(sessao)
+        self._redirecionar(BASE + "/Dashboard", {"Set-Cookie": f"{COOKIE_SESSAO}={sessao}; Path=/; HttpOnly"})
+
+    def _download(self, caminho):
+        tipo = "xml" if "/Download/NFSe/" in caminho else "pdf"
+        chave = caminho.rsplit("/", 1)[-1]
+        if not self._sessao_valida():
+            return self._responder(pagina_login("Sessão expirada."))
+        if chave not in self.portal.por_chave:
+            return self._responder("<h1>404</h1>", status=404)
+        corpo = self.portal.arquivo(chave, tipo)
+        nome = f"{chave}.xml" if tipo == "xml" else f"DANFSe_{chave}.pdf"
+        mime = "application/xml" if tipo == "xml" else "application/pdf"
+        self._responder(corpo, mime, cabecalhos={"Content-Disposition": f'attachment; filename="{nome}"'})
+
+    def _pagina_lista(self, secao, params):
+        modo = SECOES[secao]
+        notas = self.portal.notas.get(modo, [])
+        chave_data = "dh_emi" if modo == "prestados" else "dh_proc"
+        inicio = _data_br(params.get("datainicio"))
+        fim = _data_br(params.get("datafim"))
+        if inicio:
+            notas = [n for n in notas if n[chave_data].date() >= inicio]
+        if fim:
+            notas = [n for n in notas if n[chave_data].date() <= fim]
+
+        por_pagina = self.portal.por_pagina
+        paginas = max(1, -(-len(notas) // por_pagina))
+        pg = min(max(1, int(params.get("pg") or 1)), paginas)
+        filtro = {k: params[k] for k in ("datainicio", "datafim") if params.get(k)}
+        dinamico = modo == "tomados" and self.portal.menu_dinamico_tomados
+        linhas = "".join(linha_tabela(n, modo, dinamico) for n in notas[(pg - 1) * por_pagina:pg * por_pagina])
+        if not linhas:
+            linhas = '<tr class="sem-registros"><th colspan="6">Nenhum registro encontrado</th></tr>'
+
+        def link(numero):
+            return f"{BASE}/Notas/{secao}?" + urlencode(dict(pg=numero, **filtro))
+        anterior = f'<li class="{"disabled" if pg == 1 else ""}"><a href="{escape(link(max(1, pg - 1)))}" data-original-title="Anterior">&laquo;</a></li>'
+        proxima = f'<li class="{"disabled" if pg == paginas else ""}"><a href="{escape(link(min(paginas, pg + 1)))}" data-original-title="Próxima">&raquo;</a></li>'
+        ultima = f'<li class="{"disabled" if pg == paginas else ""}"><a href="{escape(link(paginas))}" data-original-title="Última">&raquo;&raquo;</a></li>'
+        janela = self.portal.janela_paginacao
+        if janela:
+            numeros = range(max(1, pg - janela), min(paginas, pg + janela) + 1)
+            ultima = "".join(f'<li><a href="{escape(link(n))}">{n}</a></li>' for n in numeros if n != pg)
+
+        return f"""<!DOCTYPE html><html><head><meta charset="utf-8"><title>NFS-e {secao}</title></head><body>
+<h2>Notas {secao}</h2>
+<form method="get" action="{BASE}/Notas/{secao}">
+  <input type="text" id="datainicio" name="datainicio" value="{escape(params.get('datainicio', ''))}">
+  <input type="text" id="datafim" name="datafim" value="{escape(params.get('datafim', ''))}">
+  <button type="submit" class="btn btn-primary">Filtrar</button>
+</form>
+<table class="table table-striped"><thead><tr><th>Emissão</th><th>Número</th><th>Contribuinte</th><th>Valor</th>
+<th>Situação</th><th></th></tr></thead><tbody>{linhas}</tbody></table>
+<ul class="pagination">{anterior}<li class="active"><span>{pg} de {paginas}</span></li>{proxima}{ultima}</ul>
+<script>{JS_MENU_DINAMICO if dinamico else ""}</script>
+</body></html>"""
+
+def _data_br(texto):
+    try:
+        return datetime.datetime.strptime((texto or "").strip(), "%d/%m/%Y").date()
+    except ValueError:
+        return None
+
+def linha_tabela(nota, modo, menu_dinamico=False):
+    if modo == "prestados":
+        data = f'<td class="td-data">{nota["dh_emi"]:%d/%m/%y}</td>'
+        contraparte = nota["toma"][1]
+    else:
+        data = f'<td class="td-datahora">{nota["dh_proc"]:%d/%m/%Y %H:%M:%S}</td>'
+        contraparte = nota["emit"][1]
+    icone = "tb-cancelada.svg" if nota["cancelada"] else "tb-gerada.svg"
+    chave = nota["chave"]
+    if menu_dinamico:
+        menu = (f'<a href="#" class="icone-trigger" data-chave="{chave}" onclick="return false;">'
+                f'<i class="glyphicon glyphicon-option-vertical"></i></a><ul class="dropdown-menu"></ul>')
+    else:
+        menu = (f'<a href="#" class="icone-trigger" onclick="return false;"><i class="glyphicon glyphicon-option-vertical"></i></a>'
+                f'<ul class="dropdown-menu"><li><a href="{BASE}/Notas/Download/NFSe/{chave}">Download XML</a></li>'
+                f'<li><a href="{BASE}/Notas/Download/DANFSe/{chave}">Download DANFSe</a></li></ul>')
+    return (f'<tr>{data}<td class="td-numero">{nota["numero"]}</td><td>{escape(contraparte)}</td>'
+            f'<td class="td-valor">{nota["v_serv"]:.2f}</td>'
+            f'<td class="td-situacao"><img src="{BASE}/img/{icone}"></td>'
+            f'<td class="td-opcoes"><div class="dropdown">{menu}</div></td></tr>')
+
+def pagina_login(erro=""):
+    return f"""<!DOCTYPE html><html><head><meta charset="utf-8"><title>Login</title></head><body>
+<form method="post" action="{BASE}/Login">
+  <input type="text" id="Inscricao" name="Inscricao">
+  <input type="password" id="Senha" name="Senha">
+  <button type="submit">Entrar</button>
+</form><p class="erro">{escape(erro)}</p></body></html>"""
+
+def pagina_inicial():
+    return f"""<!DOCTYPE html><html><head><meta charset="utf-8"><title>Emissor Nacional</title></head><body>
+<a href="{BASE}/Notas/Emitidas">Notas Emitidas</a> <a href="{BASE}/Notas/Recebidas">Notas Recebidas</a>
+</body></html>"""
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--notas", type=int, default=300, help="notas da competência por modo")
+    ap.add_argument("--competencia", default="11/2025")
+    ap.add_argument("--cnpj", default=EMPRESAS[0][0])
+    ap.add_argument("--por-pagina", type=int, default=15)
+    ap.add_argument("--latencia-pagina", type=float, default=0.0)
+    ap.add_argument("--latencia-download", type=float, default=0.0)
+    ap.add_argument("--porta", type=int, default=8765)
+    ap.add_argument("--janela-paginacao", type=int, help="mostra só N páginas em volta da atual, sem a \"Última\"")
+    args = ap.parse_args()
+
+    mes, ano = (int(p) for p in args.competencia.split("/"))
+    notas = {modo: gerar_notas_da_empresa(args.notas, modo, args.cnpj, (ano, mes)) for modo in SECOES.values()}
+    portal = PortalSimulado(notas, args.por_pagina, args.latencia_pagina, args.latencia_download, args.porta,
+                            janela_paginacao=args.janela_paginacao)
+    print(f"Portal simulado em {portal.url}/Login (qualquer CPF/CNPJ e senha). Ctrl+C para sair.")
+    try:
+        portal.servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        portal.servidor.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Gerador de NFS-e sintéticas no leiaute do Portal Nacional (XML, DANFSe em PDF
+e evento de cancelamento), usado pelos benchmarks e pelos servidores de teste
+locais.
+"""
+import os
+import random
+import datetime
+from xml.sax.saxutils import escape
+
+NS = "http://www.sped.fazenda.gov.br/nfse"
+
+EMPRESAS = [
+    ("11222333000181", "ALFA SERVICOS DE CONTABILIDADE LTDA"),
+    ("22333444000172", "BETA TECNOLOGIA E SISTEMAS S/A"),
+    ("33444555000163", "GAMA ENGENHARIA & CONSULTORIA LTDA"),
+    ("44555666000154", "DELTA MANUTENCAO PREDIAL EIRELI"),
+]
+DESCRICOES = [
+    "Serviços de consultoria contábil referentes à competência",
+    "Licenciamento de software e suporte técnico",
+    "Manutenção preventiva de equipamentos <ar-condicionado>",
+    "Projeto executivo de engenharia civil",
+]
+SIMPLES = [
+    ("Optante-MicroempresaouEmpresadePequenoPorte(ME/EPP)", "RegimedeapuraçãodostributosfederaisemunicipalpeloSimplesNacional"),
+    ("Optante-MicroempreendedorIndividual(MEI)", "RegimedeapuraçãodostributosfederaisemunicipalpeloSimplesNacional"),
+    ("Nãooptante", "-"),
+]
+
+def chave_acesso(numero, cnpj, dt, rnd):
+    return f"4106902{2}{2}{cnpj:0>14}{numero:013d}{dt:%y%m}{rnd.randrange(10**9):09d}{rnd.randrange(10)}"
+
+def gerar_nota(numero, competencia=(2025, 11), cnpj_emit=None, cnpj_toma=None, cancelada=False, rnd=None):
+    """Dados de uma nota sintética (também usados para montar as linhas da tabela do portal)."""
+    rnd = rnd or random.Random(numero)
+    ano, mes = competencia
+    emit = next((e for e in EMPRESAS if e[0] == cnpj_emit), None) or rnd.choice(EMPRESAS)
+    toma = next((e for e in EMPRESAS if e[0] == cnpj_toma), None) or rnd.choice([e for e in EMPRESAS if e != emit])
+    dt = datetime.datetime(ano, mes, rnd.randint(1, 28), rnd.randint(7, 19), rnd.randint(0, 59), rnd.randint(0, 59))
+    v_serv = round(rnd.uniform(100, 50000), 2)
+    return {
+        'numero': numero,
+        'chave': chave_acesso(numero, emit[0], dt, rnd),
+        'dh_emi': dt,
+        'dh_proc': dt + datetime.timedelta(minutes=rnd.randint(1, 90)),
+        'emit': emit,
+        'toma': toma,
+        'toma_cpf': rnd.random() < 0.1,
+        'emit_cpf': rnd.random() < 0.05,
+        'descricao': rnd.choice(DESCRICOES),
+        'c_trib_nac': f"{rnd.randint(1, 40):02d}{rnd.randint(1, 9):02d}01",
+        'v_serv': v_serv,
+        'iss_retido': rnd.random() < 0.3,
+        'aliq_iss': rnd.choice([0.02, 0.03, 0.05]),
+        'tem_piscofins': rnd.random() < 0.6,
+        'ret_federal': rnd.random() < 0.4,
+        'simples': rnd.choice(SIMPLES),
+        'cancelada': cancelada,
+    }
+
+def _doc(tag_cnpj, doc):
+    return f"<{tag_cnpj}>{doc}</{tag_cnpj}>"
+
+def gerar_xml(nota):
+    n = nota
+    v_serv = n['v_serv']
+    v_iss = round(v_serv * n['aliq_iss'], 2)
+    irrf = round(v_serv * 0.015, 2) if n['ret_federal'] else 0.0
+    csll = round(v_serv * 0.01, 2) if n['ret_federal'] else 0.0
+    cp = round(v_serv * 0.11, 2) if n['ret_federal'] and n['numero'] % 3 == 0 else 0.0
+    pis = round(v_serv * 0.0065, 2)
+    cofins = round(v_serv * 0.03, 2)
+    total_ret = round(irrf + csll + cp + (v_iss if n['iss_retido'] else 0.0), 2)
+    emit_doc = _doc("CPF", n['emit'][0][:11]) if n['emit_cpf'] else _doc("CNPJ", n['emit'][0])
+    toma_doc = _doc("CPF", n['toma'][0][:11]) if n['toma_cpf'] else _doc("CNPJ", n['toma'][0])
+    piscofins = (f"<piscofins><CST>01</CST><vBCPisCofins>{v_serv:.2f}</vBCPisCofins><pAliqPis>0.65</pAliqPis>"
+                 f"<pAliqCofins>3.00</pAliqCofins><vPis>{pis:.2f}</vPis><vCofins>{cofins:.2f}</vCofins>"
+                 f"<tpRetPisCofins>2</tpRetPisCofins></piscofins>") if n['tem_piscofins'] else ""
+    federais = (f"<vRetCP>{cp:.2f}</vRetCP><vRetIRRF>{irrf:.2f}</vRetIRRF><vRetCSLL>{csll:.2f}</vRetCSLL>"
+                if n['ret_federal'] else "")
+    trib_fed = f"<tribFed>{piscofins}{federais}</tribFed>" if piscofins or federais else ""
+    endereco = ("<enderNac><xLgr>RUA DAS FLORES</xLgr><nro>123</nro><xBairro>CENTRO</xBairro>"
+                "<cMun>4106902</cMun><UF>PR</UF><CEP>80000000</CEP></enderNac>")
+    assinatura = ('<Signature xmlns="http://www.w3.org/2000/09/xmldsig#"><SignedInfo>'
+                  '<CanonicalizationMethod Algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315"/>'
+                  '<SignatureMethod Algorithm="http://www.w3.org/2000/09/xmldsig#rsa-sha1"/>'
+                  '<Reference URI=""><DigestValue>q1w2e3r4t5y6u7i8o9p0</DigestValue></Reference></SignedInfo>'
+                  '<SignatureValue>' + "A" * 344 + '</SignatureValue>'
+                  '<KeyInfo><X509Data><X509Certificate>' + "B" * 1200 + '</X509Certificate></X509Data></KeyInfo></Signature>')
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<NFSe versao="1.00" xmlns="{NS}"><infNFSe Id="NFS{n['chave']}">
+<xLocEmi>Curitiba</xLocEmi><xLocPrestacao>Curitiba</xLocPrestacao><nNFSe>{n['numero']}</nNFSe>
+<cLocIncid>4106902</cLocIncid><xLocIncid>Curitiba</xLocIncid><xTribNac>{escape(n['descricao'])}</xTribNac>
+<verAplic>SefinNac_Pre_1.4.0</verAplic><ambGer>2</ambGer><tpEmis>1</tpEmis><procEmi>1</procEmi><cStat>100</cStat>
+<dhProc>{n['dh_proc']:%Y-%m-%dT%H:%M:%S}-03:00</dhProc><nDFSe>{n['numero'] + 900000}</nDFSe>
+<emit>{emit_doc}<IM>123456</IM><xNome>{escape(n['emit'][1])}</xNome>{endereco}<fone>4133334444</fone><email>fiscal@exemplo.com.br</email></emit>
+<valores><vBC>{v_serv:.2f}</vBC><pAliqAplic>{n['aliq_iss'] * 100:.2f}</pAliqAplic><vISSQN>{v_iss:.2f}</vISSQN>
+<vTotalRet>{total_ret:.2f}</vTotalRet><vLiq>{v_serv - total_ret:.2f}</vLiq></valores>
+<DPS versao="1.00"><infDPS Id="DPS{n['chave'][:42]}"><tpAmb>1</tpAmb><dhEmi>{n['dh_emi']:%Y-%m-%dT%H:%M:%S}-03:00</dhEmi>
+<verAplic>EmissorWeb_1.4.0</verAplic><serie>900</serie><nDPS>{n['numero']}</nDPS><dCompet>{n['dh_emi']:%Y-%m-%d}</dCompet>
+<tpEmit>1</tpEmit><cLocEmi>4106902</cLocEmi>
+<prest>{emit_doc}<regTrib><opSimpNac>1</opSimpNac><regEspTrib>0</regEspTrib></regTrib></prest>
+<toma>{toma_doc}<xNome>{escape(n['toma'][1])}</xNome>{endereco}</toma>
+<serv><locPrest><cLocPrestacao>4106902</cLocPrestacao></locPrest><cServ><cTribNac>{n['c_trib_nac']}</cTribNac>
+<xDescServ>{escape(n['descricao'])} {n['dh_emi']:%m/%Y}</xDescServ><cNBS>115022000</cNBS></cServ></serv>
+<valores><vServPrest><vServ>{v_serv:.2f}</vServ></vServPrest><trib><tribMun><tribISSQN>1</tribISSQN>
+<tpRetISSQN>{2 if n['iss_retido'] else 1}</tpRetISSQN></tribMun>{trib_fed}<totTrib><indTotTrib>0</indTotTrib></totTrib></trib></valores>
+</infDPS>{assinatura}</DPS></infNFSe>{assinatura}</NFSe>
+"""
+
+def gerar_evento_cancelamento(nota):
+    """Evento de cancelamento (e101101) da nota, como o ADN distribui."""
+    n = nota
+    dh = n['dh_proc'] + datetime.timedelta(days=1)
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<evento versao="1.00" xmlns="{NS}"><infEvento Id="EVT{n['chave']}101101001">
+<verAplic>SefinNac_Pre_1.4.0</verAplic><ambGer>2</ambGer><nSeqEvento>1</nSeqEvento>
+<dhProc>{dh:%Y-%m-%dT%H:%M:%S}-03:00</dhProc><nDFSe>{n['numero'] + 900000}</nDFSe>
+<pedRegEvento versao="1.00"><infPedReg Id="PRE{n['chave']}101101001"><tpAmb>1</tpAmb>
+<verAplic>EmissorWeb_1.4.0</verAplic><dhEvento>{dh:%Y-%m-%dT%H:%M:%S}-03:00</dhEvento>
+<CNPJAutor>{n['emit'][0]}</CNPJAutor><chNFSe>{n['chave']}</chNFSe><nPedRegEvento>1</nPedRegEvento>
+<e101101><xDesc>Cancelamento de NFS-e</xDesc><cMotivo>1</cMotivo><xMotivo>Erro na emissão</xMotivo></e101101>
+</infPedReg></pedRegEvento></infEvento></evento>
+"""
+
+def _texto_pdf(texto):
+    return texto.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)").encode("cp1252")
+
+def gerar_pdf(nota):
+    """DANFSe mínimo (uma página, Helvetica) com o bloco do Simples Nacional."""
+    simples, regime = nota['simples']
+    linhas = [
+        (40, 800, 14, "DANFSe v1.0 - Documento Auxiliar da NFS-e"),
+        (40, 770, 9, f"Número da NFS-e {nota['numero']}"),
+        (40, 755, 9, f"Chave de Acesso {nota['chave']}"),
+        (40, 730, 10, "EMITENTE DA NFS-e"),
+        (40, 715, 9, f"{nota['emit'][1]}"),
+        (40, 700, 7, "SimplesNacionalnaDatadeCompetência RegimedeApuraçãoTributáriapeloSN"),
+        (40, 690, 7, f"{simples} {regime}"),
+        (40, 660, 10, "TOMADOR DO SERVIÇO"),
+        (40, 645, 9, f"{nota['toma'][1]}"),
+        (40, 600, 10, "VALOR TOTAL DA NFS-E"),
+        (40, 585, 9, f"R$ {nota['v_serv']:.2f}"),
+    ]
+    conteudo = b"".join(b"BT /F1 %d Tf %d %d Td (%s) Tj ET\n" % (tam, x, y, _texto_pdf(txt)) for x, y, tam, txt in linhas)
+    objetos = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        b"<< /Length %d >>\nstream\n" % len(conteudo) + conteudo + b"endstream",
+    ]
+    saida = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objetos, 1):
+        offsets.append(len(saida))
+        saida += b"%d 0 obj\n" % i + obj + b"\nendobj\n"
+    xref = len(saida)
+    saida += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objetos) + 1)
+    saida += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    saida += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objetos) + 1, xref)
+    return saida
+
+def gerar_corpus(pasta, quantidade, competencia=(2025, 11), com_pdf=False, semente=42):
+    """Grava `quantidade` XMLs (e DANFSe, se pedido) em `pasta`; retorna os caminhos dos XMLs."""
+    os.makedirs(pasta, exist_ok=True)
+    rnd = random.Random(semente)
+    caminhos = []
+    for i in range(1, quantidade + 1):
+        nota = gerar_nota(i, competencia, rnd=rnd)
+        caminho = os.path.join(pasta, f"{nota['chave']}.xml")
+        with open(caminho, "w", encoding="utf-8") as f:
+            f.write(gerar_xml(nota))
+        if com_pdf:
+            with open(os.path.join(pasta, f"NFSE N° {i}.pdf"), "wb") as f:
+                f.write(gerar_pdf(nota))
+        caminhos.append(caminho)
+    return caminhos